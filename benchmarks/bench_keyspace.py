@@ -0,0 +1,82 @@
+"""
+Benchmark for parsing keys in a yoda tree snapshot.
+
+Usage:
+
+    python benchmarks/bench_keyspace.py [NUMBER_OF_KEYS]
+
+Compares :meth:`yoda.keyspace.KeySpace.parse` with the per key prefix
+slicing and splitting it replaced.
+"""
+import sys
+import timeit
+from yoda.keyspace import KeySpace
+
+__author__ = 'sukrit'
+
+DEFAULT_KEYS = 100000
+
+
+def snapshot(size, etcd_base='/yoda'):
+    """
+    Generates keys for a yoda tree with roughly the given number of keys.
+
+    :rtype: list
+    """
+    keyspace = KeySpace(etcd_base)
+    keys = []
+    index = 0
+    while len(keys) < size:
+        upstream = 'app%d-v1-8080' % index
+        keys.append(keyspace.upstream_key(upstream, 'mode'))
+        for node in range(5):
+            node_name = 'node%d' % node
+            keys.append(keyspace.endpoint_key(upstream, node_name))
+            keys.append(keyspace.endpoints_meta_key(upstream, node_name,
+                                                    'version'))
+        hostname = 'app%d.example.com' % index
+        for field in ('path', 'upstream', 'force-ssl', 'acls/allowed/public'):
+            keys.append(keyspace.location_key(hostname, '-', field))
+        keys.append(keyspace.alias_key(hostname, 'www.' + hostname))
+        keys.append(keyspace.listener_key('listener%d' % index, 'bind'))
+        index += 1
+    return keys[:size]
+
+
+def split_parse(keys, etcd_base='/yoda'):
+    """
+    Extracts the same information as :meth:`KeySpace.parse` by slicing and
+    splitting every key with the prefix computed per call (as done
+    previously by each consumer).
+    """
+    etcd_base = etcd_base.rstrip('/')
+    for key in keys:
+        if not key.startswith(etcd_base + '/'):
+            continue
+        parts = key[len(etcd_base) + 1:].split('/')
+        if parts[0] in ('upstreams', 'hosts') and len(parts) >= 2:
+            (parts[0], parts[1], parts[3] if len(parts) > 3 else None,
+             '/'.join(parts[4:]) or None)
+        elif parts[:3] == ['global', 'listeners', 'tcp'] and len(parts) >= 4:
+            ('listener', parts[3], None, '/'.join(parts[4:]) or None)
+
+
+def keyspace_parse(keys, etcd_base='/yoda'):
+    parse = KeySpace(etcd_base).parse
+    for key in keys:
+        parse(key)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    size = int(argv[0]) if argv else DEFAULT_KEYS
+    keys = snapshot(size)
+    for name, func in (('split', split_parse),
+                       ('keyspace.parse', keyspace_parse)):
+        elapsed = min(timeit.repeat(lambda: func(keys), number=1, repeat=5))
+        sys.stdout.write('%-16s %8d keys %8.3fs %12.0f keys/s\n' % (
+            name, len(keys), elapsed, len(keys) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,15 @@ setup(
     author='Sukrit Khera',
     packages=['yoda'],
     install_requires=requirements,
+    extras_require={
+        # Incremental parsing for streaming reads (yoda.stream)
+        'stream': ['ijson'],
+    },
     zip_safe=True,
     test_suite='tests',
+    entry_points={
+        'console_scripts': ['yoda = yoda.cli:main'],
+    },
     classifiers=[
         'Development Status :: In development',
         'Environment :: Other Environment',
@@ -0,0 +1,108 @@
+"""
+Test for yoda.adaptive
+"""
+from nose.tools import eq_, ok_, raises
+from yoda.adaptive import AdaptiveTtlPolicy, TTL_NODE, TTL_PROXY_NODE, \
+    TTL_UPSTREAM
+
+__author__ = 'sukrit'
+
+
+def test_ttl_for_healthy_etcd():
+    """
+    Should use the lower bound while etcd is healthy.
+    """
+
+    # Given: Policy with fast writes
+    policy = AdaptiveTtlPolicy(bounds={TTL_NODE: (30, 300)},
+                               target_latency=0.1)
+    for _ in range(10):
+        policy.observe(0.01)
+
+    # Then: Lower bounds are used
+    eq_(policy.ttl(TTL_NODE), 30)
+    eq_(policy.ttl(TTL_PROXY_NODE), 150)
+    eq_(policy.ttl(TTL_UPSTREAM), 1800)
+
+
+def test_ttl_grows_with_latency_and_failures():
+    """
+    Should stretch ttl as writes slow down or fail, capped at upper bound.
+    """
+
+    # Given: Policy without smoothing
+    policy = AdaptiveTtlPolicy(bounds={TTL_NODE: (30, 300)},
+                               target_latency=0.1, smoothing=1,
+                               failure_weight=4)
+
+    # When: Writes slow down
+    policy.observe(0.3)
+
+    # Then: TTL grows with latency
+    eq_(policy.ttl(TTL_NODE), 90)
+
+    # When: Writes fail
+    policy.observe(0.3, failed=True)
+
+    # Then: TTL is capped at upper bound
+    eq_(policy.ttl(TTL_NODE), 300)
+
+
+def test_moving_averages():
+    """
+    Should smooth latency and failure rate.
+    """
+
+    # Given: Policy with smoothing
+    policy = AdaptiveTtlPolicy(smoothing=0.5)
+
+    # When: I record writes
+    policy.observe(0.1)
+    policy.observe(0.3, failed=True)
+
+    # Then: Moving averages are updated
+    ok_(abs(policy.latency - 0.2) < 1e-9)
+    eq_(policy.failure_rate, 0.5)
+    eq_(policy.observations, 2)
+
+
+def test_refresh_interval():
+    """
+    Should renew at least min_renewals times, reserving time for the
+    renewal.
+    """
+
+    # Given: Policy with slow writes
+    policy = AdaptiveTtlPolicy(min_renewals=3)
+    policy.observe(1.5)
+
+    # Then: Renewal time is reserved before splitting the ttl
+    eq_(policy.refresh_interval(60), 15.0)
+
+    # And: At most half of the ttl is reserved
+    eq_(policy.refresh_interval(12), 2.0)
+
+
+def test_to_dict():
+    """
+    Should expose chosen ttls and refresh intervals.
+    """
+
+    # Given: Policy for healthy etcd
+    policy = AdaptiveTtlPolicy()
+
+    # When: I get the values for the policy
+    values = policy.to_dict()
+
+    # Then: Chosen values are exposed
+    eq_(values['ttls'][TTL_NODE], 60)
+    eq_(values['refresh_intervals'][TTL_NODE], 20.0)
+    eq_(values['load_factor'], 1.0)
+
+
+@raises(ValueError)
+def test_invalid_bounds():
+    """
+    Should reject bounds with max ttl less than min ttl.
+    """
+    AdaptiveTtlPolicy(bounds={TTL_NODE: (60, 30)})
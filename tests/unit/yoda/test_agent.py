@@ -0,0 +1,242 @@
+"""
+Test for yoda.agent
+"""
+import socket
+import threading
+import time
+from unittest import SkipTest
+from mock import MagicMock
+from nose.tools import eq_, ok_
+from yoda.agent import Agent, HttpProbe, TcpProbe, _new_future
+from yoda.client import Client
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+__author__ = 'sukrit'
+
+
+def _new_loop():
+    if asyncio is None:  # pragma: no cover
+        raise SkipTest('asyncio is not available')
+    return asyncio.new_event_loop()
+
+
+def _run_until(loop, predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        loop.run_until_complete(asyncio.sleep(0.01))
+    return predicate()
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class _HttpServerProtocol(object):
+
+    def __init__(self, status):
+        self.status = status
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.transport.write(
+            ('HTTP/1.0 %d OK\r\n\r\n' % self.status).encode('ascii'))
+        self.transport.close()
+
+
+class MockProbe:
+
+    def __init__(self, results):
+        self.results = list(results)
+
+    def start(self, loop, timeout=None):
+        future = _new_future(loop)
+        future.set_result(self.results.pop(0) if self.results else False)
+        return future
+
+
+class TestProbes():
+
+    def setup(self):
+        self.loop = _new_loop()
+
+    def teardown(self):
+        self.loop.close()
+
+    def _probe(self, probe):
+        return self.loop.run_until_complete(probe.start(self.loop, 1))
+
+    def test_tcp_probe_for_listening_port(self):
+        """
+        Should pass tcp probe when port is listening.
+        """
+
+        # Given: Listening socket
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+
+        # When: I probe the port
+        try:
+            passed = self._probe(
+                TcpProbe.from_endpoint('127.0.0.1:%d' %
+                                       sock.getsockname()[1]))
+        finally:
+            sock.close()
+
+        # Then: Probe passes
+        eq_(passed, True)
+
+    def test_tcp_probe_for_closed_port(self):
+        """
+        Should fail tcp probe when port is not listening.
+        """
+
+        # When: I probe a closed port
+        passed = self._probe(TcpProbe('127.0.0.1', _free_port()))
+
+        # Then: Probe fails
+        eq_(passed, False)
+
+    def test_http_probe(self):
+        """
+        Should pass http probe only for expected status codes.
+        """
+
+        # Given: HTTP servers returning 200 and 503
+        results = []
+        for status in (200, 503):
+            server = self.loop.run_until_complete(self.loop.create_server(
+                lambda: _HttpServerProtocol(status), '127.0.0.1', 0))
+            port = server.sockets[0].getsockname()[1]
+
+            # When: I probe the server
+            results.append(self._probe(
+                HttpProbe('127.0.0.1', port, path='/health')))
+            server.close()
+
+        # Then: Probe passes only for 200
+        eq_(results, [True, False])
+
+    def test_http_probe_check(self):
+        """
+        Should validate HTTP status line.
+        """
+
+        # Given: HTTP probe
+        probe = HttpProbe('127.0.0.1', 8080)
+
+        # Then: Status lines are validated
+        eq_(probe.check(b'HTTP/1.1 204 No Content\r\n'), True)
+        eq_(probe.check(b'HTTP/1.1 500 Error\r\n'), False)
+        eq_(probe.check(b'SSH-2.0-OpenSSH\r\n'), False)
+        eq_(probe.check(b''), False)
+
+
+class TestAgent():
+
+    def setup(self):
+        self.client = MagicMock(spec=Client)
+        self.client.refresh_interval.return_value = 10
+        self.loop = _new_loop()
+        self.agent = Agent(self.client, interval=0.01, ttl=30,
+                           loop=self.loop)
+
+    def teardown(self):
+        self.loop.close()
+
+    def test_register_healthy_node(self):
+        """
+        Should register node once its probe passes.
+        """
+
+        # When: I add node with passing probe
+        self.agent.add('upstream1', 'node1', 'host1:8080',
+                       probe=MockProbe([False, True]), meta={'a': 'b'})
+
+        # Then: Node gets registered
+        ok_(_run_until(self.loop, lambda: self.client.discover_node.called))
+        self.client.discover_node.assert_called_once_with(
+            'upstream1', 'node1', 'host1:8080', ttl=30, meta={'a': 'b'})
+        eq_(self.client.remove_node.called, False)
+
+    def test_remove_node_on_failed_probe(self):
+        """
+        Should remove registered node as soon as its probe fails.
+        """
+
+        # When: I add node whose probe fails after passing
+        self.agent.add('upstream1', 'node1', 'host1:8080',
+                       probe=MockProbe([True, False]))
+
+        # Then: Node gets registered and removed
+        ok_(_run_until(self.loop, lambda: self.client.remove_node.called))
+        eq_(self.client.discover_node.call_count, 1)
+        self.client.remove_node.assert_called_once_with('upstream1', 'node1')
+
+    def test_remove_node_on_failures_while_pending(self):
+        """
+        Should count failed probes while etcd call for the node is pending.
+        """
+
+        # Given: Slow registration
+        registering = threading.Event()
+        self.client.discover_node.side_effect = \
+            lambda *args, **kwargs: registering.wait(2)
+        self.agent.failure_threshold = 3
+
+        # When: Probe fails repeatedly while node is being registered
+        self.agent.add('upstream1', 'node1', 'host1:8080',
+                       probe=MockProbe([True] + [False] * 100))
+        _run_until(self.loop, lambda: self.agent.targets)
+        ok_(_run_until(self.loop, lambda: (
+            self.agent.targets['upstream1', 'node1'].failures >= 3)))
+        eq_(self.client.remove_node.called, False)
+        registering.set()
+
+        # Then: Node gets removed once registration completes
+        ok_(_run_until(self.loop, lambda: self.client.remove_node.called))
+        eq_(self.client.discover_node.call_count, 1)
+        self.client.remove_node.assert_called_once_with('upstream1', 'node1')
+
+    def test_refresh_registered_node(self):
+        """
+        Should refresh registered node only after refresh interval.
+        """
+
+        # Given: Small refresh interval
+        self.client.refresh_interval.return_value = 0
+
+        # When: I add node with passing probe
+        self.agent.add('upstream1', 'node1', 'host1:8080',
+                       probe=MockProbe([True] * 100))
+
+        # Then: Node gets refreshed
+        ok_(_run_until(self.loop,
+                       lambda: self.client.discover_node.call_count > 1))
+
+    def test_remove(self):
+        """
+        Should stop managing and deregister node.
+        """
+
+        # Given: Registered node
+        self.agent.add('upstream1', 'node1', 'host1:8080',
+                       probe=MockProbe([True] * 100))
+        _run_until(self.loop, lambda: self.client.discover_node.called)
+
+        # When: I remove the node
+        self.agent.remove('upstream1', 'node1')
+
+        # Then: Node is removed
+        ok_(_run_until(self.loop, lambda: self.client.remove_node.called))
+        eq_(self.agent.targets, {})
@@ -0,0 +1,183 @@
+"""
+Test for yoda.bulk
+"""
+import json
+import threading
+from mock import MagicMock
+from nose.tools import eq_, ok_, raises
+from yoda.bulk import BulkProcessor, parse_operation
+from yoda.client import Client
+from yoda.model import Host, Location
+
+try:
+    from StringIO import StringIO
+except ImportError:  # pragma: no cover
+    from io import StringIO
+
+__author__ = 'sukrit'
+
+
+def test_parse_operation():
+    """
+    Should parse NDJSON operation.
+    """
+
+    # When: I parse wire_proxy operation
+    op_id, op, key, params = parse_operation(json.dumps({
+        'id': 'op1',
+        'op': 'wire_proxy',
+        'host': {
+            'hostname': 'myhost',
+            'locations': [{'upstream': 'upstream1'}]
+        }
+    }))
+
+    # Then: Operation is parsed as expected
+    eq_(op_id, 'op1')
+    eq_(op, 'wire_proxy')
+    eq_(key, ('host', 'myhost'))
+    eq_(params['host'].hostname, 'myhost')
+    eq_(params['host'].locations, [Location('upstream1')])
+
+
+def test_parse_discover_proxy_node():
+    """
+    Should not convert plain host parameter of discover_proxy_node.
+    """
+
+    # When: I parse discover_proxy_node operation
+    op_id, op, key, params = parse_operation(json.dumps({
+        'op': 'discover_proxy_node',
+        'node_name': 'proxy1',
+        'host': '10.0.0.1'
+    }))
+
+    # Then: Operation is parsed as expected
+    eq_(op, 'discover_proxy_node')
+    eq_(key, ('proxy', 'proxy1'))
+    eq_(params, {'node_name': 'proxy1', 'host': '10.0.0.1'})
+
+
+@raises(ValueError)
+def test_parse_unsupported_operation():
+    """
+    Should raise ValueError for unsupported operation.
+    """
+
+    # When: I parse unsupported operation
+    parse_operation('{"op": "read_tree"}')
+
+    # Then: ValueError is raised
+
+
+class TestBulkProcessor():
+
+    def setup(self):
+        self.client = MagicMock(spec=Client)
+        self.output = StringIO()
+        self.processor = BulkProcessor(self.client, max_workers=4)
+
+    def _results(self):
+        return dict((result['line'], result) for result in
+                    (json.loads(line) for line in
+                     self.output.getvalue().splitlines()))
+
+    def test_run(self):
+        """
+        Should apply operations and write results.
+        """
+
+        # Given: Stream of operations
+        self.client.discover_node.return_value = None
+        self.client.update_tcp_listener.return_value = {'set': 1,
+                                                        'deleted': 0}
+        lines = [
+            json.dumps({'id': 'a', 'op': 'discover_node',
+                        'upstream': 'up1', 'node_name': 'node1',
+                        'endpoint': 'host1:40001', 'ttl': 60}),
+            '',
+            'not json',
+            json.dumps({'op': 'update_tcp_listener', 'tcp_listener': {
+                'name': 'listener1', 'bind': '*:32768'}}),
+            json.dumps({'op': 'wire_proxy', 'host': {
+                'hostname': 'myhost', 'locations': [{'upstream': 'up1'}]}}),
+        ]
+
+        # When: I run the bulk processor
+        summary = self.processor.run(lines, self.output)
+
+        # Then: Operations are applied
+        eq_(summary, {'ok': 3, 'failed': 1})
+        self.client.discover_node.assert_called_once_with(
+            upstream='up1', node_name='node1', endpoint='host1:40001',
+            ttl=60)
+        eq_(self.client.update_tcp_listener.call_args[1]['tcp_listener']
+            .name, 'listener1')
+        ok_(isinstance(self.client.wire_proxy.call_args[1]['host'], Host))
+
+        # And: Results are written for every operation
+        results = self._results()
+        eq_(sorted(results), [1, 3, 4, 5])
+        eq_(results[1], {'line': 1, 'id': 'a', 'op': 'discover_node',
+                         'ok': True, 'result': None})
+        eq_(results[3]['ok'], False)
+        eq_(results[4]['result'], {'set': 1, 'deleted': 0})
+
+    def test_run_discover_proxy_node(self):
+        """
+        Should apply discover_proxy_node operation.
+        """
+
+        # When: I run the bulk processor with discover_proxy_node operation
+        summary = self.processor.run(
+            ['{"op": "discover_proxy_node", "node_name": "p1", '
+             '"host": "10.0.0.1"}'], self.output)
+
+        # Then: Proxy node is discovered
+        eq_(summary, {'ok': 1, 'failed': 0})
+        self.client.discover_proxy_node.assert_called_once_with(
+            node_name='p1', host='10.0.0.1')
+
+    def test_run_with_failed_operation(self):
+        """
+        Should write error for failed operation.
+        """
+
+        # Given: Failing removal
+        self.client.remove_node.side_effect = ValueError('failed')
+
+        # When: I run the bulk processor
+        summary = self.processor.run(
+            ['{"op": "remove_node", "upstream": "up1", "node_name": "n1"}'],
+            self.output)
+
+        # Then: Error is written
+        eq_(summary, {'ok': 0, 'failed': 1})
+        eq_(self._results()[1]['error'], 'ValueError: failed')
+
+    def test_run_preserves_order_for_same_key(self):
+        """
+        Should apply operations for the same upstream in order.
+        """
+
+        # Given: Operations for multiple upstreams
+        applied = []
+        lock = threading.Lock()
+
+        def discover_node(upstream, node_name, endpoint):
+            with lock:
+                applied.append((upstream, node_name))
+        self.client.discover_node.side_effect = discover_node
+        lines = [json.dumps({'op': 'discover_node', 'upstream': 'up%d' % (
+            index % 3), 'node_name': 'node%03d' % index,
+            'endpoint': 'host:1'}) for index in range(90)]
+
+        # When: I run the bulk processor
+        self.processor.run(lines, self.output)
+
+        # Then: Operations for each upstream are applied in order
+        eq_(len(applied), 90)
+        for upstream in ('up0', 'up1', 'up2'):
+            nodes = [node for applied_upstream, node in applied
+                     if applied_upstream == upstream]
+            eq_(nodes, sorted(nodes))
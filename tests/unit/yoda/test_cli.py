@@ -0,0 +1,161 @@
+"""
+Test for yoda.cli
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from mock import MagicMock
+from nose.tools import eq_, ok_
+from yoda.cli import main, split_operations
+from yoda.client import Client
+from yoda.model import Host, Location
+
+try:
+    from StringIO import StringIO
+except ImportError:  # pragma: no cover
+    from io import StringIO
+
+__author__ = 'sukrit'
+
+
+def test_split_operations():
+    """
+    Should split arguments into operations.
+    """
+
+    # When: I split arguments with multiple operations
+    operations = split_operations(['remove', 'up1', 'node1', '+',
+                                   'remove', 'up1', 'node2', '+'])
+
+    # Then: Arguments are split for each operation
+    eq_(operations, [['remove', 'up1', 'node1'],
+                     ['remove', 'up1', 'node2']])
+
+
+def test_import_does_not_load_etcd():
+    """
+    Should not import etcd when cli module is imported.
+    """
+
+    # When: I import cli module in a new interpreter
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, yoda.cli; print("etcd" in sys.modules)'])
+
+    # Then: etcd is not imported
+    eq_(output.strip(), b'False')
+
+
+class TestMain():
+
+    def setup(self):
+        self.client = MagicMock(spec=Client)
+        self.output = StringIO()
+
+    def _main(self, *argv):
+        return main(list(argv), client=self.client, output=self.output)
+
+    def test_multiple_operations(self):
+        """
+        Should execute multiple operations in order.
+        """
+
+        # When: I invoke cli with multiple operations
+        code = self._main(
+            'register', 'up1', '--mode', 'tcp', '+',
+            'discover', 'up1', 'node1', 'host1:40001', '--meta', 'a=b', '+',
+            'remove', 'up1', 'node0')
+
+        # Then: Operations are executed
+        eq_(code, 0)
+        self.client.register_upstream.assert_called_once_with(
+            'up1', mode='tcp', health_uri=None, health_timeout=None,
+            health_interval=None)
+        self.client.discover_node.assert_called_once_with(
+            'up1', 'node1', 'host1:40001', ttl=120, meta={'a': 'b'})
+        self.client.remove_node.assert_called_once_with('up1', 'node0')
+
+    def test_stops_at_failed_operation(self):
+        """
+        Should stop executing operations once an operation fails.
+        """
+
+        # Given: Failing discover
+        self.client.discover_node.side_effect = ValueError('failed')
+
+        # When: I invoke cli with multiple operations
+        code = self._main('discover', 'up1', 'node1', 'host1:40001', '+',
+                          'remove', 'up1', 'node0')
+
+        # Then: Remaining operations are not executed
+        eq_(code, 1)
+        eq_(self.client.remove_node.called, False)
+
+    def test_wire(self):
+        """
+        Should wire proxy for host.
+        """
+
+        # When: I wire host
+        code = self._main('wire', 'myhost', 'up1', '/api=up2',
+                          '--alias', 'myalias', '--force-ssl')
+
+        # Then: Proxy gets wired
+        eq_(code, 0)
+        host = self.client.wire_proxy.call_args[0][0]
+        ok_(isinstance(host, Host))
+        eq_(host.hostname, 'myhost')
+        eq_(host.aliases, ['myalias'])
+        eq_(host.locations, [
+            Location('up1', force_ssl=True),
+            Location('up2', path='/api', force_ssl=True)])
+
+    def test_unwire(self):
+        """
+        Should unwire proxy for host.
+        """
+
+        # When: I unwire host
+        self._main('unwire', 'myhost', 'up1')
+
+        # Then: Proxy gets unwired
+        self.client.unwire_proxy.assert_called_once_with(
+            'myhost', upstreams=['up1'])
+
+    def test_get_nodes(self):
+        """
+        Should print nodes as JSON.
+        """
+
+        # Given: Existing nodes
+        self.client.get_nodes.return_value = {'node1': 'host1:40001'}
+
+        # When: I get nodes
+        self._main('get-nodes', 'up1')
+
+        # Then: Nodes are printed
+        eq_(json.loads(self.output.getvalue()), {'node1': 'host1:40001'})
+
+    def test_bulk(self):
+        """
+        Should apply NDJSON operations from file.
+        """
+
+        # Given: File with operations
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson',
+                                         delete=False) as ops_file:
+            ops_file.write('{"op": "remove_node", "upstream": "up1", '
+                           '"node_name": "node1"}\n')
+        try:
+            # When: I apply operations in bulk
+            code = self._main('bulk', ops_file.name)
+        finally:
+            os.remove(ops_file.name)
+
+        # Then: Operations are applied
+        eq_(code, 0)
+        self.client.remove_node.assert_called_once_with(
+            upstream='up1', node_name='node1')
+        eq_(json.loads(self.output.getvalue())['ok'], True)
@@ -3,12 +3,23 @@ Test for yoda.client
 """
 import collections
 import etcd
+import json
+import threading
+import time
 from mock import MagicMock
-from nose.tools import eq_
+from nose.tools import eq_, ok_, raises
 from tests.helper import dict_compare
 from yoda import Host, Location
+from yoda.model import TcpListener
 
-from yoda.client import as_upstream, Client, as_endpoint, DEFAULT_UPSTREAM_TTL
+from yoda.client import as_upstream, Client, as_endpoint, \
+    DEFAULT_UPSTREAM_TTL, matches_app, UpstreamNotReady, NoMatchingLocations
+from yoda.tracing import Tracer
+from yoda.adaptive import AdaptiveTtlPolicy, TTL_NODE
+from yoda.consistency import Consistency, LEVEL_FOLLOWER
+from yoda.retry import DeadlineExceeded, RetryPolicy
+from yoda.ratelimit import TokenBucket, PRIORITY_REMOVE, PRIORITY_RENEW, \
+    PRIORITY_REGISTER
 
 MOCK_APP_NAME = 'mock-app'
 MOCK_APP_VERSION = 'mock-version'
@@ -48,6 +59,22 @@ def test_as_endpoint():
     eq_(endpoint, 'mockhost:40123')
 
 
+def test_matches_app():
+    """
+    Should match upstreams named using as_upstream.
+    """
+    ok_(matches_app('mock-app-v1-8080', 'mock-app'))
+    ok_(matches_app('mock-app-v1-8080', 'mock-app-v1-'))
+    ok_(matches_app('mock-app', 'mock-app'))
+    ok_(not matches_app('mock-application-8080', 'mock-app'))
+
+    # Exact match requires '<port>' or '<version>-<port>' after app name
+    ok_(matches_app('mock-app-8080', 'mock-app'))
+    ok_(not matches_app('mock-app-two-v1-8080', 'mock-app'))
+    ok_(not matches_app('mock-app-two', 'mock-app'))
+    ok_(matches_app('mock-app-two-v1-8080', 'mock-app', exact=False))
+
+
 def test_client_init():
     """
     Should initialize etcd_client when etcd client instance is not passed
@@ -66,6 +93,7 @@ def test_client_init():
 class TestClient():
     KeyValue = collections.namedtuple('KeyValue', 'key,value')
     KeyChildren = collections.namedtuple('KeyChildren', 'key,children')
+    Leaf = collections.namedtuple('Leaf', 'key,value,dir')
 
     def setup(self):
         self.etcd_cl = MagicMock(spec=etcd.Client)
@@ -336,3 +364,1018 @@ class TestClient():
 
         # Then: Empty nodes dictionary is returned
         dict_compare(nodes, {})
+
+    def test_write_limiter_priorities(self):
+        """
+        Should acquire write tokens with priority of the operation.
+        """
+
+        # Given: Client with write limiter
+        limiter = MagicMock(spec=TokenBucket)
+        self.client.write_limiter = limiter
+
+        # When: I register, renew and remove nodes
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+        self.client.renew_upstream('test')
+        self.client.remove_node('test', 'testnode')
+
+        # Then: Tokens are acquired with expected priorities
+        eq_([call[0][0] for call in limiter.acquire.call_args_list],
+            [PRIORITY_REGISTER, PRIORITY_RENEW, PRIORITY_REMOVE])
+
+    def test_write_limiter_is_not_used_for_reads(self):
+        """
+        Should not throttle etcd reads.
+        """
+
+        # Given: Client with write limiter
+        limiter = MagicMock(spec=TokenBucket)
+        self.client.write_limiter = limiter
+
+        # When: I get nodes for upstream
+        self.client.get_nodes('test')
+
+        # Then: Limiter is not used
+        eq_(limiter.acquire.called, False)
+
+    def test_startup_jitter_for_first_registration(self):
+        """
+        Should delay only the first registration of a node.
+        """
+
+        # Given: Client with startup jitter
+        self.client.startup_jitter = 5
+        self.client._sleep = MagicMock()
+
+        # When: I discover the same node twice
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+
+        # Then: Registration gets delayed only once
+        eq_(self.client._sleep.call_count, 1)
+        ok_(0 <= self.client._sleep.call_args[0][0] <= 5)
+
+    def test_refresh_interval(self):
+        """
+        Should return jittered refresh interval for given ttl.
+        """
+
+        # When: I get refresh interval for ttl
+        interval = self.client.refresh_interval(120)
+
+        # Then: Interval is within jitter bounds
+        ok_(36 <= interval <= 44)
+
+    def test_discover_node_refreshes_unchanged_node(self):
+        """
+        Should only refresh ttl when node is re-discovered with same endpoint.
+        """
+
+        # Given: Node that was discovered earlier
+        self.client.discover_node('test', 'testnode', 'localhost:3434',
+                                  meta={'unit-no': 1})
+
+        # When: I discover the node again with the same endpoint and meta
+        self.etcd_cl.set.reset_mock()
+        self.client.discover_node('test', 'testnode', 'localhost:3434',
+                                  meta={'unit-no': 1})
+
+        # Then: Only the ttl gets refreshed
+        eq_(self.etcd_cl.set.called, False)
+        self.etcd_cl.refresh.assert_any_call(
+            '/yoda/upstreams/test/endpoints/testnode', DEFAULT_TTL,
+            prevValue='localhost:3434')
+        self.etcd_cl.refresh.assert_any_call(
+            '/yoda/upstreams/test/endpoints-meta/testnode/unit-no',
+            DEFAULT_TTL, prevValue=1)
+
+    def test_discover_node_writes_changed_endpoint(self):
+        """
+        Should perform full write when endpoint for node changes.
+        """
+
+        # Given: Node that was discovered earlier
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+
+        # When: I discover the node with a different endpoint
+        self.client.discover_node('test', 'testnode', 'localhost:4545')
+
+        # Then: Endpoint gets written
+        eq_(self.etcd_cl.refresh.called, False)
+        self.etcd_cl.set.assert_called_with(
+            '/yoda/upstreams/test/endpoints/testnode', 'localhost:4545',
+            ttl=DEFAULT_TTL)
+
+    def test_discover_node_writes_expired_node(self):
+        """
+        Should fall back to full write when refreshed node has expired.
+        """
+
+        # Given: Node that was discovered earlier but has expired since
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+        self.etcd_cl.refresh.side_effect = etcd.EtcdKeyNotFound('mock')
+
+        # When: I discover the node again
+        self.etcd_cl.set.reset_mock()
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+
+        # Then: Endpoint gets written again
+        self.etcd_cl.set.assert_called_once_with(
+            '/yoda/upstreams/test/endpoints/testnode', 'localhost:3434',
+            ttl=DEFAULT_TTL)
+
+    def test_change_set(self):
+        """
+        Should update generation key once after all operations succeed.
+        """
+
+        # When: I wire proxy and discover node within a change set
+        self.etcd_cl.read.return_value.children = []
+        with self.client.change_set('mock deploy') as changes:
+            self.client.discover_node('test', 'testnode', 'localhost:3434')
+            with self.client.change_set():
+                self.client.wire_proxy(Host('mockhost', locations=[
+                    Location('test', path='/')]))
+
+        # Then: Generation key gets updated with summary of changes
+        generation_calls = [call for call in self.etcd_cl.set.call_args_list
+                            if call[0][0] == '/yoda/generation']
+        eq_(len(generation_calls), 1)
+        generation = json.loads(generation_calls[0][0][1])
+        eq_(generation['summary'], 'mock deploy')
+        eq_(generation['changes'], changes['changes'])
+        eq_(generation['upstreams'], ['test'])
+        eq_(generation['hosts'], ['mockhost'])
+
+    def test_change_set_with_failure(self):
+        """
+        Should not update generation key when operations fail.
+        """
+
+        # Given: Failing etcd write
+        self.etcd_cl.set.side_effect = [None, ValueError('mock')]
+
+        # When: I discover node within a change set
+        try:
+            with self.client.change_set():
+                self.client.discover_node('test', 'testnode1', 'host1:3434')
+                self.client.discover_node('test', 'testnode2', 'host2:3434')
+        except ValueError:
+            pass
+
+        # Then: Generation key is not updated
+        eq_(self.etcd_cl.set.call_count, 2)
+        eq_(self.client._context.change_set, None)
+
+    def test_change_set_per_thread(self):
+        """
+        Should track change sets of threads sharing the client separately.
+        """
+
+        # Given: Change set A that stays open while change set B runs in
+        # another thread
+        opened, closed = threading.Event(), threading.Event()
+
+        def change_set_b():
+            opened.wait(5)
+            with self.client.change_set('B'):
+                self.client.remove_node('u2', 'node2')
+            closed.set()
+
+        thread = threading.Thread(target=change_set_b)
+        thread.start()
+
+        # When: I remove nodes within both change sets
+        with self.client.change_set('A'):
+            self.client.remove_node('u1', 'node1')
+            opened.set()
+            closed.wait(5)
+        thread.join(5)
+
+        # Then: Generation key is updated once for each change set
+        generations = dict(
+            (generation['summary'], generation) for generation in (
+                json.loads(call[0][1])
+                for call in self.etcd_cl.set.call_args_list
+                if call[0][0] == '/yoda/generation'))
+        eq_(sorted(generations), ['A', 'B'])
+        eq_(generations['A']['upstreams'], ['u1'])
+        eq_(generations['B']['upstreams'], ['u2'])
+
+    def test_read_tree(self):
+        """
+        Should read yoda tree as nested dictionary.
+        """
+
+        # Given: Existing keys in etcd
+        self.etcd_cl.read.return_value.etcd_index = 1234
+        self.etcd_cl.read.return_value.leaves = [
+            self.Leaf('/yoda/upstreams/test/mode', 'http', False),
+            self.Leaf('/yoda/upstreams/test/endpoints/testnode1',
+                      'host1:40001', False),
+            self.Leaf('/yoda/hosts/mockhost/aliases', None, True),
+        ]
+
+        # When: I read the tree
+        tree, etcd_index = self.client.read_tree()
+
+        # Then: Expected tree is returned
+        eq_(etcd_index, 1234)
+        dict_compare(tree, {
+            'upstreams': {
+                'test': {
+                    'mode': 'http',
+                    'endpoints': {
+                        'testnode1': 'host1:40001'
+                    }
+                }
+            }
+        })
+        self.etcd_cl.read.assert_called_once_with('/yoda', recursive=True)
+
+    def test_read_missing_tree(self):
+        """
+        Should return etcd index reported for a missing tree.
+        """
+
+        # Given: Missing tree
+        self.etcd_cl.read.side_effect = etcd.EtcdKeyNotFound(
+            'Key not found', {'errorCode': 100, 'index': 42})
+
+        # When: I read the tree
+        tree, etcd_index = self.client.read_tree()
+
+        # Then: Empty tree is returned with index from the error
+        eq_(tree, {})
+        eq_(etcd_index, 42)
+
+    def test_stats(self):
+        """
+        Should compute statistics using a single recursive read.
+        """
+
+        # Given: Existing keys in etcd
+        Node = collections.namedtuple('Node', 'key,value,ttl,dir')
+        self.etcd_cl.read.return_value.etcd_index = 1234
+        self.etcd_cl.read.return_value.get_subtree.return_value = [
+            Node('/yoda', None, None, True),
+            Node('/yoda/upstreams/test', None, None, True),
+            Node('/yoda/upstreams/test/endpoints/testnode1', 'host1:40001',
+                 10, False),
+            Node('/yoda/upstreams/test/endpoints/testnode2', 'host2:40001',
+                 100, False),
+            Node('/yoda/upstreams/empty', None, None, True),
+        ]
+
+        # When: I get the statistics
+        stats = self.client.stats(expiring_within=30)
+
+        # Then: Expected statistics are returned
+        eq_(stats.etcd_index, 1234)
+        eq_(stats.nodes, 2)
+        eq_(stats.expiring_nodes, 1)
+        eq_(stats.empty_upstreams, ['empty'])
+        self.etcd_cl.read.assert_called_once_with('/yoda', recursive=True)
+
+    def test_stats_for_non_existing_tree(self):
+        """
+        Should return empty statistics when yoda tree does not exist.
+        """
+
+        # Given: Non existing yoda tree
+        self.etcd_cl.read.side_effect = KeyError
+
+        # When: I get the statistics
+        stats = self.client.stats()
+
+        # Then: Empty statistics are returned
+        eq_(stats.keys, 0)
+        eq_(stats.upstreams, 0)
+
+    def test_wire_proxies(self):
+        """
+        Should wire multiple hosts writing only the differences.
+        """
+
+        # Given: Hosts to be wired
+        hosts = [
+            Host('mockhost1', locations=[
+                Location('upstream1', path='/path1')]),
+            Host('mockhost2', locations=[
+                Location('upstream2', path='/path2')]),
+        ]
+
+        # And: Existing keys for mockhost1
+        base = '/yoda/hosts/mockhost1/locations'
+        self.etcd_cl.read.return_value.leaves = [
+            self.Leaf('%s/-path1/path' % base, '/path1', False),
+            self.Leaf('%s/-path1/upstream' % base, 'upstream-old', False),
+            self.Leaf('%s/-path1/force-ssl' % base, 'false', False),
+            self.Leaf('%s/-path1/acls/allowed/public' % base, 'public',
+                      False),
+            self.Leaf('%s/-path1/acls/allowed/stale' % base, 'stale', False),
+            self.Leaf('%s/-path1/acls/denied/global-black-list' % base,
+                      'global-black-list', False),
+            self.Leaf('%s/-path3/path' % base, '/path3', False),
+            self.Leaf('%s/-path3/upstream' % base, 'upstream3', False),
+        ]
+
+        # When: I wire proxies for the hosts
+        results, failures = self.client.wire_proxies(hosts)
+
+        # Then: Only the differences are written for mockhost1
+        eq_(failures, {})
+        eq_(results['mockhost1'], {'set': 1, 'deleted': 2})
+        self.etcd_cl.set.assert_any_call('%s/-path1/upstream' % base,
+                                         'upstream1')
+        self.etcd_cl.delete.assert_any_call('%s/-path3' % base,
+                                            recursive=True)
+        self.etcd_cl.delete.assert_any_call(
+            '%s/-path1/acls/allowed/stale' % base)
+
+        # And: All keys are written for new host
+        eq_(results['mockhost2'], {'set': 5, 'deleted': 0})
+        self.etcd_cl.set.assert_any_call(
+            '/yoda/hosts/mockhost2/locations/-path2/upstream', 'upstream2')
+
+        # And: Hosts subtree is read only once
+        self.etcd_cl.read.assert_called_once_with(
+            '/yoda/hosts', recursive=True, quorum=True)
+
+    def test_wire_proxies_with_failure(self):
+        """
+        Should report failures without stopping other hosts.
+        """
+
+        # Given: Hosts to be wired
+        hosts = [
+            Host('mockhost1', locations=[Location('upstream1')]),
+            Host('mockhost2', locations=[Location('upstream2')]),
+        ]
+        self.etcd_cl.read.side_effect = etcd.EtcdKeyNotFound('mock')
+
+        # And: Etcd write fails for mockhost1
+        error = etcd.EtcdException('mock')
+
+        def mock_set(key, value):
+            if key.startswith('/yoda/hosts/mockhost1/'):
+                raise error
+
+        self.etcd_cl.set.side_effect = mock_set
+
+        # When: I wire proxies for the hosts
+        results, failures = self.client.wire_proxies(hosts)
+
+        # Then: Failure is reported for mockhost1 only
+        eq_(failures, {'mockhost1': error})
+        eq_(list(results), ['mockhost2'])
+
+    def test_update_tcp_listener(self):
+        """
+        Should write only changed keys and remove stale acls for listener.
+        """
+
+        # Given: Existing tcp listener
+        base = '/yoda/global/listeners/tcp/mock-listener'
+        self.etcd_cl.read.return_value.leaves = [
+            self.Leaf('%s/bind' % base, '*:32768', False),
+            self.Leaf('%s/upstream' % base, 'upstream-old', False),
+            self.Leaf('%s/acls/allowed/stale' % base, 'stale', False),
+        ]
+
+        # When: I update tcp listener
+        result = self.client.update_tcp_listener(TcpListener(
+            'mock-listener', '*:32768', upstream='upstream1',
+            allowed_acls=['public']))
+
+        # Then: Only the differences are written
+        eq_(result, {'set': 2, 'deleted': 1})
+        self.etcd_cl.set.assert_any_call('%s/upstream' % base, 'upstream1')
+        self.etcd_cl.set.assert_any_call('%s/acls/allowed/public' % base,
+                                         'public')
+        self.etcd_cl.delete.assert_called_once_with(
+            '%s/acls/allowed/stale' % base)
+        self.etcd_cl.read.assert_called_once_with(base, recursive=True,
+                                                  quorum=True)
+
+    def test_sync_tcp_listeners_with_prune(self):
+        """
+        Should sync listeners and remove stale listeners.
+        """
+
+        # Given: Existing tcp listeners
+        base = '/yoda/global/listeners/tcp'
+        self.etcd_cl.read.return_value.leaves = [
+            self.Leaf('%s/listener1/bind' % base, '*:32768', False),
+            self.Leaf('%s/listener2/bind' % base, '*:32769', False),
+        ]
+
+        # When: I sync tcp listeners
+        results, failures = self.client.sync_tcp_listeners(
+            [TcpListener('listener1', '*:32768'),
+             TcpListener('listener3', '*:32770')], prune=True)
+
+        # Then: Listeners get synced
+        eq_(failures, {})
+        eq_(results, {
+            'listener1': {'set': 0, 'deleted': 0},
+            'listener2': {'set': 0, 'deleted': 1},
+            'listener3': {'set': 1, 'deleted': 0},
+        })
+        self.etcd_cl.set.assert_called_once_with(
+            '%s/listener3/bind' % base, '*:32770')
+        self.etcd_cl.delete.assert_called_once_with(
+            '%s/listener2' % base, recursive=True)
+
+    def test_remove_tcp_listener(self):
+        """
+        Should remove existing tcp listener.
+        """
+
+        # When: I remove tcp listener
+        self.client.remove_tcp_listener('mock-listener')
+
+        # Then: Listener gets removed
+        self.etcd_cl.delete.assert_called_once_with(
+            '/yoda/global/listeners/tcp/mock-listener', recursive=True)
+
+    def _mock_switch_reads(self, nodes):
+        base = '/yoda/hosts'
+        hosts = MagicMock()
+        hosts.leaves = [
+            self.Leaf('%s/host1/locations/-/upstream' % base, 'blue', False),
+            self.Leaf('%s/host1/locations/-api/upstream' % base, 'other',
+                      False),
+            self.Leaf('%s/host2/locations/-/upstream' % base, 'blue', False),
+            self.Leaf('%s/host2/locations/-/path' % base, 'blue', False),
+        ]
+        endpoints = MagicMock()
+        endpoints.children = [
+            self.KeyValue('/yoda/upstreams/green/endpoints/%s' % node,
+                          'host:8080') for node in nodes]
+
+        def read(key, **kwargs):
+            return hosts if key == base else endpoints
+        self.etcd_cl.read.side_effect = read
+
+    def test_switch_upstream(self):
+        """
+        Should switch all locations routing to old upstream.
+        """
+
+        # Given: Ready green upstream and locations routing to blue
+        self._mock_switch_reads(['node1', 'node2'])
+
+        # When: I switch from blue to green
+        result = self.client.switch_upstream('blue', 'green', min_nodes=2,
+                                             rollback_ttl=600)
+
+        # Then: Locations are switched using compare and swap
+        eq_(result.success, True)
+        eq_(result.switched, ['/yoda/hosts/host1/locations/-/upstream',
+                              '/yoda/hosts/host2/locations/-/upstream'])
+        eq_(sorted(call[0] for call in
+                   self.etcd_cl.test_and_set.call_args_list), [
+            ('/yoda/hosts/host1/locations/-/upstream', 'green', 'blue'),
+            ('/yoda/hosts/host2/locations/-/upstream', 'green', 'blue'),
+        ])
+
+        # And: Old upstream is kept for rollback
+        self.etcd_cl.write.assert_called_once_with(
+            '/yoda/upstreams/blue', None, ttl=600, dir=True, prevExist=True)
+
+        # And: Generation is updated once
+        self.etcd_cl.set.assert_called_once()
+        eq_(self.etcd_cl.set.call_args[0][0], '/yoda/generation')
+
+    def test_switch_upstream_for_hostnames(self):
+        """
+        Should switch locations only for given hostnames.
+        """
+
+        # Given: Ready green upstream and locations routing to blue
+        self._mock_switch_reads(['node1'])
+
+        # When: I switch from blue to green for host2
+        result = self.client.switch_upstream('blue', 'green',
+                                             hostnames=['host2'])
+
+        # Then: Only locations for host2 are switched
+        eq_(result.switched, ['/yoda/hosts/host2/locations/-/upstream'])
+
+    @raises(NoMatchingLocations)
+    def test_switch_upstream_without_matching_locations(self):
+        """
+        Should raise NoMatchingLocations when no location routes to old
+        upstream.
+        """
+
+        # Given: Ready green upstream and locations routing to blue
+        self._mock_switch_reads(['node1'])
+
+        try:
+            # When: I switch from misspelt upstream to green
+            self.client.switch_upstream('bleu', 'green')
+        finally:
+            # Then: Nothing is written
+            eq_(self.etcd_cl.test_and_set.called, False)
+            eq_(self.etcd_cl.write.called, False)
+            eq_(self.etcd_cl.set.called, False)
+
+    @raises(UpstreamNotReady)
+    def test_switch_upstream_when_not_ready(self):
+        """
+        Should not switch when new upstream does not have ready nodes.
+        """
+
+        # Given: Green upstream with node that is not ready
+        self._mock_switch_reads(['node1'])
+        self.client._sleep = MagicMock()
+
+        # When: I switch from blue to green
+        try:
+            self.client.switch_upstream(
+                'blue', 'green', ready=lambda node, info: False,
+                timeout=0)
+        finally:
+            # Then: No location is switched
+            eq_(self.etcd_cl.test_and_set.called, False)
+
+    def test_switch_upstream_reverts_on_failure(self):
+        """
+        Should revert switched locations when a location fails to switch.
+        """
+
+        # Given: Location that has changed concurrently
+        self._mock_switch_reads(['node1'])
+        failed_key = '/yoda/hosts/host2/locations/-/upstream'
+
+        def test_and_set(key, value, prev_value):
+            if key == failed_key and prev_value == 'blue':
+                raise ValueError('Compare failed')
+        self.etcd_cl.test_and_set.side_effect = test_and_set
+
+        # When: I switch from blue to green
+        result = self.client.switch_upstream('blue', 'green')
+
+        # Then: Switched location is reverted
+        eq_(result.success, False)
+        eq_(result.reverted, True)
+        eq_(result.switched, [])
+        eq_(list(result.failures), [failed_key])
+        self.etcd_cl.test_and_set.assert_called_with(
+            '/yoda/hosts/host1/locations/-/upstream', 'blue', 'green')
+        eq_(self.etcd_cl.write.called, False)
+
+    def test_switch_rollback(self):
+        """
+        Should switch locations back to old upstream.
+        """
+
+        # Given: Switched locations
+        self._mock_switch_reads(['node1'])
+        result = self.client.switch_upstream('blue', 'green')
+        self.etcd_cl.test_and_set.reset_mock()
+
+        # When: I rollback the switch
+        rollback = result.rollback()
+
+        # Then: Locations are switched back
+        eq_(rollback.switched, result.switched)
+        eq_(sorted(call[0] for call in
+                   self.etcd_cl.test_and_set.call_args_list), [
+            ('/yoda/hosts/host1/locations/-/upstream', 'blue', 'green'),
+            ('/yoda/hosts/host2/locations/-/upstream', 'blue', 'green'),
+        ])
+
+    def test_retry_idempotent_call(self):
+        """
+        Should retry idempotent etcd call on transient error.
+        """
+
+        # Given: Transient failure for set
+        self.client._sleep = MagicMock()
+        self.etcd_cl.set.side_effect = [etcd.EtcdConnectionFailed(), None]
+
+        # When: I set the key
+        self.client._etcd_op('set', '/yoda/test', 'value')
+
+        # Then: Call is retried after backoff
+        eq_(self.etcd_cl.set.call_count, 2)
+        eq_(self.client._sleep.call_count, 1)
+
+    def test_no_retry_for_watch_timeout(self):
+        """
+        Should not retry a watch that timed out.
+        """
+
+        # Given: Watch that times out
+        self.client._sleep = MagicMock()
+        self.etcd_cl.read.side_effect = etcd.EtcdWatchTimedOut('timeout')
+
+        # When: I watch the yoda tree
+        try:
+            self.client.watch(index=10, timeout=60)
+        except etcd.EtcdWatchTimedOut:
+            pass
+
+        # Then: Watch is not retried
+        eq_(self.etcd_cl.read.call_count, 1)
+        eq_(self.client._sleep.call_count, 0)
+
+    @raises(etcd.EtcdConnectionFailed)
+    def test_no_retry_for_non_idempotent_call(self):
+        """
+        Should not retry call that is not safe to be repeated.
+        """
+
+        # Given: Transient failure for compare and swap
+        self.client._sleep = MagicMock()
+        self.etcd_cl.test_and_set.side_effect = etcd.EtcdConnectionFailed()
+
+        # When: I make compare and swap call
+        try:
+            self.client._etcd_op('test_and_set', '/yoda/test', 'new', 'old')
+        finally:
+            # Then: Call is not retried
+            eq_(self.etcd_cl.test_and_set.call_count, 1)
+
+    def test_retry_delete(self):
+        """
+        Should treat missing key as success when retrying delete.
+        """
+
+        # Given: Delete that succeeds but fails to respond
+        self.client._sleep = MagicMock()
+        self.etcd_cl.delete.side_effect = [etcd.EtcdConnectionFailed(),
+                                           etcd.EtcdKeyNotFound()]
+
+        # When: I delete the key
+        self.client._etcd_op('delete', '/yoda/test')
+
+        # Then: Delete is retried
+        eq_(self.etcd_cl.delete.call_count, 2)
+
+    def test_deadline_for_read(self):
+        """
+        Should use remaining time as timeout for reads within deadline.
+        """
+
+        # When: I get nodes within a deadline
+        with self.client.deadline(5):
+            self.client.get_nodes('test')
+
+        # Then: Read is made with timeout
+        timeout = self.etcd_cl.read.call_args[1]['timeout']
+        ok_(0 < timeout <= 5)
+
+    def test_operation_deadline_with_partial_progress(self):
+        """
+        Should stop operation once deadline expires and report progress.
+        """
+
+        # Given: Client with operation timeout and slow etcd
+        client = Client(etcd_cl=self.etcd_cl, operation_timeout=0.08,
+                        retry_policy=RetryPolicy(max_attempts=1))
+        self.etcd_cl.set.side_effect = lambda *args, **kwargs: \
+            time.sleep(0.05)
+
+        # When: I wire the proxy
+        try:
+            client.wire_proxy(Host('mockhost', [Location('upstream1')]))
+            ok_(False, 'DeadlineExceeded was not raised')
+        except DeadlineExceeded as error:
+            # Then: Partial progress is reported
+            eq_(error.operation, 'wire_proxy')
+            eq_(error.completed, [
+                ('set', '/yoda/hosts/mockhost/locations/-/path'),
+                ('set', '/yoda/hosts/mockhost/locations/-/acls/allowed/'
+                        'public'),
+            ])
+
+    def test_tracing(self):
+        """
+        Should record span for client method and child spans for etcd calls.
+        """
+
+        # Given: Client with tracer
+        spans = []
+        exporter = MagicMock()
+        exporter.on_end.side_effect = spans.append
+        client = Client(etcd_cl=self.etcd_cl, tracer=Tracer(exporter))
+        self.etcd_cl.read.return_value.leaves = []
+        self.etcd_cl.set.side_effect = [etcd.EtcdConnectionFailed(), None,
+                                        None, None, None, None]
+        client._sleep = MagicMock()
+
+        # When: I wire proxies (using worker threads)
+        client.wire_proxies([Host('mockhost', [Location('upstream1')])])
+
+        # Then: Span is recorded for client method
+        root = spans[-1]
+        eq_(root.name, 'yoda.wire_proxies')
+
+        # And: Child spans are recorded for etcd calls
+        children = spans[:-1]
+        eq_([span.name for span in children],
+            ['etcd.read'] + ['etcd.set'] * 5)
+        for span in children:
+            eq_(span.trace_id, root.trace_id)
+            eq_(span.parent_id, root.span_id)
+        eq_(children[1].attributes, {
+            'etcd.verb': 'set',
+            'etcd.key': '/yoda/hosts/mockhost/locations/-/path',
+            'etcd.bytes': 1,
+            'etcd.retries': 1,
+        })
+
+    def test_adaptive_ttl(self):
+        """
+        Should pick ttl and refresh interval using observed write latency.
+        """
+
+        # Given: Client with ttl policy
+        policy = AdaptiveTtlPolicy(bounds={TTL_NODE: (30, 300)},
+                                   target_latency=0.1, smoothing=1)
+        client = Client(etcd_cl=self.etcd_cl, ttl_policy=policy,
+                        refresh_jitter=0)
+
+        # When: I discover node without ttl
+        client.discover_node('test', 'testnode', 'localhost:3434')
+
+        # Then: Write latency is observed
+        eq_(policy.observations, 1)
+
+        # And: TTL is picked using the policy
+        self.etcd_cl.set.assert_called_once_with(
+            '/yoda/upstreams/test/endpoints/testnode', 'localhost:3434',
+            ttl=30)
+
+        # And: Refresh interval is derived from policy
+        eq_(client.refresh_interval(30), policy.refresh_interval(30))
+
+    def test_adaptive_ttl_observes_failures(self):
+        """
+        Should record transient etcd failures in the ttl policy.
+        """
+
+        # Given: Client with ttl policy and failing etcd
+        policy = AdaptiveTtlPolicy(smoothing=1)
+        client = Client(etcd_cl=self.etcd_cl, ttl_policy=policy,
+                        retry_policy=RetryPolicy(max_attempts=1))
+        self.etcd_cl.set.side_effect = etcd.EtcdConnectionFailed()
+
+        # When: I discover proxy node
+        try:
+            client.discover_proxy_node('proxy1')
+        except etcd.EtcdConnectionFailed:
+            pass
+
+        # Then: Failure is recorded
+        eq_(policy.failure_rate, 1.0)
+
+    def test_read_consistency(self):
+        """
+        Should use per-call consistency over client default.
+        """
+
+        # Given: Client with leader reads across two members
+        follower, leader = MagicMock(spec=etcd.Client), \
+            MagicMock(spec=etcd.Client)
+        follower.base_uri = 'http://10.0.0.1:2379'
+        leader.base_uri = 'http://10.0.0.2:2379'
+        leader.read.return_value.children = []
+        self.etcd_cl.leader = {'clientURLs': ['http://10.0.0.2:2379/']}
+        self.etcd_cl.read.return_value.children = []
+        client = Client(etcd_cl=self.etcd_cl, consistency='leader',
+                        read_clients=[follower, leader])
+
+        # When: I get nodes using default and linearizable consistency
+        client.get_nodes('upstream1')
+        client.get_nodes('upstream1', consistency='linearizable')
+
+        # Then: Leader read is sent to the leader
+        leader.read.assert_called_once_with(
+            '/yoda/upstreams/upstream1/endpoints', recursive=True)
+        eq_(follower.read.call_count, 0)
+
+        # And: Linearizable read is made with quorum
+        self.etcd_cl.read.assert_called_once_with(
+            '/yoda/upstreams/upstream1/endpoints', recursive=True,
+            quorum=True)
+
+    def test_leader_read_for_unknown_leader(self):
+        """
+        Should make leader reads as linearizable reads when the leader is not
+        one of the read clients.
+        """
+
+        # Given: Client with leader reads and unknown leader
+        self.etcd_cl.leader = {'clientURLs': ['http://10.0.0.3:2379']}
+        self.etcd_cl.base_uri = 'http://10.0.0.1:2379'
+        self.etcd_cl.read.return_value.children = []
+        client = Client(etcd_cl=self.etcd_cl, consistency='leader')
+
+        # When: I get nodes
+        client.get_nodes('upstream1')
+
+        # Then: Read is made with quorum
+        self.etcd_cl.read.assert_called_once_with(
+            '/yoda/upstreams/upstream1/endpoints', recursive=True,
+            quorum=True)
+
+    def test_follower_reads(self):
+        """
+        Should spread follower reads across read clients and repeat stale
+        reads as linearizable reads.
+        """
+
+        # Given: Client with follower reads across two members
+        follower = MagicMock(spec=etcd.Client)
+        follower.read.return_value.etcd_index = 5
+        follower.read.return_value.children = []
+        self.etcd_cl.read.return_value.etcd_index = 20
+        self.etcd_cl.read.return_value.children = []
+        client = Client(etcd_cl=self.etcd_cl,
+                        read_clients=[self.etcd_cl, follower],
+                        consistency=Consistency(LEVEL_FOLLOWER,
+                                                max_staleness=10))
+
+        # When: I read nodes twice
+        client.get_nodes('upstream1')
+        client.get_nodes('upstream1')
+
+        # Then: Reads are spread across members
+        follower.read.assert_called_once_with(
+            '/yoda/upstreams/upstream1/endpoints', recursive=True)
+
+        # And: Stale follower read is repeated as linearizable read
+        eq_(client.stale_reads, 1)
+        self.etcd_cl.read.assert_called_with(
+            '/yoda/upstreams/upstream1/endpoints', recursive=True,
+            quorum=True)
+
+    def test_discover_nodes(self):
+        """
+        Should write endpoints and meta for all nodes and report results per
+        node.
+        """
+
+        # Given: Etcd that fails writes for node2
+        def set_key(key, value, ttl=None):
+            if 'node2' in key:
+                raise etcd.EtcdConnectionFailed()
+        self.etcd_cl.set.side_effect = set_key
+        self.client.retry_policy = RetryPolicy(max_attempts=1)
+
+        # When: I discover multiple nodes
+        results, failures = self.client.discover_nodes([
+            {'upstream': 'upstream1', 'node_name': 'node1',
+             'endpoint': 'host1:40001', 'meta': {'version': 'v1'}},
+            {'upstream': 'upstream1', 'node_name': 'node2',
+             'endpoint': 'host2:40001'},
+            {'upstream': 'upstream2', 'node_name': 'node3',
+             'endpoint': 'host3:40001', 'ttl': 30},
+        ], ttl=60)
+
+        # Then: Results are reported per node
+        eq_(results, {
+            ('upstream1', 'node1'): {'set': 2, 'refreshed': 0},
+            ('upstream2', 'node3'): {'set': 1, 'refreshed': 0},
+        })
+        eq_(list(failures), [('upstream1', 'node2')])
+
+        # And: Endpoint and meta keys are written
+        self.etcd_cl.set.assert_any_call(
+            '/yoda/upstreams/upstream1/endpoints/node1', 'host1:40001',
+            ttl=60)
+        self.etcd_cl.set.assert_any_call(
+            '/yoda/upstreams/upstream1/endpoints-meta/node1/version', 'v1',
+            ttl=60)
+        self.etcd_cl.set.assert_any_call(
+            '/yoda/upstreams/upstream2/endpoints/node3', 'host3:40001',
+            ttl=30)
+
+        # When: I discover the nodes again
+        self.etcd_cl.set.reset_mock()
+        results, _ = self.client.discover_nodes([
+            {'upstream': 'upstream1', 'node_name': 'node1',
+             'endpoint': 'host1:40001', 'meta': {'version': 'v1'}}], ttl=60)
+
+        # Then: Only ttls are refreshed
+        eq_(results, {('upstream1', 'node1'): {'set': 0, 'refreshed': 2}})
+        eq_(self.etcd_cl.set.call_count, 0)
+
+    def test_remove_nodes(self):
+        """
+        Should remove endpoints and meta for all nodes.
+        """
+
+        # Given: Meta for node2 does not exist
+        def delete_key(key, **kwargs):
+            if key.endswith('endpoints-meta/node2'):
+                raise etcd.EtcdKeyNotFound()
+        self.etcd_cl.delete.side_effect = delete_key
+
+        # When: I remove multiple nodes
+        results, failures = self.client.remove_nodes([
+            ('upstream1', 'node1'), ('upstream1', 'node2')])
+
+        # Then: Results are reported per node
+        eq_(results, {
+            ('upstream1', 'node1'): {'deleted': 2},
+            ('upstream1', 'node2'): {'deleted': 1},
+        })
+        eq_(failures, {})
+
+        # And: Endpoints and meta are deleted
+        self.etcd_cl.delete.assert_any_call(
+            '/yoda/upstreams/upstream1/endpoints/node1')
+        self.etcd_cl.delete.assert_any_call(
+            '/yoda/upstreams/upstream1/endpoints-meta/node1', recursive=True,
+            dir=True)
+
+    def test_decommission(self):
+        """
+        Should delete routes to matching upstreams before the upstreams.
+        """
+
+        # Given: Tree with hosts and listeners for mock-app
+        self.etcd_cl.read.return_value.leaves = [
+            self.Leaf('/yoda/upstreams/mock-app-v1-8080/mode', 'http', False),
+            self.Leaf('/yoda/upstreams/mock-app-v2-8080/mode', 'http', False),
+            self.Leaf('/yoda/upstreams/other-8080/mode', 'http', False),
+            self.Leaf('/yoda/hosts/host1/locations/-/upstream',
+                      'mock-app-v1-8080', False),
+            self.Leaf('/yoda/hosts/host1/aliases/alias1', 'alias1', False),
+            self.Leaf('/yoda/hosts/host2/locations/-/upstream',
+                      'other-8080', False),
+            self.Leaf('/yoda/hosts/host2/locations/-api/upstream',
+                      'mock-app-v2-8080', False),
+            self.Leaf('/yoda/global/listeners/tcp/listener1/upstream',
+                      'mock-app-v2-8080', False),
+        ]
+
+        # And: Delete for location of host2 fails
+        def delete_key(key, **kwargs):
+            if key == '/yoda/hosts/host2/locations/-api':
+                raise etcd.EtcdException()
+        self.etcd_cl.delete.side_effect = delete_key
+
+        # When: I decommission the app
+        result = self.client.decommission('mock-app', dry_run=False)
+
+        # Then: Tree is read once using linearizable read
+        self.etcd_cl.read.assert_called_once_with('/yoda', recursive=True,
+                                                  quorum=True)
+
+        # And: Routes and upstreams that are no longer routed are deleted
+        eq_(result.upstreams, ['mock-app-v1-8080', 'mock-app-v2-8080'])
+        eq_(result.deleted, [
+            '/yoda/hosts/host1',
+            '/yoda/global/listeners/tcp/listener1',
+            '/yoda/upstreams/mock-app-v1-8080',
+        ])
+
+        # And: Upstream still routed by failed location is kept
+        eq_(list(result.failures), ['/yoda/hosts/host2/locations/-api'])
+        eq_(result.skipped, ['/yoda/upstreams/mock-app-v2-8080'])
+        eq_(result.success, False)
+
+        # And: Upstreams are deleted after the routes
+        deleted = [call[0][0] for call in
+                   self.etcd_cl.delete.call_args_list]
+        ok_(deleted.index('/yoda/upstreams/mock-app-v1-8080') >
+            deleted.index('/yoda/hosts/host1'))
+        ok_('/yoda/upstreams/mock-app-v2-8080' not in deleted)
+
+    def test_decommission_dry_run(self):
+        """
+        Should only plan the deletes for a dry run.
+        """
+
+        # Given: Tree with upstreams of mock-app and mock-app-two
+        self.etcd_cl.read.return_value.leaves = [
+            self.Leaf('/yoda/upstreams/mock-app-v1-8080/mode', 'http', False),
+            self.Leaf('/yoda/upstreams/mock-app-two-v1-8080/mode', 'http',
+                      False),
+            self.Leaf('/yoda/hosts/host1/locations/-/upstream',
+                      'mock-app-v1-8080', False),
+            self.Leaf('/yoda/hosts/host2/locations/-/upstream',
+                      'mock-app-two-v1-8080', False),
+        ]
+
+        # When: I decommission the app (dry run)
+        result = self.client.decommission('mock-app', dry_run=True)
+
+        # Then: Deletes for mock-app only are planned
+        eq_(result.dry_run, True)
+        eq_(result.success, False)
+        eq_(result.upstreams, ['mock-app-v1-8080'])
+        eq_(result.planned, ['/yoda/hosts/host1',
+                             '/yoda/upstreams/mock-app-v1-8080'])
+        eq_(result.deleted, [])
+
+        # And: Nothing is deleted
+        eq_(self.etcd_cl.delete.called, False)
+        eq_(self.etcd_cl.set.called, False)
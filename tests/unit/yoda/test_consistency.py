@@ -0,0 +1,78 @@
+"""
+Test for yoda.consistency
+"""
+from nose.tools import eq_, raises
+from yoda.consistency import as_consistency, Consistency, FOLLOWER, \
+    IndexTracker, LEADER, LEVEL_FOLLOWER, LINEARIZABLE
+
+__author__ = 'sukrit'
+
+
+def test_read_options():
+    """
+    Should map consistency levels to etcd read options.
+    """
+    eq_(LINEARIZABLE.read_options, {'quorum': True})
+    eq_(LEADER.read_options, {})
+    eq_(FOLLOWER.read_options, {})
+
+
+def test_as_consistency():
+    """
+    Should create consistency from level name.
+    """
+    eq_(as_consistency('leader'), LEADER)
+    eq_(as_consistency(LINEARIZABLE), LINEARIZABLE)
+    eq_(as_consistency(None), None)
+
+
+@raises(ValueError)
+def test_invalid_level():
+    """
+    Should reject unknown consistency levels.
+    """
+    Consistency('eventual')
+
+
+@raises(ValueError)
+def test_max_staleness_for_linearizable():
+    """
+    Should reject max_staleness for levels other than follower.
+    """
+    Consistency('linearizable', max_staleness=10)
+
+
+def test_is_stale():
+    """
+    Should compare read index with highest seen index.
+    """
+
+    # Given: Bounded follower consistency
+    consistency = Consistency(LEVEL_FOLLOWER, max_staleness=10)
+
+    # Then: Reads lagging more than max_staleness are stale
+    eq_(consistency.is_stale(90, 100), False)
+    eq_(consistency.is_stale(89, 100), True)
+
+    # And: Reads are not stale when index is unknown
+    eq_(consistency.is_stale(None, 100), False)
+    eq_(consistency.is_stale(89, None), False)
+
+    # And: Unbounded reads are never stale
+    eq_(FOLLOWER.is_stale(1, 100), False)
+
+
+def test_index_tracker():
+    """
+    Should track highest integer index.
+    """
+
+    # Given: Index tracker
+    tracker = IndexTracker()
+
+    # When: I observe indexes
+    for index in (10, 5, None, 'invalid', 12):
+        tracker.observe(index)
+
+    # Then: Highest index is tracked
+    eq_(tracker.highest, 12)
@@ -0,0 +1,166 @@
+"""
+Test for yoda.events
+"""
+import etcd
+from mock import MagicMock
+from nose.tools import eq_
+from yoda.client import Client
+from yoda.events import to_domain_event, Coalescer, ChangeStream, \
+    NodeDiscovered, NodeRemoved, NodeMetaChanged, UpstreamRegistered, \
+    UpstreamExpired, LocationChanged, HostUnwired, TcpListenerChanged, \
+    HostAliasesChanged, TreeResynced
+from yoda.watch import WatchEvent
+
+__author__ = 'sukrit'
+
+
+def _event(action, key, value=None, is_dir=False, index=1):
+    return WatchEvent(action, key, value, index, is_dir)
+
+
+def _translate(action, key, value=None):
+    translated = to_domain_event(_event(action, key, value))
+    return translated[1] if translated else None
+
+
+def test_to_domain_event():
+    """
+    Should translate raw events into domain events.
+    """
+
+    # Then: Raw events are translated as expected
+    eq_(_translate('set', '/yoda/upstreams/up1/endpoints/node1', 'h1:80'),
+        NodeDiscovered('up1', 'node1', 'h1:80'))
+    eq_(_translate('expire', '/yoda/upstreams/up1/endpoints/node1'),
+        NodeRemoved('up1', 'node1'))
+    eq_(_translate('set', '/yoda/upstreams/up1/endpoints-meta/node1/unit'),
+        NodeMetaChanged('up1', 'node1', frozenset(['unit'])))
+    eq_(_translate('set', '/yoda/upstreams/up1'),
+        UpstreamRegistered('up1'))
+    eq_(_translate('set', '/yoda/upstreams/up1/health/uri', '/'),
+        UpstreamRegistered('up1'))
+    eq_(_translate('expire', '/yoda/upstreams/up1'),
+        UpstreamExpired('up1'))
+    eq_(_translate('set', '/yoda/hosts/host1/locations/-/acls/allowed/a'),
+        LocationChanged('host1', '-'))
+    eq_(_translate('set', '/yoda/hosts/host1/aliases/alias1', 'alias1'),
+        HostAliasesChanged('host1'))
+    eq_(_translate('delete', '/yoda/hosts/host1'), HostUnwired('host1'))
+    eq_(_translate('set', '/yoda/global/listeners/tcp/l1/bind', '*:80'),
+        TcpListenerChanged('l1'))
+    eq_(_translate('set', '/yoda/generation', '{}'), None)
+    eq_(_translate('set', '/other/key', 'value'), None)
+
+
+def test_coalescer_merges_bursts():
+    """
+    Should merge events for the same entity.
+    """
+
+    # Given: Burst of raw events
+    coalescer = Coalescer()
+    for event in [
+        _event('set', '/yoda/upstreams/up1'),
+        _event('set', '/yoda/upstreams/up1/mode', 'http'),
+        _event('set', '/yoda/upstreams/up1/endpoints/node1', 'h1:80'),
+        _event('set', '/yoda/upstreams/up1/endpoints-meta/node1/a', '1'),
+        _event('set', '/yoda/upstreams/up1/endpoints-meta/node1/b', '2'),
+        _event('set', '/yoda/upstreams/up1/endpoints/node1', 'h2:80'),
+        _event('set', '/yoda/hosts/host1/locations/-/path', '/'),
+        _event('set', '/yoda/hosts/host2/locations/-/path', '/'),
+        _event('delete', '/yoda/hosts/host1', is_dir=True),
+    ]:
+        coalescer.add(event)
+
+    # When: I flush the coalescer
+    events = coalescer.flush()
+
+    # Then: One event per entity is returned
+    eq_(events, [
+        UpstreamRegistered('up1'),
+        NodeDiscovered('up1', 'node1', 'h2:80'),
+        NodeMetaChanged('up1', 'node1', frozenset(['a', 'b'])),
+        LocationChanged('host2', '-'),
+        HostUnwired('host1'),
+    ])
+    eq_(len(coalescer), 0)
+
+
+def test_change_stream():
+    """
+    Should stream merged domain events.
+    """
+
+    # Given: Source of raw events
+    source = [
+        _event('set', '/yoda/upstreams/up1/endpoints/node1', 'h1:80'),
+        _event('expire', '/yoda/upstreams/up1/endpoints/node1'),
+        _event('set', '/yoda/global/listeners/tcp/l1/bind', '*:80'),
+    ]
+
+    # When: I consume the change stream
+    events = list(ChangeStream(source, window=1))
+
+    # Then: Merged events are returned
+    eq_(events, [NodeRemoved('up1', 'node1'), TcpListenerChanged('l1')])
+
+
+def test_change_stream_commits_processed_batches():
+    """
+    Should commit a batch only after it has been processed.
+    """
+
+    # Given: Change stream for source of raw events
+    commit = MagicMock()
+    batches = ChangeStream([
+        _event('set', '/yoda/upstreams/up1/endpoints/node1', 'h1:80',
+               index=2),
+        _event('set', '/yoda/upstreams/up1/endpoints/node2', 'h2:80',
+               index=3),
+    ], window=1, commit=commit).batches()
+
+    # When: I get the first batch
+    next(batches)
+
+    # Then: Batch is not committed yet
+    eq_(commit.called, False)
+
+    # And: Batch is committed once the next batch is requested
+    eq_(list(batches), [])
+    commit.assert_called_once_with(3)
+
+
+def test_change_stream_resync_after_compaction():
+    """
+    Should emit resync event when the watch restarts from a snapshot.
+    """
+
+    # Given: Client whose checkpointed index has been compacted
+    client = MagicMock(spec=Client)
+    client.etcd_base = '/yoda'
+    client.read_tree.return_value = ({'upstreams': {}}, 100)
+    result = MagicMock(spec=etcd.EtcdResult)
+    result.modifiedIndex = 150
+    result.key = '/yoda/upstreams/up1/endpoints/node1'
+    result.action = 'set'
+    result.value = 'h1:80'
+    result.dir = False
+    client.watch.side_effect = [etcd.EtcdEventIndexCleared('mock'), result]
+    checkpoint = MagicMock()
+    checkpoint.load.return_value = 5
+    stop = MagicMock()
+    stop.is_set.side_effect = [False, False, True]
+
+    # When: I consume the change stream
+    batches = ChangeStream.from_client(client, checkpoint, window=1,
+                                       stop=stop).batches()
+    batch = next(batches)
+
+    # Then: Resync event is emitted before the events after the snapshot
+    eq_(batch, [TreeResynced({'upstreams': {}}, 100),
+                NodeDiscovered('up1', 'node1', 'h1:80')])
+    eq_(checkpoint.save.called, False)
+
+    # And: Batch is checkpointed once processed
+    eq_(list(batches), [])
+    checkpoint.save.assert_called_once_with(150)
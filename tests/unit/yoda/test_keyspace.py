@@ -0,0 +1,101 @@
+"""
+Test for yoda.keyspace
+"""
+from nose.tools import eq_, ok_
+from yoda.keyspace import KeySpace, KeyInfo, ACL_ALLOWED, ACL_DENIED, \
+    KIND_ALIAS, KIND_ENDPOINT, \
+    KIND_ENDPOINT_META, KIND_GENERATION, KIND_HOST, KIND_LISTENER, \
+    KIND_LOCATION, KIND_PROXY_NODE, KIND_UPSTREAM, keyspace_for
+
+__author__ = 'sukrit'
+
+
+def test_build_keys():
+    # Given: Key space with trailing slash in etcd base
+    keyspace = KeySpace('/yoda/')
+
+    # Then: Keys are built relative to the normalized base
+    eq_(keyspace.generation_key, '/yoda/generation')
+    eq_(keyspace.upstream_key('upstream1'), '/yoda/upstreams/upstream1')
+    eq_(keyspace.upstream_key('upstream1', 'health/uri'),
+        '/yoda/upstreams/upstream1/health/uri')
+    eq_(keyspace.endpoint_key('upstream1', 'node1'),
+        '/yoda/upstreams/upstream1/endpoints/node1')
+    eq_(keyspace.endpoints_meta_key('upstream1', 'node1', 'version'),
+        '/yoda/upstreams/upstream1/endpoints-meta/node1/version')
+    eq_(keyspace.location_key('host1', '-', 'upstream'),
+        '/yoda/hosts/host1/locations/-/upstream')
+    eq_(keyspace.alias_key('host1', 'alias1'),
+        '/yoda/hosts/host1/aliases/alias1')
+    eq_(keyspace.listener_key('listener1', 'bind'),
+        '/yoda/global/listeners/tcp/listener1/bind')
+    eq_(keyspace.proxy_node_key('proxy1'), '/yoda/proxy-nodes/proxy1')
+    eq_(keyspace.location_acl_key('host1', '-', ACL_ALLOWED, 'public'),
+        '/yoda/hosts/host1/locations/-/acls/allowed/public')
+    eq_(keyspace.listener_acl_key('listener1', ACL_DENIED, 'black-list'),
+        '/yoda/global/listeners/tcp/listener1/acls/denied/black-list')
+
+
+def test_parse_keys():
+    # Given: Key space
+    keyspace = KeySpace('/yoda')
+
+    # Then: Keys are parsed into kind, name, child and field
+    for key, expected in (
+            ('/yoda/generation', (KIND_GENERATION, None, None, None)),
+            ('/yoda/upstreams', (KIND_UPSTREAM, None, None, None)),
+            ('/yoda/upstreams/u1', (KIND_UPSTREAM, 'u1', None, None)),
+            ('/yoda/upstreams/u1/health/uri',
+             (KIND_UPSTREAM, 'u1', None, 'health/uri')),
+            ('/yoda/upstreams/u1/endpoints',
+             (KIND_ENDPOINT, 'u1', None, None)),
+            ('/yoda/upstreams/u1/endpoints/n1',
+             (KIND_ENDPOINT, 'u1', 'n1', None)),
+            ('/yoda/upstreams/u1/endpoints-meta/n1/version',
+             (KIND_ENDPOINT_META, 'u1', 'n1', 'version')),
+            ('/yoda/hosts/h1', (KIND_HOST, 'h1', None, None)),
+            ('/yoda/hosts/h1/locations', (KIND_LOCATION, 'h1', None, None)),
+            ('/yoda/hosts/h1/locations/-/acls/allowed/public',
+             (KIND_LOCATION, 'h1', '-', 'acls/allowed/public')),
+            ('/yoda/hosts/h1/aliases/a1', (KIND_ALIAS, 'h1', 'a1', None)),
+            ('/yoda/global/listeners/tcp/l1/bind',
+             (KIND_LISTENER, 'l1', None, 'bind')),
+            ('/yoda/proxy-nodes/p1', (KIND_PROXY_NODE, 'p1', None, None))):
+        eq_(keyspace.parse(key), KeyInfo(*expected))
+
+
+def test_parse_keys_outside_layout():
+    # Given: Key space
+    keyspace = KeySpace('/yoda')
+
+    # Then: Keys outside of the layout are not parsed
+    for key in ('/other/upstreams/u1', '/yodax/upstreams/u1',
+                '/yoda/global/listeners/udp/l1', '/yoda/unknown'):
+        eq_(keyspace.parse(key), None)
+
+
+def test_parse_round_trip():
+    # Given: Key space with nested etcd base
+    keyspace = KeySpace('/apps/yoda')
+
+    # When: I parse a built key
+    info = keyspace.parse(keyspace.endpoints_meta_key('u1', 'n1', 'v'))
+
+    # Then: Original parts are returned
+    eq_(info, KeyInfo(KIND_ENDPOINT_META, 'u1', 'n1', 'v'))
+
+
+def test_relative_parts():
+    # Given: Key space
+    keyspace = KeySpace('/yoda')
+
+    # Then: Parts relative to the etcd base are returned
+    eq_(keyspace.relative_parts('/yoda/hosts/h1/aliases/a1'),
+        ['hosts', 'h1', 'aliases', 'a1'])
+    eq_(keyspace.relative_parts('/other/hosts'), None)
+
+
+def test_keyspace_for_is_cached():
+    # Then: Same key space is returned for the same etcd base
+    ok_(keyspace_for('/yoda') is keyspace_for('/yoda'))
+    eq_(keyspace_for('/other').base, '/other')
@@ -1,5 +1,7 @@
-from nose.tools import eq_
-from yoda import Location
+import pickle
+from nose.tools import eq_, ok_, raises
+from yoda import Location, Host
+from yoda.model import TcpListener, FrozenLocation, FrozenHost
 
 
 def test_location_eq():
@@ -16,3 +18,139 @@ def test_location_eq():
 
     # Then: Two locations are equivalent
     eq_(result, True)
+
+
+def test_frozen_location_eq_and_hash():
+    """
+    Should treat locations with same acls (in any order) as equal.
+    """
+
+    # Given: Frozen locations with acls in different order
+    loc1 = FrozenLocation('upstream1', allowed_acls=['acl1', 'acl2'])
+    loc2 = FrozenLocation('upstream1', allowed_acls=['acl2', 'acl1'])
+
+    # Then: Locations are equal and can be used in sets
+    eq_(loc1, loc2)
+    eq_(hash(loc1), hash(loc2))
+    eq_(len(set([loc1, loc2])), 1)
+    ok_(loc1 != FrozenLocation('upstream2'))
+
+
+@raises(AttributeError)
+def test_frozen_location_is_immutable():
+    """
+    Should not allow modification of frozen location.
+    """
+
+    # When: I modify frozen location
+    FrozenLocation('upstream1').upstream = 'upstream2'
+
+    # Then: AttributeError is raised
+
+
+def test_frozen_location_has_no_dict():
+    """
+    Should use slots for frozen location.
+    """
+
+    # Then: Frozen location has no instance dictionary
+    eq_(hasattr(FrozenLocation('upstream1'), '__dict__'), False)
+
+
+def test_location_freeze_and_thaw():
+    """
+    Should convert between mutable and frozen location.
+    """
+
+    # Given: Existing location
+    location = Location('upstream1', path='/path1', force_ssl=True)
+
+    # When: I freeze and thaw the location
+    frozen = location.freeze()
+
+    # Then: Location is converted as expected
+    eq_(frozen.location_name, '-path1')
+    eq_(frozen.allowed_acls, frozenset(['public']))
+    eq_(frozen.thaw(), location)
+
+
+def test_frozen_host_from_dict():
+    """
+    Should create frozen host from dictionary.
+    """
+
+    # Given: Existing frozen host
+    host = Host('mockhost', [Location('upstream1')],
+                aliases=['alias1']).freeze()
+
+    # When: I convert host to dictionary and back
+    copy = FrozenHost.from_dict(host.to_dict())
+
+    # Then: Same host is returned
+    eq_(copy, host)
+    eq_(copy.locations, (FrozenLocation('upstream1'),))
+    eq_({host: 'mock'}[copy], 'mock')
+
+
+def test_frozen_host_to_dict():
+    """
+    Should convert frozen host (with nested locations) to dictionary.
+    """
+
+    # Given: Existing frozen host
+    host = FrozenHost('mockhost', [Location('upstream1', path='/path1')],
+                      aliases=['alias2', 'alias1'])
+
+    # When: I convert host to dictionary
+    values = host.to_dict()
+
+    # Then: Fields are converted to plain values
+    eq_(values, {
+        'hostname': 'mockhost',
+        'locations': [{
+            'upstream': 'upstream1',
+            'path': '/path1',
+            'location_name': '-path1',
+            'allowed_acls': ['public'],
+            'denied_acls': ['global-black-list'],
+            'force_ssl': False
+        }],
+        'aliases': ['alias1', 'alias2']
+    })
+
+
+def test_frozen_host_pickle():
+    """
+    Should be able to pickle frozen host.
+    """
+
+    # Given: Existing frozen host
+    host = FrozenHost('mockhost', [Location('upstream1')])
+
+    # When: I pickle and unpickle the host
+    copy = pickle.loads(pickle.dumps(host))
+
+    # Then: Same host is returned
+    eq_(copy, host)
+
+
+def test_frozen_tcp_listener():
+    """
+    Should convert between mutable and frozen tcp listener.
+    """
+
+    # Given: Existing tcp listener
+    listener = TcpListener('listener1', '*:32768', allowed_acls=['acl1'])
+
+    # When: I freeze the listener
+    frozen = listener.freeze()
+
+    # Then: Listener is converted as expected
+    eq_(frozen.to_dict(), {
+        'name': 'listener1',
+        'bind': '*:32768',
+        'upstream': None,
+        'allowed_acls': ['acl1'],
+        'denied_acls': []
+    })
+    eq_(frozen.thaw(), listener)
@@ -0,0 +1,173 @@
+"""
+Test for yoda.ratelimit
+"""
+import os
+import shutil
+import tempfile
+from nose.tools import eq_, ok_, raises
+from yoda.ratelimit import TokenBucket, jitter, PRIORITY_REMOVE, \
+    PRIORITY_REGISTER
+
+
+class MockClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_jitter_without_fraction():
+    """
+    Should return value as is when jitter fraction is not specified.
+    """
+
+    # When: I jitter value without any fraction
+    value = jitter(30, 0)
+
+    # Then: Value is returned as is
+    eq_(value, 30)
+
+
+def test_jitter_within_bounds():
+    """
+    Should return value within +/- fraction of original value.
+    """
+
+    # When: I jitter the value multiple times
+    values = [jitter(100, 0.1) for _ in range(100)]
+
+    # Then: All values are within bounds
+    ok_(all(90 <= value <= 110 for value in values))
+
+
+@raises(ValueError)
+def test_token_bucket_with_invalid_rate():
+    """
+    Should raise ValueError for non positive rate.
+    """
+
+    # When: I create bucket with zero rate
+    TokenBucket(0)
+
+    # Then: ValueError is raised
+
+
+class TestTokenBucket():
+
+    def setup(self):
+        self.clock = MockClock()
+        self.bucket = TokenBucket(2, burst=2, clock=self.clock)
+
+    def test_acquire_within_burst(self):
+        """
+        Should acquire tokens without waiting when bucket is not empty.
+        """
+
+        # When: I acquire tokens within burst
+        waited = [self.bucket.acquire() for _ in range(2)]
+
+        # Then: No wait happens
+        eq_(waited, [0, 0])
+
+    @raises(ValueError)
+    def test_acquire_more_than_burst(self):
+        """
+        Should raise ValueError when more tokens than burst are requested.
+        """
+
+        # When: I acquire more tokens than burst
+        self.bucket.acquire(tokens=3)
+
+        # Then: ValueError is raised
+
+    def test_acquire_reports_time_waited(self):
+        """
+        Should report the time actually spent waiting.
+        """
+
+        # Given: Empty bucket
+        self.bucket.acquire(tokens=2)
+
+        # And: Waiter that is woken up before the requested wait
+        def wait(timeout):
+            self.clock.now += 0.1
+        self.bucket._cond.wait = wait
+
+        # When: I acquire a token
+        waited = self.bucket.acquire()
+
+        # Then: Time spent waiting is returned
+        ok_(abs(waited - 0.5) < 1e-6)
+
+    def test_take_when_bucket_is_empty(self):
+        """
+        Should return wait duration when bucket is empty.
+        """
+
+        # Given: Empty bucket
+        self.bucket._take_local(2)
+
+        # When: I try to take a token
+        wait = self.bucket._take_local(1)
+
+        # Then: Caller is asked to wait for refill
+        eq_(wait, 0.5)
+
+    def test_take_after_refill(self):
+        """
+        Should refill tokens based on elapsed time.
+        """
+
+        # Given: Empty bucket
+        self.bucket._take_local(2)
+
+        # When: I take token after refill interval
+        self.clock.now += 0.5
+        wait = self.bucket._take_local(1)
+
+        # Then: Token is granted
+        eq_(wait, 0)
+
+    def test_priority_waiters(self):
+        """
+        Should report higher priority waiters.
+        """
+
+        # Given: Waiter with removal priority
+        self.bucket._waiting[PRIORITY_REMOVE] = 1
+
+        # Then: Registrations need to wait for removal
+        eq_(self.bucket._has_priority_waiters(PRIORITY_REGISTER), True)
+        eq_(self.bucket._has_priority_waiters(PRIORITY_REMOVE), False)
+
+
+class TestSharedTokenBucket():
+
+    def setup(self):
+        self.clock = MockClock()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lock_file = os.path.join(self.tmp_dir, 'yoda.lock')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_buckets_share_budget(self):
+        """
+        Should share tokens across buckets using same lock file.
+        """
+
+        # Given: Two buckets sharing the same lock file
+        bucket1 = TokenBucket(1, burst=1, lock_file=self.lock_file,
+                              clock=self.clock)
+        bucket2 = TokenBucket(1, burst=1, lock_file=self.lock_file,
+                              clock=self.clock)
+
+        # When: Both buckets try to take a token
+        wait1 = bucket1._take_shared(1)
+        wait2 = bucket2._take_shared(1)
+
+        # Then: Only first bucket gets the token
+        eq_(wait1, 0)
+        eq_(wait2, 1)
@@ -0,0 +1,182 @@
+"""
+Test for yoda.render
+"""
+from nose.tools import eq_, ok_
+from yoda.render import HaproxyTemplates, Renderer, SECTION_BACKEND, \
+    SECTION_FRONTEND, SECTION_LISTENER
+from yoda.watch import WatchEvent
+
+__author__ = 'sukrit'
+
+MOCK_TREE = {
+    'upstreams': {
+        'upstream1': {
+            'mode': 'http',
+            'endpoints': {
+                'node1': 'host1:40001',
+            }
+        },
+        'upstream2': {
+            'mode': 'tcp'
+        }
+    },
+    'hosts': {
+        'mockhost': {
+            'locations': {
+                '-': {
+                    'path': '/',
+                    'upstream': 'upstream1',
+                    'force-ssl': 'true',
+                    'acls': {'allowed': {'public': 'public'}}
+                }
+            },
+            'aliases': {'mockalias': 'mockalias'}
+        }
+    },
+    'global': {
+        'listeners': {
+            'tcp': {
+                'listener1': {'bind': '*:32768', 'upstream': 'upstream2'}
+            }
+        }
+    }
+}
+
+
+def _event(action, key, value=None, is_dir=False):
+    return WatchEvent(action, key, value, 1, is_dir)
+
+
+class CountingTemplates(HaproxyTemplates):
+
+    def __init__(self):
+        self.calls = []
+
+    def frontend(self, host, table):
+        self.calls.append((SECTION_FRONTEND, host.hostname))
+        return HaproxyTemplates.frontend(self, host, table)
+
+    def backend(self, upstream, nodes, table):
+        self.calls.append((SECTION_BACKEND, upstream))
+        return HaproxyTemplates.backend(self, upstream, nodes, table)
+
+
+class TestRenderer():
+
+    def setup(self):
+        self.templates = CountingTemplates()
+        self.renderer = Renderer.from_tree(MOCK_TREE,
+                                           templates=self.templates)
+
+    def test_render_all(self):
+        """
+        Should render all sections for the tree.
+        """
+
+        # When: I render the tree
+        changed = self.renderer.render()
+
+        # Then: All sections are rendered
+        eq_(set(changed), set([
+            (SECTION_FRONTEND, 'mockhost'),
+            (SECTION_BACKEND, 'upstream1'),
+            (SECTION_BACKEND, 'upstream2'),
+            (SECTION_LISTENER, 'listener1'),
+        ]))
+        config = self.renderer.config()
+        ok_('acl host_mockhost hdr(host) -i mockhost mockalias' in config)
+        ok_('use_backend upstream1 if host_mockhost path_mockhost__ public '
+            '!global-black-list' in config)
+        ok_('redirect scheme https' in config)
+        ok_('backend upstream1\n    server node1 host1:40001 check\n'
+            in config)
+        ok_('default_backend upstream2' in config)
+        ok_(config.index('acl host_mockhost') <
+            config.index('backend upstream1') <
+            config.index('frontend tcp_listener1'))
+
+    def test_render_node_change(self):
+        """
+        Should re-render only the backend for a node change.
+        """
+
+        # Given: Rendered config
+        self.renderer.render()
+        del self.templates.calls[:]
+
+        # When: I discover a node
+        self.renderer.apply(_event(
+            'set', '/yoda/upstreams/upstream1/endpoints/node2',
+            'host2:40001'))
+        changed = self.renderer.render()
+
+        # Then: Only the backend is re-rendered
+        eq_(changed, [(SECTION_BACKEND, 'upstream1')])
+        eq_(self.templates.calls, [(SECTION_BACKEND, 'upstream1')])
+        ok_('server node2 host2:40001' in self.renderer.config())
+
+    def test_render_unchanged(self):
+        """
+        Should not report changes when rendered text is the same.
+        """
+
+        # Given: Rendered config
+        self.renderer.render()
+        checksums = self.renderer.checksums()
+
+        # When: Node is re-discovered with the same endpoint
+        self.renderer.apply(_event(
+            'update', '/yoda/upstreams/upstream1/endpoints/node1',
+            'host1:40001'))
+
+        # Then: No section has changed
+        eq_(self.renderer.render(), [])
+        eq_(self.renderer.checksums(), checksums)
+
+    def test_render_removed_sections(self):
+        """
+        Should remove sections for unwired hosts and expired upstreams.
+        """
+
+        # Given: Rendered config
+        self.renderer.render()
+
+        # When: Upstream expires and host gets unwired
+        self.renderer.apply(_event('expire', '/yoda/upstreams/upstream2',
+                                   is_dir=True))
+        self.renderer.apply(_event('delete', '/yoda/hosts/mockhost',
+                                   is_dir=True))
+        changed = self.renderer.render()
+
+        # Then: Sections are removed (including listener for the upstream)
+        eq_(changed, [
+            (SECTION_BACKEND, 'upstream2'),
+            (SECTION_FRONTEND, 'mockhost'),
+            (SECTION_LISTENER, 'listener1'),
+        ])
+        config = self.renderer.config()
+        ok_('mockhost' not in config)
+        ok_('upstream2' not in config)
+
+    def test_reset(self):
+        """
+        Should re-render all sections for a new snapshot.
+        """
+
+        # Given: Rendered config
+        self.renderer.render()
+
+        # When: I reset the renderer with an empty tree
+        self.renderer.reset({}, 10)
+
+        # Then: All sections are removed
+        eq_(len(self.renderer.render()), 4)
+        eq_(self.renderer.config(), HaproxyTemplates().header())
+
+    def test_apply_irrelevant_event(self):
+        """
+        Should ignore events outside of the yoda tree.
+        """
+        eq_(self.renderer.apply(_event('set', '/other/key', 'value')), False)
+        eq_(self.renderer.apply(_event('set', '/yoda/generation', '{}')),
+            False)
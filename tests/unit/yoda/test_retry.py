@@ -0,0 +1,89 @@
+"""
+Test for yoda.retry
+"""
+import etcd
+from nose.tools import eq_, ok_
+from yoda.retry import Deadline, DeadlineExceeded, RetryPolicy
+
+__author__ = 'sukrit'
+
+
+def test_deadline():
+    """
+    Should track remaining time for the deadline.
+    """
+
+    # Given: Deadline with mock clock
+    now = [100.0]
+    deadline = Deadline(5, clock=lambda: now[0])
+
+    # When: Time passes
+    now[0] = 103.0
+
+    # Then: Remaining time is computed
+    eq_(deadline.remaining(), 2.0)
+    eq_(deadline.expired, False)
+
+    # And: Deadline expires
+    now[0] = 106.0
+    eq_(deadline.remaining(), 0)
+    eq_(deadline.expired, True)
+
+
+def test_backoff():
+    """
+    Should use exponential backoff capped at max delay.
+    """
+
+    # Given: Retry policy without jitter
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.3, jitter_fraction=0)
+
+    # Then: Delays grow exponentially
+    eq_([policy.backoff(attempt) for attempt in (1, 2, 3)], [0.1, 0.2, 0.3])
+
+
+def test_backoff_with_jitter():
+    """
+    Should randomize backoff using jitter.
+    """
+
+    # Given: Retry policy with jitter
+    policy = RetryPolicy(base_delay=1, jitter_fraction=0.5)
+
+    # Then: Delay is randomized within bounds
+    for _ in range(50):
+        delay = policy.backoff(1)
+        ok_(0.5 <= delay <= 1.5)
+
+
+def test_should_retry():
+    """
+    Should retry only transient errors within max attempts.
+    """
+
+    # Given: Retry policy
+    policy = RetryPolicy(max_attempts=2)
+
+    # Then: Only transient errors are retried
+    eq_(policy.should_retry(etcd.EtcdConnectionFailed(), 1), True)
+    eq_(policy.should_retry(etcd.EtcdConnectionFailed(), 2), False)
+    eq_(policy.should_retry(etcd.EtcdCompareFailed(), 1), False)
+    eq_(policy.should_retry(KeyError(), 1), False)
+
+    # And: Watch timeouts are not retried
+    eq_(policy.should_retry(etcd.EtcdWatchTimedOut('timeout'), 1), False)
+
+
+def test_deadline_exceeded():
+    """
+    Should report partial progress.
+    """
+
+    # When: I create deadline exceeded error
+    error = DeadlineExceeded('wire_proxy', 5,
+                             completed=[('set', '/yoda/hosts/h1/a')])
+
+    # Then: Partial progress is reported
+    eq_(error.completed, [('set', '/yoda/hosts/h1/a')])
+    eq_(str(error), 'wire_proxy did not complete within 5s '
+                    '(1 write(s) completed)')
@@ -0,0 +1,180 @@
+"""
+Test for yoda.routing
+"""
+from mock import MagicMock
+from nose.tools import eq_
+from yoda.client import Client
+from yoda.model import FrozenLocation
+from yoda.routing import RoutingTable
+
+__author__ = 'sukrit'
+
+MOCK_TREE = {
+    'upstreams': {
+        'upstream1': {
+            'mode': 'http',
+            'endpoints': {
+                'node1': 'host1:40001',
+                'node2': 'host2:40001',
+            }
+        },
+        'upstream2': {
+            'mode': 'tcp'
+        }
+    },
+    'hosts': {
+        'mockhost': {
+            'locations': {
+                '-': {
+                    'path': '/',
+                    'upstream': 'upstream1',
+                    'force-ssl': 'true',
+                    'acls': {'allowed': {'public': 'public'}}
+                }
+            },
+            'aliases': {'mockalias': 'mockalias'}
+        }
+    },
+    'global': {
+        'listeners': {
+            'tcp': {
+                'listener1': {'bind': '*:32768', 'upstream': 'upstream2'}
+            }
+        }
+    }
+}
+
+
+class TestRoutingTable():
+
+    def setup(self):
+        self.table = RoutingTable.from_tree(MOCK_TREE)
+
+    def test_from_tree(self):
+        """
+        Should index the yoda tree.
+        """
+
+        # Then: Routing table is indexed as expected
+        eq_(self.table.get_nodes('upstream1'), {
+            'node1': 'host1:40001',
+            'node2': 'host2:40001',
+        })
+        eq_(self.table.get_locations('mockhost'), {
+            '-': FrozenLocation('upstream1', force_ssl=True,
+                                allowed_acls=['public'])
+        })
+        eq_(self.table.get_hostname_for_alias('mockalias'), 'mockhost')
+        eq_(self.table.get_locations_for_upstream('upstream1'),
+            set([('mockhost', '-')]))
+        eq_(self.table.get_listeners_for_upstream('upstream2'),
+            set(['listener1']))
+        eq_(self.table.get_nodes_for_endpoint('host1:40001'),
+            set([('upstream1', 'node1')]))
+        eq_(self.table.empty_upstreams, set(['upstream2']))
+
+    def test_from_client(self):
+        """
+        Should build routing table using yoda client.
+        """
+
+        # Given: Yoda client
+        client = MagicMock(spec=Client)
+        client.etcd_base = '/yoda'
+        client.read_tree.return_value = (MOCK_TREE, 1234)
+
+        # When: I build routing table from client
+        table = RoutingTable.from_client(client)
+
+        # Then: Routing table is built
+        eq_(table.upstreams, set(['upstream1', 'upstream2']))
+
+    def test_apply_node_events(self):
+        """
+        Should update nodes and empty upstreams for node events.
+        """
+
+        # When: I apply node events
+        self.table.apply_event('set', '/yoda/upstreams/upstream2/endpoints/'
+                                      'node3', 'host1:40001')
+        self.table.apply_event('expire', '/yoda/upstreams/upstream1/'
+                                         'endpoints/node1')
+        self.table.apply_event('delete', '/yoda/upstreams/upstream1/'
+                                         'endpoints/node2')
+
+        # Then: Nodes are updated
+        eq_(self.table.get_nodes('upstream1'), {})
+        eq_(self.table.get_nodes_for_endpoint('host1:40001'),
+            set([('upstream2', 'node3')]))
+        eq_(self.table.empty_upstreams, set(['upstream1']))
+
+    def test_apply_upstream_removal(self):
+        """
+        Should remove upstream with its nodes.
+        """
+
+        # When: I remove upstream
+        self.table.apply_event('delete', '/yoda/upstreams/upstream1',
+                               is_dir=True)
+
+        # Then: Upstream and its nodes are removed
+        eq_(self.table.upstreams, set(['upstream2']))
+        eq_(self.table.get_nodes_for_endpoint('host1:40001'), set())
+
+    def test_apply_location_events(self):
+        """
+        Should re-index location when its keys change.
+        """
+
+        # When: I change the upstream for location and add a new location
+        self.table.apply_event('set', '/yoda/hosts/mockhost/locations/-/'
+                                      'upstream', 'upstream2')
+        self.table.apply_event('set', '/yoda/hosts/mockhost/locations/'
+                                      '-path1/upstream', 'upstream2')
+        self.table.apply_event('delete', '/yoda/hosts/mockhost/locations/-/'
+                                         'acls/allowed/public')
+
+        # Then: Locations are re-indexed
+        eq_(self.table.get_locations_for_upstream('upstream1'), set())
+        eq_(self.table.get_locations_for_upstream('upstream2'),
+            set([('mockhost', '-'), ('mockhost', '-path1')]))
+        eq_(self.table.get_locations('mockhost')['-'].upstream, 'upstream2')
+
+    def test_apply_host_removal(self):
+        """
+        Should remove host with its locations and aliases.
+        """
+
+        # When: I unwire the host
+        self.table.apply_event('delete', '/yoda/hosts/mockhost', is_dir=True)
+
+        # Then: Host gets removed
+        eq_(self.table.get_locations('mockhost'), {})
+        eq_(self.table.get_hostname_for_alias('mockalias'), None)
+        eq_(self.table.get_locations_for_upstream('upstream1'), set())
+        eq_(self.table.hostnames, set())
+
+    def test_apply_listener_events(self):
+        """
+        Should re-index tcp listeners.
+        """
+
+        # When: I remove listener
+        self.table.apply_event('delete',
+                               '/yoda/global/listeners/tcp/listener1',
+                               is_dir=True)
+
+        # Then: Listener gets removed
+        eq_(self.table.get_listener('listener1'), None)
+        eq_(self.table.get_listeners_for_upstream('upstream2'), set())
+
+    def test_apply_irrelevant_event(self):
+        """
+        Should ignore events outside yoda tree.
+        """
+
+        # When: I apply event outside yoda tree
+        result = self.table.apply_event('set', '/other/key', 'value')
+
+        # Then: Event is ignored
+        eq_(result, False)
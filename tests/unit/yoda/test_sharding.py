@@ -0,0 +1,443 @@
+"""
+Test for yoda.sharding
+"""
+import etcd
+from mock import MagicMock
+from nose.tools import eq_, ok_, raises
+from yoda import Host, Location
+from yoda.client import Client, NoMatchingLocations
+from yoda.consistency import LINEARIZABLE
+from yoda.sharding import HashRing, ShardedClient
+
+__author__ = 'sukrit'
+
+MOCK_NAMES = ['upstream-%d' % index for index in range(1000)]
+
+
+def test_hash_ring_is_stable():
+    """
+    Should place the same name on same node irrespective of node order.
+    """
+
+    # Given: Two rings with same nodes added in different order
+    ring1 = HashRing(['shard1', 'shard2', 'shard3'])
+    ring2 = HashRing(['shard3', 'shard1', 'shard2'])
+
+    # Then: Names get placed on the same nodes
+    eq_([ring1.get(name) for name in MOCK_NAMES],
+        [ring2.get(name) for name in MOCK_NAMES])
+
+
+def test_hash_ring_distributes_names():
+    """
+    Should use all nodes for placing names.
+    """
+
+    # Given: Ring with three nodes
+    ring = HashRing(['shard1', 'shard2', 'shard3'])
+
+    # When: I place names on the ring
+    placed = set(ring.get(name) for name in MOCK_NAMES)
+
+    # Then: All nodes get used
+    eq_(placed, set(['shard1', 'shard2', 'shard3']))
+
+
+def test_hash_ring_add_moves_few_names():
+    """
+    Should only move names to the newly added node.
+    """
+
+    # Given: Existing ring with names placed
+    ring = HashRing(['shard1', 'shard2', 'shard3'])
+    before = dict((name, ring.get(name)) for name in MOCK_NAMES)
+
+    # When: I add a new node
+    ring.add('shard4')
+    after = dict((name, ring.get(name)) for name in MOCK_NAMES)
+
+    # Then: Only names relocated to the new node have moved
+    moved = [name for name in MOCK_NAMES if before[name] != after[name]]
+    ok_(all(after[name] == 'shard4' for name in moved))
+    ok_(len(moved) < len(MOCK_NAMES) / 2)
+
+
+def test_hash_ring_remove():
+    """
+    Should not place names on removed node.
+    """
+
+    # Given: Existing ring
+    ring = HashRing(['shard1', 'shard2'])
+
+    # When: I remove a node
+    ring.remove('shard2')
+
+    # Then: All names are placed on remaining node
+    eq_(set(ring.get(name) for name in MOCK_NAMES), set(['shard1']))
+    eq_(ring.nodes, ['shard1'])
+
+
+@raises(ValueError)
+def test_hash_ring_get_for_empty_ring():
+    """
+    Should raise ValueError when ring has no nodes.
+    """
+
+    # When: I get node from empty ring
+    HashRing().get('mock')
+
+    # Then: ValueError is raised
+
+
+def _fake_etcd():
+    """
+    Creates mock etcd client backed by a dictionary of key to tuple (value,
+    ttl), supporting the calls used for moving entities between shards.
+    """
+    store = dict()
+    etcd_cl = MagicMock(spec=etcd.Client)
+
+    def node_for(key, recursive, top=True):
+        if key in store:
+            value, ttl = store[key]
+            return {'key': key, 'value': value, 'ttl': ttl}
+        children = sorted(set(
+            '%s/%s' % (key, child[len(key) + 1:].split('/')[0])
+            for child in store if child.startswith(key + '/')))
+        if not children:
+            raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+        node = {'key': key, 'dir': True}
+        if top or recursive:
+            node['nodes'] = [node_for(child, recursive, top=False)
+                             for child in children]
+        return node
+
+    def read(key, recursive=False, **kwargs):
+        return etcd.EtcdResult(node=node_for(key, recursive))
+
+    def write(key, value, ttl=None, dir=False, prevExist=None, **kwargs):
+        if dir:
+            return
+        if prevExist is False and key in store:
+            raise etcd.EtcdAlreadyExist('Key already exists : %s' % key)
+        store[key] = (value, ttl)
+
+    def delete(key, recursive=False, **kwargs):
+        node_for(key, recursive)
+        for existing in list(store):
+            if existing == key or existing.startswith(key + '/'):
+                del store[existing]
+
+    def test_and_set(key, value, prev_value, ttl=None):
+        if store.get(key, (None, None))[0] != prev_value:
+            raise ValueError('Compare failed : %s' % key)
+        store[key] = (value, ttl)
+
+    etcd_cl.read.side_effect = read
+    etcd_cl.write.side_effect = write
+    etcd_cl.test_and_set.side_effect = test_and_set
+    etcd_cl.set.side_effect = lambda key, value, ttl=None: write(key, value,
+                                                                 ttl)
+    etcd_cl.delete.side_effect = delete
+    etcd_cl.store = store
+    return etcd_cl
+
+
+def test_rebalance_after_add_shard():
+    """
+    Should move only relocated entities to the new shard.
+    """
+
+    # Given: Upstreams discovered on a single shard
+    etcd_cl1, etcd_cl2 = _fake_etcd(), _fake_etcd()
+    client = ShardedClient({'shard1': {'etcd_cl': etcd_cl1}})
+    upstreams = MOCK_NAMES[:20]
+    for upstream in upstreams:
+        client.discover_node(upstream, 'node1', 'host1:8080', ttl=60)
+
+    # When: I add a shard and rebalance
+    client.add_shard('shard2', {'etcd_cl': etcd_cl2})
+    moved = [upstream for upstream in upstreams
+             if client.ring.get(upstream) == 'shard2']
+    results, failures = client.rebalance()
+
+    # Then: Relocated upstreams are moved to the new shard
+    eq_(failures, {})
+    ok_(moved)
+    eq_(sorted(results), sorted(('shard1', '/yoda/upstreams/%s' % upstream)
+                                for upstream in moved))
+    eq_(etcd_cl2.store['/yoda/upstreams/%s/endpoints/node1' % moved[0]],
+        ('host1:8080', 60))
+
+    # And: Lookups find the nodes on the owning shard
+    for upstream in upstreams:
+        eq_(client.get_nodes(upstream), {'node1': 'host1:8080'})
+
+    # And: Moved upstreams are removed from the old shard
+    ok_(not any(key.startswith('/yoda/upstreams/%s/' % upstream)
+                for key in etcd_cl1.store for upstream in moved))
+
+
+class TestShardedClientWithStore():
+
+    def setup(self):
+        self.etcd_cls = dict((name, _fake_etcd())
+                             for name in ('shard1', 'shard2', 'shard3'))
+        self.client = ShardedClient(dict(
+            (name, {'etcd_cl': etcd_cl})
+            for name, etcd_cl in self.etcd_cls.items()))
+
+    def _owner_store(self, name):
+        return self.etcd_cls[self.client.ring.get(name)].store
+
+    def _wire(self, hostname, upstream):
+        self.client.wire_proxy(Host(hostname, locations=[
+            Location(upstream)]))
+
+    def test_discover_and_remove_nodes(self):
+        """
+        Should discover and remove nodes on the shards owning their
+        upstreams.
+        """
+
+        # Given: Nodes for multiple upstreams
+        upstreams = MOCK_NAMES[:20]
+        nodes = [{'upstream': upstream, 'node_name': 'node1',
+                  'endpoint': 'host1:8080'} for upstream in upstreams]
+
+        # When: I discover the nodes
+        results, failures = self.client.discover_nodes(nodes, ttl=60)
+
+        # Then: Nodes are discovered on owning shards
+        eq_(failures, {})
+        eq_(sorted(results), sorted((upstream, 'node1')
+                                    for upstream in upstreams))
+        for upstream in upstreams:
+            eq_(self._owner_store(upstream)[
+                '/yoda/upstreams/%s/endpoints/node1' % upstream],
+                ('host1:8080', 60))
+
+        # And: Statistics are combined across shards
+        stats = self.client.stats()
+        eq_(stats.nodes, 20)
+        eq_(stats.upstreams, 20)
+        eq_(stats.etcd_index, None)
+
+        # When: I remove the nodes
+        results, failures = self.client.remove_nodes(
+            [(upstream, 'node1') for upstream in upstreams])
+
+        # Then: Nodes are removed from owning shards
+        eq_(failures, {})
+        eq_(self.client.stats().nodes, 0)
+
+    def test_decommission_across_shards(self):
+        """
+        Should remove routes and upstreams of an application from all
+        shards.
+        """
+
+        # Given: Upstreams and hosts for mock-app and another app
+        upstreams = ['mock-app-v%d-8080' % version for version in range(5)]
+        for upstream in upstreams + ['other-app-v1-8080']:
+            self.client.discover_node(upstream, 'node1', 'host1:8080')
+        hostnames = ['mockhost%d' % index for index in range(10)]
+        for index, hostname in enumerate(hostnames):
+            self._wire(hostname, upstreams[index % len(upstreams)])
+        self._wire('otherhost', 'other-app-v1-8080')
+
+        # When: I decommission the app (dry run)
+        plan = self.client.decommission('mock-app', dry_run=True)
+
+        # Then: Deletes are planned across shards without deleting anything
+        eq_(plan.upstreams, upstreams)
+        eq_(sorted(plan.planned), sorted(
+            ['/yoda/hosts/%s' % hostname for hostname in hostnames] +
+            ['/yoda/upstreams/%s' % upstream for upstream in upstreams]))
+        eq_(plan.success, False)
+        for hostname in hostnames:
+            ok_(self._owner_store(hostname))
+
+        # When: I decommission the app
+        result = self.client.decommission('mock-app', dry_run=False)
+
+        # Then: Routes and upstreams of the app are removed
+        eq_(result.success, True)
+        eq_(sorted(result.deleted), sorted(plan.planned))
+        for etcd_cl in self.etcd_cls.values():
+            ok_(not any(key.startswith(('/yoda/upstreams/mock-app',
+                                        '/yoda/hosts/mockhost'))
+                        for key in etcd_cl.store))
+
+        # And: Other app is kept
+        eq_(self.client.get_nodes('other-app-v1-8080'),
+            {'node1': 'host1:8080'})
+        ok_('/yoda/hosts/otherhost/locations/-/upstream' in
+            self._owner_store('otherhost'))
+
+    def test_switch_upstream_across_shards(self):
+        """
+        Should switch locations routing to old upstream on all shards.
+        """
+
+        # Given: Hosts routing to blue and ready green upstream
+        self.client.discover_node('blue', 'node1', 'host1:8080')
+        self.client.discover_node('green', 'node1', 'host2:8080')
+        hostnames = ['mockhost%d' % index for index in range(10)]
+        for hostname in hostnames:
+            self._wire(hostname, 'blue')
+
+        # When: I switch from blue to green
+        result = self.client.switch_upstream('blue', 'green',
+                                             rollback_ttl=600)
+
+        # Then: Locations on all shards are switched
+        eq_(result.success, True)
+        eq_(len(result.switched), 10)
+        for hostname in hostnames:
+            eq_(self._owner_store(hostname)[
+                '/yoda/hosts/%s/locations/-/upstream' % hostname][0],
+                'green')
+
+        # When: I roll back the switch
+        rollback = result.rollback()
+
+        # Then: Locations are switched back to blue
+        eq_(len(rollback.switched), 10)
+        for hostname in hostnames:
+            eq_(self._owner_store(hostname)[
+                '/yoda/hosts/%s/locations/-/upstream' % hostname][0],
+                'blue')
+
+    @raises(NoMatchingLocations)
+    def test_switch_upstream_without_matching_locations(self):
+        """
+        Should raise NoMatchingLocations when no shard routes to old
+        upstream.
+        """
+
+        # Given: Ready green upstream
+        self.client.discover_node('green', 'node1', 'host2:8080')
+
+        # When: I switch from misspelt upstream
+        self.client.switch_upstream('bleu', 'green')
+
+        # Then: NoMatchingLocations is raised
+
+
+class TestShardedClient():
+
+    def setup(self):
+        self.etcd_cls = {
+            'shard1': MagicMock(spec=etcd.Client),
+            'shard2': MagicMock(spec=etcd.Client),
+        }
+        self.client = ShardedClient(dict(
+            (name, {'etcd_cl': etcd_cl})
+            for name, etcd_cl in self.etcd_cls.items()))
+
+    def test_init_with_client_kwargs(self):
+        """
+        Should create clients for shards specified using keyword arguments.
+        """
+
+        # Then: Clients get created for each shard
+        ok_(all(isinstance(shard, Client)
+                for shard in self.client.shards.values()))
+
+    def test_discover_node_is_routed_to_owning_shard(self):
+        """
+        Should discover node on the shard owning the upstream.
+        """
+
+        # When: I discover node for an upstream
+        self.client.discover_node('test', 'testnode', 'localhost:3434')
+
+        # Then: Node gets discovered on owning shard only
+        owner = self.client.ring.get('test')
+        for name, etcd_cl in self.etcd_cls.items():
+            eq_(etcd_cl.set.called, name == owner)
+
+    def test_wire_proxy_is_routed_by_hostname(self):
+        """
+        Should wire host on the shard owning the hostname.
+        """
+
+        # Given: Host to be wired
+        host = Host('mockhost', locations=[Location('test')])
+        for etcd_cl in self.etcd_cls.values():
+            etcd_cl.read.return_value.children = []
+
+        # When: I wire proxy for the host
+        self.client.wire_proxy(host)
+
+        # Then: Host gets wired on owning shard
+        owner = self.client.ring.get('mockhost')
+        self.etcd_cls[owner].set.assert_any_call(
+            '/yoda/hosts/mockhost/locations/-/upstream', 'test')
+
+    def test_unwire_proxy_across_shards(self):
+        """
+        Should remove host and upstreams from their owning shards.
+        """
+
+        # When: I unwire proxy for host with multiple upstreams
+        upstreams = MOCK_NAMES[:20]
+        self.client.unwire_proxy('mockhost', upstreams)
+
+        # Then: Each upstream gets removed from its owning shard
+        for upstream in upstreams:
+            etcd_cl = self.etcd_cls[self.client.ring.get(upstream)]
+            etcd_cl.delete.assert_any_call(
+                '/yoda/upstreams/%s' % upstream, recursive=True, dir=True)
+
+    def test_fan_out(self):
+        """
+        Should invoke method on all shards.
+        """
+
+        # Given: Nodes registered on both shards
+        for name, etcd_cl in self.etcd_cls.items():
+            etcd_cl.read.return_value.children = []
+
+        # When: I fan out get_nodes to all shards
+        results = self.client.fan_out('get_nodes', 'test')
+
+        # Then: Results for all shards are returned
+        eq_(results, {'shard1': {}, 'shard2': {}})
+
+    def test_wire_proxies_across_shards(self):
+        """
+        Should wire hosts on their owning shards.
+        """
+
+        # Given: Hosts to be wired
+        hosts = [Host('mockhost%d' % index, locations=[Location('test')])
+                 for index in range(10)]
+        for etcd_cl in self.etcd_cls.values():
+            etcd_cl.read.side_effect = etcd.EtcdKeyNotFound('mock')
+
+        # When: I wire proxies for the hosts
+        results, failures = self.client.wire_proxies(hosts)
+
+        # Then: All hosts get wired on owning shards
+        eq_(failures, {})
+        eq_(sorted(results), sorted(host.hostname for host in hosts))
+        for host in hosts:
+            etcd_cl = self.etcd_cls[self.client.ring.get(host.hostname)]
+            etcd_cl.set.assert_any_call(
+                '/yoda/hosts/%s/locations/-/upstream' % host.hostname, 'test')
+
+    def test_get_nodes_with_consistency(self):
+        """
+        Should read nodes on owning shard with given consistency.
+        """
+
+        # When: I get nodes with linearizable consistency
+        self.client.get_nodes('test', consistency=LINEARIZABLE)
+
+        # Then: Read is made on owning shard with quorum
+        owner = self.client.ring.get('test')
+        self.etcd_cls[owner].read.assert_called_once_with(
+            '/yoda/upstreams/test/endpoints', recursive=True, quorum=True)
@@ -0,0 +1,254 @@
+"""
+Test for yoda.snapshot
+"""
+import os
+import shutil
+import tempfile
+import etcd
+from mock import MagicMock
+from nose.tools import eq_, raises
+from tests.helper import dict_compare
+from yoda.client import Client
+from yoda.snapshot import apply_event, write_snapshot, SnapshotReader, \
+    SnapshotCache, nodes_with_meta_from_upstream
+
+__author__ = 'sukrit'
+
+MOCK_TREE = {
+    'upstreams': {
+        'upstream1': {
+            'mode': 'http',
+            'endpoints': {
+                'node1': 'host1:40001',
+                'node2': 'host2:40001',
+            },
+            'endpoints-meta': {
+                'node1': {'unit-no': '1'}
+            }
+        },
+        'upstream2': {
+            'mode': 'tcp'
+        }
+    },
+    'hosts': {
+        'mockhost': {
+            'locations': {
+                '-': {'path': '/', 'upstream': 'upstream1'}
+            }
+        }
+    }
+}
+
+
+def _mock_client():
+    client = MagicMock(spec=Client)
+    client.etcd_base = '/yoda'
+    return client
+
+
+def _mock_result(modified_index, action, key, value=None, is_dir=False):
+    result = MagicMock(spec=etcd.EtcdResult)
+    result.modifiedIndex = modified_index
+    result.action = action
+    result.key = key
+    result.value = value
+    result.dir = is_dir
+    return result
+
+
+def test_apply_event():
+    """
+    Should apply changes to the tree without modifying existing records.
+    """
+
+    # Given: Existing tree
+    tree = {'upstreams': {'upstream1': {'endpoints': {'node1': 'h1:80'}}}}
+    record = tree['upstreams']['upstream1']
+
+    # When: I apply changes
+    apply_event(tree, ['upstreams', 'upstream1', 'endpoints', 'node2'],
+                'h2:80')
+    apply_event(tree, ['upstreams', 'upstream1', 'endpoints', 'node1'],
+                deleted=True)
+    apply_event(tree, ['hosts', 'host1'], is_dir=True)
+    apply_event(tree, ['generation'], '{}')
+
+    # Then: Tree is updated
+    dict_compare(tree, {
+        'upstreams': {'upstream1': {'endpoints': {'node2': 'h2:80'}}},
+        'hosts': {'host1': {}},
+        'generation': '{}'
+    })
+
+    # And: Existing record is not modified
+    eq_(record, {'endpoints': {'node1': 'h1:80'}})
+
+
+def test_nodes_with_meta_from_upstream():
+    """
+    Should merge endpoints with meta information.
+    """
+
+    # When: I get nodes with meta for upstream record
+    nodes = nodes_with_meta_from_upstream(MOCK_TREE['upstreams']['upstream1'])
+
+    # Then: Nodes with meta are returned
+    dict_compare(nodes, {
+        'node1': {'endpoint': 'host1:40001', 'unit-no': '1'},
+        'node2': {'endpoint': 'host2:40001'}
+    })
+
+
+class TestSnapshot():
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'yoda.snapshot')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_and_read_snapshot(self):
+        """
+        Should read entries from written snapshot.
+        """
+
+        # Given: Existing snapshot
+        write_snapshot(self.path, MOCK_TREE, 1234)
+
+        # When: I read the snapshot
+        reader = SnapshotReader(self.path)
+
+        # Then: Entries are read as expected
+        eq_(reader.etcd_index, 1234)
+        eq_(list(reader.keys()), ['hosts/mockhost', 'upstreams/upstream1',
+                                  'upstreams/upstream2'])
+        dict_compare(reader.get('upstreams/upstream1'),
+                     MOCK_TREE['upstreams']['upstream1'])
+        dict_compare(reader.get('upstreams/upstream2'),
+                     MOCK_TREE['upstreams']['upstream2'])
+        eq_(reader.get('upstreams/upstream3'), None)
+        reader.close()
+
+    @raises(ValueError)
+    def test_read_corrupt_snapshot(self):
+        """
+        Should raise ValueError when checksum does not match.
+        """
+
+        # Given: Corrupt snapshot
+        write_snapshot(self.path, MOCK_TREE, 1234)
+        with open(self.path, 'r+b') as snapshot_file:
+            snapshot_file.seek(-2, os.SEEK_END)
+            snapshot_file.write(b'XX')
+
+        # When: I read the snapshot
+        SnapshotReader(self.path)
+
+        # Then: ValueError is raised
+
+    def test_cache_serves_from_snapshot(self):
+        """
+        Should serve lookups from snapshot file before refresh.
+        """
+
+        # Given: Existing snapshot
+        write_snapshot(self.path, MOCK_TREE, 1234)
+
+        # When: I create cache using the snapshot
+        cache = SnapshotCache(MagicMock(spec=Client), self.path)
+
+        # Then: Lookups are served from the snapshot
+        eq_(cache.etcd_index, 1234)
+        dict_compare(cache.get_nodes('upstream1'), {
+            'node1': 'host1:40001',
+            'node2': 'host2:40001',
+        })
+        dict_compare(cache.get_nodes('upstream3'), {})
+        eq_(cache.get_host('mockhost')['locations']['-']['upstream'],
+            'upstream1')
+
+    def test_cache_without_snapshot(self):
+        """
+        Should return empty results when snapshot does not exist.
+        """
+
+        # When: I create cache with non existing snapshot
+        cache = SnapshotCache(MagicMock(spec=Client), self.path)
+
+        # Then: Empty results are returned
+        eq_(cache.etcd_index, None)
+        dict_compare(cache.get_nodes_with_meta('upstream1'), {})
+
+    def test_cache_refresh(self):
+        """
+        Should persist the tree read from etcd when the stored index has been
+        compacted.
+        """
+
+        # Given: Cache with existing snapshot whose index has been compacted
+        write_snapshot(self.path, {}, 1000)
+        client = _mock_client()
+        client.read_tree.return_value = (MOCK_TREE, 1234)
+        client.watch.side_effect = [etcd.EtcdEventIndexCleared('mock'),
+                                    etcd.EtcdWatchTimedOut('mock')]
+        cache = SnapshotCache(client, self.path)
+
+        # When: I refresh the cache
+        updated = cache.refresh()
+
+        # Then: Snapshot gets updated
+        eq_(updated, True)
+        eq_(cache.etcd_index, 1234)
+        eq_(SnapshotReader(self.path).etcd_index, 1234)
+        dict_compare(cache.get_nodes('upstream1'), {
+            'node1': 'host1:40001',
+            'node2': 'host2:40001',
+        })
+
+        # And: Snapshot is not re-written when index has not changed
+        client.watch.side_effect = [etcd.EtcdWatchTimedOut('mock')]
+        eq_(cache.refresh(), False)
+        client.watch.assert_called_with(index=1235, timeout=1)
+
+    def test_cache_refresh_catches_up_using_watch(self):
+        """
+        Should apply changes since the stored index without reading the tree.
+        """
+
+        # Given: Cache with existing snapshot
+        write_snapshot(self.path, MOCK_TREE, 1234)
+        client = _mock_client()
+        client.watch.side_effect = [
+            _mock_result(1235, 'set', '/yoda/upstreams/upstream1/endpoints/'
+                                      'node3', 'host3:40001'),
+            _mock_result(1236, 'expire', '/yoda/upstreams/upstream2',
+                         is_dir=True),
+            etcd.EtcdWatchTimedOut('mock')
+        ]
+        cache = SnapshotCache(client, self.path)
+        nodes_before = cache.get_nodes('upstream1')
+
+        # When: I refresh the cache
+        updated = cache.refresh()
+
+        # Then: Changes are applied without reading the complete tree
+        eq_(updated, True)
+        eq_(client.read_tree.called, False)
+        client.watch.assert_any_call(index=1235, timeout=1)
+        eq_(cache.etcd_index, 1236)
+        dict_compare(cache.get_nodes('upstream1'), {
+            'node1': 'host1:40001',
+            'node2': 'host2:40001',
+            'node3': 'host3:40001',
+        })
+        eq_(len(nodes_before), 2)
+
+        # And: Snapshot file is updated
+        reader = SnapshotReader(self.path)
+        eq_(reader.etcd_index, 1236)
+        eq_(reader.get('upstreams/upstream2'), None)
+        reader.close()
+
+        # And: Reader for the old snapshot file is closed
+        eq_(cache._reader, None)
@@ -0,0 +1,84 @@
+"""
+Test for yoda.stats
+"""
+from nose.tools import eq_
+from yoda.stats import ClusterStats
+
+__author__ = 'sukrit'
+
+
+def _mock_stats():
+    stats = ClusterStats('/yoda', expiring_within=30)
+    stats.add('/yoda/generation', '10')
+    stats.add('/yoda/upstreams', is_dir=True)
+    stats.add('/yoda/upstreams/upstream1', is_dir=True, ttl=3600)
+    stats.add('/yoda/upstreams/upstream1/mode', 'http')
+    stats.add('/yoda/upstreams/upstream1/endpoints', is_dir=True)
+    stats.add('/yoda/upstreams/upstream1/endpoints/node1', 'host1:40001',
+              ttl=120)
+    stats.add('/yoda/upstreams/upstream1/endpoints/node2', 'host2:40001',
+              ttl=10)
+    stats.add('/yoda/upstreams/upstream2', is_dir=True, ttl=5)
+    stats.add('/yoda/hosts/mockhost/locations/-/upstream', 'upstream1')
+    stats.add('/yoda/hosts/mockhost/locations/-', is_dir=True)
+    stats.add('/yoda/global/listeners/tcp/listener1/bind', '*:32768')
+    stats.add('/yoda/proxy-nodes/proxy1', '172.17.42.1', ttl=300)
+    stats.add('/other/key', 'ignored')
+    return stats
+
+
+def test_cluster_stats():
+    """
+    Should aggregate capacity and expiry statistics.
+    """
+
+    # When: I add keys to the statistics
+    stats = _mock_stats()
+
+    # Then: Expected statistics are computed
+    eq_(stats.to_dict(), {
+        'etcd_index': None,
+        'keys': 7,
+        'dirs': 5,
+        'bytes': sum(len(key) + len(value) for key, value in (
+            ('/yoda/generation', '10'),
+            ('/yoda/upstreams/upstream1/mode', 'http'),
+            ('/yoda/upstreams/upstream1/endpoints/node1', 'host1:40001'),
+            ('/yoda/upstreams/upstream1/endpoints/node2', 'host2:40001'),
+            ('/yoda/hosts/mockhost/locations/-/upstream', 'upstream1'),
+            ('/yoda/global/listeners/tcp/listener1/bind', '*:32768'),
+            ('/yoda/proxy-nodes/proxy1', '172.17.42.1'))),
+        'upstreams': 2,
+        'nodes': 2,
+        'nodes_per_upstream': {'upstream1': 2, 'upstream2': 0},
+        'expiring_within': 30,
+        'expiring_nodes': 1,
+        'expiring_nodes_per_upstream': {'upstream1': 1},
+        'expiring_upstreams': ['upstream2'],
+        'empty_upstreams': ['upstream2'],
+        'hosts': 1,
+        'locations': 1,
+        'tcp_listeners': 1,
+        'proxy_nodes': 1,
+    })
+
+
+def test_cluster_stats_to_metrics():
+    """
+    Should export statistics as flat metrics.
+    """
+
+    # Given: Statistics for the yoda tree
+    stats = _mock_stats()
+
+    # When: I export the metrics
+    metrics = stats.to_metrics(prefix='test')
+
+    # Then: Expected metrics are returned
+    eq_(metrics['test.nodes'], 2)
+    eq_(metrics['test.nodes.expiring'], 1)
+    eq_(metrics['test.upstreams.empty'], 1)
+    eq_(metrics['test.upstreams.expiring'], 1)
+    eq_(metrics['test.upstream.upstream1.nodes'], 2)
+    eq_(metrics['test.upstream.upstream1.nodes.expiring'], 1)
+    eq_(metrics['test.upstream.upstream2.nodes'], 0)
@@ -0,0 +1,378 @@
+"""
+Test for yoda.stream
+"""
+import io
+import json
+import warnings
+import etcd
+from mock import MagicMock, patch
+import urllib3
+from nose.tools import eq_, raises
+from tests.helper import dict_compare
+from yoda.client import Client
+from yoda.stream import node_to_tree, iter_leaves, iter_nodes, \
+    iter_children, iter_response_children, _load_ijson
+
+__author__ = 'sukrit'
+
+MOCK_UPSTREAMS = {
+    'action': 'get',
+    'node': {
+        'key': '/yoda/upstreams',
+        'dir': True,
+        'nodes': [
+            {
+                'key': '/yoda/upstreams/upstream1',
+                'dir': True,
+                'nodes': [
+                    {'key': '/yoda/upstreams/upstream1/mode',
+                     'value': 'http'},
+                    {
+                        'key': '/yoda/upstreams/upstream1/endpoints',
+                        'dir': True,
+                        'nodes': [
+                            {'key': '/yoda/upstreams/upstream1/endpoints/'
+                                    'node1',
+                             'value': 'host1:40001', 'ttl': 100},
+                        ]
+                    }
+                ]
+            },
+            {
+                'key': '/yoda/upstreams/upstream2',
+                'dir': True
+            }
+        ]
+    }
+}
+
+
+MOCK_TREE = {
+    'action': 'get',
+    'node': {
+        'key': '/yoda',
+        'dir': True,
+        'nodes': [
+            {'key': '/yoda/generation', 'value': '{"summary": "mock"}'},
+            MOCK_UPSTREAMS['node'],
+            {
+                'key': '/yoda/proxy-nodes',
+                'dir': True,
+                'nodes': [
+                    {'key': '/yoda/proxy-nodes/proxy1',
+                     'value': '172.17.42.1', 'ttl': 10},
+                ]
+            },
+            {'key': '/yoda/hosts', 'dir': True, 'ttl': 20},
+        ]
+    }
+}
+
+
+class MockResponse(io.BytesIO):
+
+    def __init__(self, body, status=200, headers=None):
+        io.BytesIO.__init__(self, json.dumps(body).encode('utf-8'))
+        self.status = status
+        self.headers = headers or {}
+        self.release_conn = MagicMock()
+
+
+def _mock_etcd_cl(response):
+    etcd_cl = MagicMock(spec=etcd.Client)
+    etcd_cl.base_uri = 'http://localhost:4001'
+    etcd_cl.key_endpoint = '/v2/keys'
+    etcd_cl.read_timeout = 60
+    etcd_cl.http = MagicMock()
+    etcd_cl.http.request.return_value = response
+    return etcd_cl
+
+
+def test_node_to_tree():
+    """
+    Should convert raw etcd node to nested dictionary.
+    """
+
+    # When: I convert raw node to tree
+    tree = node_to_tree(MOCK_UPSTREAMS['node'])
+
+    # Then: Expected tree is returned
+    dict_compare(tree, {
+        'upstream1': {
+            'mode': 'http',
+            'endpoints': {'node1': 'host1:40001'}
+        },
+        'upstream2': {}
+    })
+
+
+def test_iter_leaves():
+    """
+    Should iterate over leaf nodes only.
+    """
+
+    # When: I iterate over leaves for raw node
+    leaves = [leaf['key'] for leaf in iter_leaves(MOCK_UPSTREAMS['node'])]
+
+    # Then: Leaf keys are returned
+    eq_(leaves, ['/yoda/upstreams/upstream1/mode',
+                 '/yoda/upstreams/upstream1/endpoints/node1'])
+
+
+def test_iter_nodes():
+    """
+    Should iterate over all nodes including directories.
+    """
+
+    # When: I iterate over nodes for raw node
+    keys = [node['key'] for node in iter_nodes(MOCK_UPSTREAMS['node'])]
+
+    # Then: All keys are returned in depth first order
+    eq_(keys, ['/yoda/upstreams',
+               '/yoda/upstreams/upstream1',
+               '/yoda/upstreams/upstream1/mode',
+               '/yoda/upstreams/upstream1/endpoints',
+               '/yoda/upstreams/upstream1/endpoints/node1',
+               '/yoda/upstreams/upstream2'])
+
+
+def test_iter_children():
+    """
+    Should stream children for etcd directory.
+    """
+
+    # Given: Etcd client returning upstreams
+    response = MockResponse(MOCK_UPSTREAMS)
+    etcd_cl = _mock_etcd_cl(response)
+
+    # When: I iterate over children
+    children = [child['key'] for child in
+                iter_children(etcd_cl, '/yoda/upstreams')]
+
+    # Then: Children are returned
+    eq_(children, ['/yoda/upstreams/upstream1', '/yoda/upstreams/upstream2'])
+    eq_(etcd_cl.http.request.call_args[0],
+        ('GET', 'http://localhost:4001/v2/keys/yoda/upstreams'))
+    eq_(etcd_cl.http.request.call_args[1]['preload_content'], False)
+    eq_(response.release_conn.called, True)
+
+
+def test_iter_children_with_depth():
+    """
+    Should stream nested children for given depth.
+    """
+
+    # Given: Etcd client returning upstreams
+    etcd_cl = _mock_etcd_cl(MockResponse(MOCK_UPSTREAMS))
+
+    # When: I iterate over children with depth 2
+    children = [child['key'] for child in
+                iter_children(etcd_cl, '/yoda/upstreams', depth=2)]
+
+    # Then: Grand children are returned
+    eq_(children, ['/yoda/upstreams/upstream1/mode',
+                   '/yoda/upstreams/upstream1/endpoints'])
+
+
+def test_iter_children_for_non_existing_key():
+    """
+    Should not yield anything for non existing key.
+    """
+
+    # Given: Etcd client returning 404
+    etcd_cl = _mock_etcd_cl(MockResponse({'errorCode': 100}, status=404))
+
+    # When: I iterate over children
+    children = list(iter_children(etcd_cl, '/yoda/upstreams'))
+
+    # Then: No children are returned
+    eq_(children, [])
+
+
+@raises(etcd.EtcdException)
+def test_iter_children_for_failed_request():
+    """
+    Should raise EtcdException when etcd request fails.
+    """
+
+    # Given: Etcd client returning server error
+    etcd_cl = _mock_etcd_cl(MockResponse({}, status=500))
+
+    # When: I iterate over children
+    list(iter_children(etcd_cl, '/yoda/upstreams'))
+
+    # Then: EtcdException is raised
+
+
+def test_client_iter_upstreams():
+    """
+    Should stream upstream records using yoda client.
+    """
+
+    # Given: Yoda client
+    client = Client(etcd_cl=_mock_etcd_cl(MockResponse(MOCK_UPSTREAMS)))
+
+    # When: I iterate over upstreams
+    upstreams = list(client.iter_upstreams())
+
+    # Then: Upstream records are returned
+    eq_(upstreams, [
+        ('upstream1', {
+            'mode': 'http',
+            'endpoints': {'node1': 'host1:40001'}
+        }),
+        ('upstream2', {})
+    ])
+
+
+def test_iter_children_without_ijson():
+    """
+    Should warn when the response can not be parsed incrementally.
+    """
+
+    # Given: Etcd client returning upstreams and no ijson
+    etcd_cl = _mock_etcd_cl(MockResponse(MOCK_UPSTREAMS))
+
+    # When: I iterate over children
+    with patch('yoda.stream._load_ijson', return_value=None), \
+            warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        children = [child['key'] for child in
+                    iter_children(etcd_cl, '/yoda/upstreams')]
+
+    # Then: Children are returned with a warning
+    eq_(children, ['/yoda/upstreams/upstream1', '/yoda/upstreams/upstream2'])
+    eq_([warning.category for warning in caught], [RuntimeWarning])
+
+
+def test_client_stream_is_retried():
+    """
+    Should retry streaming read that failed to connect.
+    """
+
+    # Given: Yoda client whose first request fails
+    etcd_cl = _mock_etcd_cl(None)
+    etcd_cl.http.request.side_effect = [
+        urllib3.exceptions.ProtocolError('mock'),
+        MockResponse(MOCK_UPSTREAMS)]
+    client = Client(etcd_cl=etcd_cl)
+    client._sleep = MagicMock()
+
+    # When: I iterate over upstreams
+    upstreams = [upstream for upstream, _ in client.iter_upstreams()]
+
+    # Then: Read is retried
+    eq_(upstreams, ['upstream1', 'upstream2'])
+    eq_(etcd_cl.http.request.call_count, 2)
+
+
+def test_client_stream_with_consistency():
+    """
+    Should make streaming read with the read consistency.
+    """
+
+    # Given: Yoda client with linearizable reads
+    etcd_cl = _mock_etcd_cl(MockResponse(MOCK_UPSTREAMS))
+    client = Client(etcd_cl=etcd_cl, consistency='linearizable')
+
+    # When: I iterate over upstreams
+    list(client.iter_upstreams())
+
+    # Then: Read is made with quorum
+    eq_(etcd_cl.http.request.call_args[1]['fields'],
+        {'recursive': 'true', 'quorum': 'true'})
+
+
+def test_client_stream_for_non_existing_key():
+    """
+    Should not yield anything for non existing key.
+    """
+
+    # Given: Yoda client for etcd returning 404
+    client = Client(etcd_cl=_mock_etcd_cl(
+        MockResponse({'errorCode': 100}, status=404)))
+
+    # When: I iterate over upstreams
+    upstreams = list(client.iter_upstreams())
+
+    # Then: No upstreams are returned
+    eq_(upstreams, [])
+
+
+def test_iter_response_children_with_parents():
+    """
+    Should stream nested children along with their parents.
+    """
+
+    # When: I iterate over children with depth 2 and parents
+    children = list(iter_response_children(MockResponse(MOCK_TREE),
+                                           depth=2, parents=True))
+
+    # Then: Parents are returned without their children
+    eq_(sorted(child['key'] for child in children), [
+        '/yoda/generation',
+        '/yoda/hosts',
+        '/yoda/proxy-nodes',
+        '/yoda/proxy-nodes/proxy1',
+        '/yoda/upstreams',
+        '/yoda/upstreams/upstream1',
+        '/yoda/upstreams/upstream2',
+    ])
+    parents = dict((child['key'], child) for child in children)
+    eq_(parents['/yoda/upstreams'], {'key': '/yoda/upstreams', 'dir': True})
+    eq_(parents['/yoda/hosts'], {'key': '/yoda/hosts', 'dir': True,
+                                 'ttl': 20})
+    eq_(parents['/yoda/generation']['value'], '{"summary": "mock"}')
+    eq_(len(parents['/yoda/upstreams/upstream1']['nodes']), 2)
+
+
+def _compare_stats(ijson_loader):
+    streamed_cl = _mock_etcd_cl(MockResponse(
+        MOCK_TREE, headers={'x-etcd-index': '42'}))
+    read_cl = MagicMock(spec=etcd.Client)
+    read_cl.read.return_value = etcd.EtcdResult(**MOCK_TREE)
+    read_cl.read.return_value.etcd_index = 42
+
+    with patch('yoda.stream._load_ijson', ijson_loader), \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        streamed = Client(etcd_cl=streamed_cl).stats(streaming=True)
+    read = Client(etcd_cl=read_cl).stats()
+
+    eq_(streamed.to_dict(), read.to_dict())
+    eq_(streamed.etcd_index, 42)
+    eq_(streamed.keys, 4)
+    eq_(streamed.dirs, 6)
+
+
+def test_client_streamed_stats():
+    """
+    Should compute the same statistics for streaming and non streaming
+    reads.
+    """
+    _compare_stats(_load_ijson)
+
+
+def test_client_streamed_stats_without_ijson():
+    """
+    Should compute the same statistics for streaming read decoded without
+    ijson.
+    """
+    _compare_stats(lambda: None)
+
+
+def test_client_streamed_stats_for_non_existing_tree():
+    """
+    Should record etcd index for non existing tree.
+    """
+
+    # Given: Yoda client for etcd returning 404
+    client = Client(etcd_cl=_mock_etcd_cl(MockResponse(
+        {'errorCode': 100}, status=404, headers={'x-etcd-index': '42'})))
+
+    # When: I get the streamed statistics
+    stats = client.stats(streaming=True)
+
+    # Then: Empty statistics are returned with the etcd index
+    eq_(stats.keys, 0)
+    eq_(stats.etcd_index, 42)
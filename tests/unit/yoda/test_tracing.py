@@ -0,0 +1,155 @@
+"""
+Test for yoda.tracing
+"""
+import json
+import os
+import tempfile
+from nose.tools import eq_, ok_, raises
+from yoda.tracing import JsonFileExporter, NOOP_SPAN, SpanContext, Tracer
+
+__author__ = 'sukrit'
+
+MOCK_TRACEPARENT = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+
+class MemoryExporter:
+
+    def __init__(self):
+        self.started = []
+        self.finished = []
+
+    def on_start(self, span):
+        self.started.append(span)
+
+    def on_end(self, span):
+        self.finished.append(span)
+
+
+def test_span_context_from_traceparent():
+    """
+    Should parse W3C traceparent header.
+    """
+
+    # When: I parse traceparent header
+    context = SpanContext.from_traceparent(MOCK_TRACEPARENT)
+
+    # Then: Expected context is returned
+    eq_(context, SpanContext('0af7651916cd43dd8448eb211c80319c',
+                             'b7ad6b7169203331', True))
+    eq_(context.traceparent, MOCK_TRACEPARENT)
+
+
+@raises(ValueError)
+def test_span_context_from_invalid_traceparent():
+    """
+    Should raise ValueError for invalid traceparent header.
+    """
+
+    # When: I parse invalid header
+    SpanContext.from_traceparent('invalid')
+
+
+class TestTracer():
+
+    def setup(self):
+        self.exporter = MemoryExporter()
+        self.tracer = Tracer(self.exporter)
+
+    def test_nested_spans(self):
+        """
+        Should record nested spans within the same trace.
+        """
+
+        # When: I record nested spans
+        with self.tracer.span('parent', attributes={'a': 1}) as parent:
+            with self.tracer.span('child') as child:
+                child.set_attribute('b', 2)
+
+        # Then: Spans are exported in the order they finish
+        eq_([span.name for span in self.exporter.finished],
+            ['child', 'parent'])
+        eq_(child.trace_id, parent.trace_id)
+        eq_(child.parent_id, parent.span_id)
+        eq_(parent.parent_id, None)
+        eq_(parent.attributes, {'a': 1})
+        eq_(child.attributes, {'b': 2})
+        ok_(parent.duration >= 0)
+
+    def test_span_with_error(self):
+        """
+        Should record error for the span.
+        """
+
+        # When: Error is raised within the span
+        try:
+            with self.tracer.span('failing'):
+                raise ValueError('failed')
+        except ValueError:
+            pass
+
+        # Then: Error is recorded
+        span = self.exporter.finished[0]
+        eq_(span.status, 'error')
+        eq_(span.error, 'ValueError: failed')
+
+    def test_remote_parent(self):
+        """
+        Should use external parent context.
+        """
+
+        # Given: Remote parent
+        parent = SpanContext.from_traceparent(MOCK_TRACEPARENT)
+
+        # When: I record span within the remote parent
+        with self.tracer.activate(parent):
+            with self.tracer.span('child') as child:
+                pass
+
+        # Then: Span is part of remote trace
+        eq_(child.trace_id, parent.trace_id)
+        eq_(child.parent_id, parent.span_id)
+
+    def test_sampling(self):
+        """
+        Should not record spans for traces that are not sampled.
+        """
+
+        # Given: Tracer that does not sample any trace
+        tracer = Tracer(self.exporter, sample_rate=0)
+
+        # When: I record nested spans
+        with tracer.span('parent') as parent:
+            with tracer.span('child') as child:
+                pass
+
+        # Then: No span is recorded
+        ok_(parent is NOOP_SPAN)
+        ok_(child is NOOP_SPAN)
+        eq_(self.exporter.started, [])
+        eq_(self.exporter.finished, [])
+
+
+def test_json_file_exporter():
+    """
+    Should write finished spans as NDJSON.
+    """
+
+    # Given: Tracer with json file exporter
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    os.close(fd)
+    tracer = Tracer(JsonFileExporter(path))
+
+    # When: I record spans
+    try:
+        with tracer.span('parent'):
+            with tracer.span('child', attributes={'etcd.key': '/yoda'}):
+                pass
+        with open(path) as spans_file:
+            spans = [json.loads(line) for line in spans_file]
+    finally:
+        os.remove(path)
+
+    # Then: Spans are written
+    eq_([span['name'] for span in spans], ['child', 'parent'])
+    eq_(spans[0]['attributes'], {'etcd.key': '/yoda'})
+    eq_(spans[0]['parent_id'], spans[1]['span_id'])
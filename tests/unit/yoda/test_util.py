@@ -1,5 +1,5 @@
-from nose.tools import eq_
-from yoda.util import dict_merge
+from nose.tools import eq_, raises
+from yoda.util import dict_merge, parallel_map
 
 __author__ = 'sukrit'
 
@@ -41,3 +41,50 @@ def test_dict_merge():
         },
         'key3': 'value3',
     })
+
+
+def test_parallel_map():
+    """
+    should apply function to all items preserving the order
+    """
+
+    # When: I map items in parallel
+    results = parallel_map(lambda item: item * 2, range(20), max_workers=4)
+
+    # Then: Results are returned in order of items
+    eq_(results, [item * 2 for item in range(20)])
+
+
+def test_parallel_map_with_return_exceptions():
+    """
+    should return exceptions in place of results
+    """
+
+    # Given: Function failing for odd items
+    error = ValueError('mock')
+
+    def func(item):
+        if item % 2:
+            raise error
+        return item
+
+    # When: I map items in parallel
+    results = parallel_map(func, range(4), return_exceptions=True)
+
+    # Then: Exceptions are returned for failed items
+    eq_(results, [0, error, 2, error])
+
+
+@raises(ValueError)
+def test_parallel_map_raises_error():
+    """
+    should raise error when return_exceptions is not set
+    """
+
+    def func(item):
+        raise ValueError('mock')
+
+    # When: I map items in parallel
+    parallel_map(func, range(4))
+
+    # Then: ValueError is raised
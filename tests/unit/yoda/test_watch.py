@@ -0,0 +1,240 @@
+"""
+Test for yoda.watch
+"""
+import os
+import shutil
+import tempfile
+import etcd
+from mock import MagicMock
+from nose.tools import eq_
+from yoda.client import Client
+from yoda.watch import FileCheckpoint, ResumableWatcher, WatchEvent
+
+__author__ = 'sukrit'
+
+
+def _mock_result(modified_index, key='/yoda/upstreams/test/endpoints/node1',
+                 action='set', value='host1:40001'):
+    result = MagicMock(spec=etcd.EtcdResult)
+    result.modifiedIndex = modified_index
+    result.key = key
+    result.action = action
+    result.value = value
+    result.dir = False
+    return result
+
+
+class MockCheckpoint:
+
+    def __init__(self, index=None):
+        self.index = index
+        self.saved = []
+
+    def load(self):
+        return self.index
+
+    def save(self, index):
+        self.index = index
+        self.saved.append(index)
+
+
+class TestFileCheckpoint():
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint = FileCheckpoint(os.path.join(self.tmp_dir, 'index'))
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_without_checkpoint(self):
+        """
+        Should return None when checkpoint does not exist.
+        """
+
+        # Then: None is returned
+        eq_(self.checkpoint.load(), None)
+
+    def test_save_and_load(self):
+        """
+        Should load saved index.
+        """
+
+        # When: I save the index
+        self.checkpoint.save(1234)
+
+        # Then: Saved index is loaded
+        eq_(self.checkpoint.load(), 1234)
+
+
+class TestResumableWatcher():
+
+    def setup(self):
+        self.client = MagicMock(spec=Client)
+        self.client.read_tree.return_value = ({'upstreams': {}}, 100)
+        self.on_snapshot = MagicMock()
+
+    def _watcher(self, checkpoint):
+        return ResumableWatcher(self.client, checkpoint,
+                                on_snapshot=self.on_snapshot)
+
+    def test_watch_resumes_from_checkpoint(self):
+        """
+        Should resume watching from checkpointed index without snapshot.
+        """
+
+        # Given: Existing checkpoint
+        checkpoint = MockCheckpoint(200)
+        self.client.watch.side_effect = [_mock_result(201)]
+
+        # When: I get the first event
+        event = next(self._watcher(checkpoint).events())
+
+        # Then: Watch resumes from checkpoint
+        eq_(event, WatchEvent('set', '/yoda/upstreams/test/endpoints/node1',
+                              'host1:40001', 201, False))
+        self.client.watch.assert_called_once_with(index=201, timeout=60)
+        eq_(self.client.read_tree.called, False)
+
+    def test_watch_takes_snapshot_without_checkpoint(self):
+        """
+        Should take snapshot when there is no checkpoint.
+        """
+
+        # Given: No checkpoint
+        checkpoint = MockCheckpoint()
+        self.client.watch.side_effect = [_mock_result(101)]
+
+        # When: I get the first event
+        next(self._watcher(checkpoint).events())
+
+        # Then: Snapshot is taken and watch starts after snapshot index
+        self.on_snapshot.assert_called_once_with({'upstreams': {}}, 100)
+        self.client.watch.assert_called_once_with(index=101, timeout=60)
+        eq_(checkpoint.saved, [100])
+
+    def test_watch_with_compacted_index(self):
+        """
+        Should take snapshot when checkpointed index has been compacted.
+        """
+
+        # Given: Compacted checkpoint
+        checkpoint = MockCheckpoint(5)
+        self.client.watch.side_effect = [
+            etcd.EtcdEventIndexCleared('mock'),
+            etcd.EtcdWatchTimedOut('mock'),
+            _mock_result(150)
+        ]
+
+        # When: I get the first event
+        event = next(self._watcher(checkpoint).events())
+
+        # Then: Watch resumes after snapshot
+        eq_(event.modified_index, 150)
+        eq_(self.on_snapshot.call_count, 1)
+        eq_(self.client.watch.call_args_list[-1][1]['index'], 101)
+
+    def test_watch_without_snapshot_index(self):
+        """
+        Should watch for the next change when snapshot has no index (e.g.
+        missing tree).
+        """
+
+        # Given: Missing tree
+        checkpoint = MockCheckpoint()
+        self.client.read_tree.return_value = ({}, None)
+        self.client.watch.side_effect = [_mock_result(7)]
+
+        # When: I get the first event
+        event = next(self._watcher(checkpoint).events())
+
+        # Then: Watch waits for the next change
+        eq_(event.modified_index, 7)
+        self.client.watch.assert_called_once_with(index=None, timeout=60)
+
+    def test_watch_backs_off_repeated_snapshots(self):
+        """
+        Should back off when snapshots are taken back to back.
+        """
+
+        # Given: Watch that keeps failing with compacted index
+        checkpoint = MockCheckpoint()
+        stop = MagicMock()
+        stop.is_set.side_effect = [False] * 4 + [True]
+        self.client.watch.side_effect = etcd.EtcdEventIndexCleared('mock')
+        watcher = self._watcher(checkpoint)
+        watcher._sleep = MagicMock()
+
+        # When: I watch for events
+        eq_(list(watcher.events(stop=stop)), [])
+
+        # Then: Consecutive snapshots are delayed with exponential backoff
+        eq_(self.client.read_tree.call_count, 5)
+        eq_([call[0][0] for call in watcher._sleep.call_args_list],
+            [1.0, 2.0, 4.0, 8.0])
+
+    def test_watch_resets_snapshot_backoff(self):
+        """
+        Should not delay snapshot after a successful watch.
+        """
+
+        # Given: Watch that fails with compacted index after an event
+        checkpoint = MockCheckpoint()
+        stop = MagicMock()
+        stop.is_set.side_effect = [False] * 3 + [True]
+        self.client.watch.side_effect = [
+            _mock_result(101),
+            etcd.EtcdEventIndexCleared('mock'),
+            etcd.EtcdWatchTimedOut('mock'),
+        ]
+        watcher = self._watcher(checkpoint)
+        watcher._sleep = MagicMock()
+
+        # When: I watch for events
+        list(watcher.events(stop=stop))
+
+        # Then: Snapshot is taken without delay
+        eq_(self.client.read_tree.call_count, 2)
+        eq_(watcher._sleep.called, False)
+
+    def test_run_checkpoints_processed_events(self):
+        """
+        Should checkpoint processed events and skip duplicates.
+        """
+
+        # Given: Watch returning duplicate events
+        checkpoint = MockCheckpoint(200)
+        stop = MagicMock()
+        stop.is_set.side_effect = [False, False, False, True]
+        self.client.watch.side_effect = [
+            _mock_result(201), _mock_result(201), _mock_result(202)]
+        handler = MagicMock()
+
+        # When: I run the watcher
+        self._watcher(checkpoint).run(handler, stop=stop)
+
+        # Then: Each event is processed once and checkpointed
+        eq_([call[0][0].modified_index for call in handler.call_args_list],
+            [201, 202])
+        eq_(checkpoint.saved, [201, 202])
+
+    def test_watch_without_auto_commit(self):
+        """
+        Should checkpoint only committed events when auto commit is disabled.
+        """
+
+        # Given: Watcher without auto commit
+        checkpoint = MockCheckpoint(200)
+        self.client.watch.side_effect = [_mock_result(201), _mock_result(202)]
+        watcher = ResumableWatcher(self.client, checkpoint,
+                                   auto_commit=False)
+        events = watcher.events()
+
+        # When: I get two events and commit the first one
+        next(events)
+        next(events)
+        watcher.commit(201)
+
+        # Then: Only the committed event is checkpointed
+        eq_(checkpoint.saved, [201])
+        eq_(self.client.watch.call_args_list[-1][1]['index'], 202)
@@ -0,0 +1,163 @@
+"""
+Adaptive TTLs for yoda records.
+
+Fixed TTLs are a trade off between fast failover (short TTLs) and stability
+when etcd is slow (long TTLs). :class:`AdaptiveTtlPolicy` tracks the latency
+and failure rate of etcd writes and picks TTLs within configured bounds:
+the lower bound while etcd is healthy, growing towards the upper bound as
+writes slow down or fail. Refresh intervals are derived from the chosen TTL
+so that a record is always renewed several times before it expires.
+"""
+import threading
+
+__author__ = 'sukrit'
+
+# Record types with adaptive TTLs
+TTL_NODE = 'node'
+TTL_PROXY_NODE = 'proxy-node'
+TTL_UPSTREAM = 'upstream'
+
+# Default bounds (in seconds) for each record type as tuple of (min, max)
+DEFAULT_TTL_BOUNDS = {
+    TTL_NODE: (60, 600),
+    TTL_PROXY_NODE: (150, 1500),
+    TTL_UPSTREAM: (1800, 18000),
+}
+
+DEFAULT_TARGET_LATENCY = 0.1
+DEFAULT_SMOOTHING = 0.2
+DEFAULT_FAILURE_WEIGHT = 4.0
+DEFAULT_MIN_RENEWALS = 3
+
+# Time (as multiple of write latency) reserved for the renewal itself.
+LATENCY_HEADROOM = 10
+
+
+class AdaptiveTtlPolicy:
+    """
+    Picks TTLs and refresh intervals using exponentially weighted moving
+    averages of etcd write latency and failure rate.
+
+    The TTL for a record type is:
+
+        min_ttl * max(latency / target_latency, 1) *
+            (1 + failure_weight * failure_rate)
+
+    capped at max_ttl.
+    """
+
+    def __init__(self, bounds=None, target_latency=DEFAULT_TARGET_LATENCY,
+                 smoothing=DEFAULT_SMOOTHING,
+                 failure_weight=DEFAULT_FAILURE_WEIGHT,
+                 min_renewals=DEFAULT_MIN_RENEWALS):
+        """
+        :keyword bounds: Dictionary of record type (e.g. TTL_NODE) to tuple
+            of (min ttl, max ttl) in seconds. Merged with DEFAULT_TTL_BOUNDS.
+        :type bounds: dict
+        :keyword target_latency: Write latency (in seconds) up to which etcd
+            is considered healthy. (Default: DEFAULT_TARGET_LATENCY)
+        :type target_latency: float
+        :keyword smoothing: Weight of the latest observation in the moving
+            averages (0 < smoothing <= 1). (Default: DEFAULT_SMOOTHING)
+        :type smoothing: float
+        :keyword failure_weight: Factor by which a failure rate of 100%
+            increases the TTL (on top of the latency factor).
+            (Default: DEFAULT_FAILURE_WEIGHT)
+        :type failure_weight: float
+        :keyword min_renewals: Minimum number of renewals within a TTL.
+            (Default: DEFAULT_MIN_RENEWALS)
+        :type min_renewals: int
+        """
+        self.bounds = dict(DEFAULT_TTL_BOUNDS)
+        self.bounds.update(bounds or {})
+        for kind, (min_ttl, max_ttl) in self.bounds.items():
+            if min_ttl <= 0 or max_ttl < min_ttl:
+                raise ValueError('Invalid ttl bounds for %s: (%s, %s)' %
+                                 (kind, min_ttl, max_ttl))
+        if not 0 < smoothing <= 1:
+            raise ValueError('smoothing must be in (0, 1]')
+        self.target_latency = target_latency
+        self.smoothing = smoothing
+        self.failure_weight = failure_weight
+        self.min_renewals = max(min_renewals, 1)
+        self.latency = 0.0
+        self.failure_rate = 0.0
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def observe(self, latency, failed=False):
+        """
+        Records the outcome of an etcd write.
+
+        :param latency: Time (in seconds) taken by the write
+        :type latency: float
+        :keyword failed: True if the write failed with a transient error
+            (e.g. connection failure). (Default: False)
+        :type failed: bool
+        :return: None
+        """
+        with self._lock:
+            if not self.observations:
+                self.latency = latency
+                self.failure_rate = 1.0 if failed else 0.0
+            else:
+                alpha = self.smoothing
+                self.latency += alpha * (latency - self.latency)
+                self.failure_rate += alpha * (
+                    (1.0 if failed else 0.0) - self.failure_rate)
+            self.observations += 1
+
+    @property
+    def load_factor(self):
+        """
+        Factor (>= 1) by which TTLs are stretched beyond their lower bound.
+        """
+        return max(self.latency / self.target_latency, 1.0) * \
+            (1 + self.failure_weight * self.failure_rate)
+
+    def ttl(self, kind):
+        """
+        :param kind: Record type (e.g. TTL_NODE)
+        :type kind: str
+        :return: TTL (in seconds) for the record type
+        :rtype: int
+        """
+        min_ttl, max_ttl = self.bounds[kind]
+        return int(round(min(min_ttl * self.load_factor, max_ttl)))
+
+    def refresh_interval(self, ttl):
+        """
+        Gets the interval after which a record with given ttl should be
+        refreshed. Time needed for the renewal (a multiple of the write
+        latency) is reserved, and the rest of the TTL is split so that the
+        record is renewed at least min_renewals times before it expires.
+
+        :param ttl: Time to live for the record (in seconds)
+        :type ttl: int
+        :return: Refresh interval (in seconds)
+        :rtype: float
+        """
+        headroom = min(self.latency * LATENCY_HEADROOM, ttl / 2.0)
+        return (ttl - headroom) / float(self.min_renewals)
+
+    def to_dict(self):
+        """
+        Exposes the observed etcd health and the chosen values. e.g.:
+
+            {'latency': 0.02, 'failure_rate': 0.0, 'load_factor': 1.0,
+             'ttls': {'node': 60, ...},
+             'refresh_intervals': {'node': 20.0, ...}}
+
+        :rtype: dict
+        """
+        ttls = dict((kind, self.ttl(kind)) for kind in self.bounds)
+        return {
+            'latency': self.latency,
+            'failure_rate': self.failure_rate,
+            'load_factor': self.load_factor,
+            'observations': self.observations,
+            'ttls': ttls,
+            'refresh_intervals': dict(
+                (kind, self.refresh_interval(ttl))
+                for kind, ttl in ttls.items()),
+        }
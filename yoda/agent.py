@@ -0,0 +1,385 @@
+"""
+Health gated registration agent for the containers running on a host.
+
+Health probes for all registered nodes are run concurrently on a single
+asyncio event loop. A node is kept alive in etcd only while its probe
+passes and it is removed as soon as the probe fails, instead of waiting for
+its ttl to expire. Blocking etcd calls are run in the loop's executor.
+
+Probes are implemented using asyncio protocols and callbacks (rather than
+coroutine syntax), so that the module can still be imported on python 2.7.
+The agent itself requires asyncio (python 3.4+).
+"""
+import logging
+import random
+import time
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+__author__ = 'sukrit'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_INTERVAL = 5
+DEFAULT_PROBE_TIMEOUT = 2
+DEFAULT_NODE_TTL = 30
+DEFAULT_FAILURE_THRESHOLD = 1
+HTTP_OK_STATUSES = range(200, 400)
+
+
+def _new_future(loop):
+    if hasattr(loop, 'create_future'):
+        return loop.create_future()
+    return asyncio.Future(loop=loop)  # pragma: no cover
+
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+class _ProbeProtocol(object):
+    """
+    Asyncio protocol for a single probe. The probe passes if the connection
+    succeeds and (if a request is sent) the probe accepts the response.
+    """
+
+    def __init__(self, probe, result):
+        self.probe = probe
+        self.result = result
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.result.add_done_callback(lambda _: transport.close())
+        request = self.probe.request()
+        if request is None:
+            _resolve(self.result, True)
+        else:
+            transport.write(request)
+
+    def data_received(self, data):
+        self.buffer += data
+        if b'\r\n' in self.buffer:
+            _resolve(self.result, self.probe.check(self.buffer))
+
+    def eof_received(self):
+        _resolve(self.result, self.probe.check(self.buffer))
+
+    def connection_lost(self, exc):
+        _resolve(self.result, False)
+
+    def pause_writing(self):  # pragma: no cover
+        pass
+
+    def resume_writing(self):  # pragma: no cover
+        pass
+
+
+class TcpProbe:
+    """
+    Probe that passes if a tcp connection can be established.
+    """
+
+    def __init__(self, host, port):
+        """
+        :param host: Host to be probed
+        :type host: str
+        :param port: Port to be probed
+        :type port: int
+        """
+        self.host = host
+        self.port = int(port)
+
+    @classmethod
+    def from_endpoint(cls, endpoint):
+        """
+        Creates probe for endpoint (host:port).
+
+        :param endpoint: Endpoint for the node (host:port)
+        :type endpoint: str
+        :rtype: TcpProbe
+        """
+        host, port = endpoint.rsplit(':', 1)
+        return cls(host, port)
+
+    def request(self):
+        return None
+
+    def check(self, response):
+        return True
+
+    def start(self, loop, timeout=DEFAULT_PROBE_TIMEOUT):
+        """
+        Starts the probe.
+
+        :param loop: Event loop used for the probe
+        :type loop: asyncio.AbstractEventLoop
+        :keyword timeout: Timeout for the probe in seconds.
+            (Default: DEFAULT_PROBE_TIMEOUT)
+        :type timeout: float
+        :return: Future resolving to True if probe passed, False otherwise.
+        :rtype: asyncio.Future
+        """
+        result = _new_future(loop)
+        connect = loop.create_task(loop.create_connection(
+            lambda: _ProbeProtocol(self, result), self.host, self.port))
+
+        def on_connect(task):
+            if task.cancelled() or task.exception() is not None:
+                _resolve(result, False)
+
+        def on_timeout():
+            connect.cancel()
+            _resolve(result, False)
+
+        connect.add_done_callback(on_connect)
+        timer = loop.call_later(timeout, on_timeout)
+        result.add_done_callback(lambda _: timer.cancel())
+        return result
+
+
+class HttpProbe(TcpProbe):
+    """
+    Probe that passes if a HTTP GET request for the path returns one of the
+    expected status codes.
+    """
+
+    def __init__(self, host, port, path='/', statuses=HTTP_OK_STATUSES):
+        """
+        :param host: Host to be probed
+        :type host: str
+        :param port: Port to be probed
+        :type port: int
+        :keyword path: Path for the health check. (Default: '/')
+        :type path: str
+        :keyword statuses: Expected HTTP status codes.
+            (Default: HTTP_OK_STATUSES)
+        """
+        TcpProbe.__init__(self, host, port)
+        self.path = path
+        self.statuses = statuses
+
+    @classmethod
+    def from_endpoint(cls, endpoint, path='/'):
+        host, port = endpoint.rsplit(':', 1)
+        return cls(host, port, path=path)
+
+    def request(self):
+        return ('GET {path} HTTP/1.0\r\nHost: {host}\r\n'
+                'Connection: close\r\n\r\n').format(
+            path=self.path, host=self.host).encode('ascii')
+
+    def check(self, response):
+        status_line = response.split(b'\r\n', 1)[0].split()
+        if len(status_line) < 2 or not status_line[0].startswith(b'HTTP/'):
+            return False
+        try:
+            return int(status_line[1]) in self.statuses
+        except ValueError:
+            return False
+
+
+class _Target:
+    """
+    Registration state for a single node managed by the agent.
+    """
+
+    def __init__(self, upstream, node_name, endpoint, probe, meta=None):
+        self.upstream = upstream
+        self.node_name = node_name
+        self.endpoint = endpoint
+        self.probe = probe
+        self.meta = meta
+        self.registered = False
+        self.refreshed_at = None
+        self.failures = 0
+        self.pending = None
+        self.timer = None
+        self.removed = False
+
+
+class Agent:
+    """
+    Manages registrations for all nodes (containers) on a host.
+    """
+
+    def __init__(self, client, interval=DEFAULT_PROBE_INTERVAL,
+                 timeout=DEFAULT_PROBE_TIMEOUT, ttl=DEFAULT_NODE_TTL,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, loop=None,
+                 executor=None, clock=time.time):
+        """
+        :param client: Yoda client
+        :type client: yoda.client.Client
+        :keyword interval: Interval (in seconds) between probes for a node.
+            (Default: DEFAULT_PROBE_INTERVAL)
+        :type interval: float
+        :keyword timeout: Timeout (in seconds) for a single probe.
+            (Default: DEFAULT_PROBE_TIMEOUT)
+        :type timeout: float
+        :keyword ttl: Time to live (in seconds) for the node records. The
+            ttl is refreshed only while the probe passes.
+            (Default: DEFAULT_NODE_TTL)
+        :type ttl: int
+        :keyword failure_threshold: Number of consecutive failed probes
+            after which the node is removed.
+            (Default: DEFAULT_FAILURE_THRESHOLD)
+        :type failure_threshold: int
+        :keyword loop: Event loop for the agent. (Default: new event loop)
+        :keyword executor: Executor for blocking etcd calls.
+            (Default: executor for the loop)
+        """
+        if asyncio is None:  # pragma: no cover
+            raise RuntimeError('Registration agent requires asyncio')
+        self.client = client
+        self.interval = interval
+        self.timeout = timeout
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.loop = loop or asyncio.new_event_loop()
+        self.executor = executor
+        self.clock = clock
+        self.targets = dict()
+
+    def add(self, upstream, node_name, endpoint, probe=None, meta=None):
+        """
+        Adds node to be managed by the agent. The node gets registered once
+        its probe passes. Safe to be called from any thread.
+
+        :param upstream: Upstream for the node.
+        :type upstream: str
+        :param node_name: Name of the node
+        :type node_name: str
+        :param endpoint: Endpoint for the node (host:port)
+        :type endpoint: str
+        :keyword probe: Health probe for the node.
+            (Default: TcpProbe for the endpoint)
+        :keyword meta: Meta information about the endpoint (Default: None)
+        :type meta: dict
+        :return: None
+        """
+        target = _Target(upstream, node_name, endpoint,
+                         probe or TcpProbe.from_endpoint(endpoint), meta=meta)
+        self.loop.call_soon_threadsafe(self._add, target)
+
+    def remove(self, upstream, node_name):
+        """
+        Stops managing the node and removes it from etcd. Safe to be called
+        from any thread.
+
+        :param upstream: Upstream for the node.
+        :type upstream: str
+        :param node_name: Name of the node
+        :type node_name: str
+        :return: None
+        """
+        self.loop.call_soon_threadsafe(self._remove, (upstream, node_name))
+
+    def _add(self, target):
+        self._remove((target.upstream, target.node_name))
+        self.targets[(target.upstream, target.node_name)] = target
+        # Spread the probes to avoid bursts of connections
+        self._schedule(target, random.uniform(0, self.interval))
+
+    def _remove(self, name):
+        target = self.targets.pop(name, None)
+        if target is None:
+            return
+        target.removed = True
+        if target.timer:
+            target.timer.cancel()
+        if target.registered:
+            self._deregister(target)
+
+    def _schedule(self, target, delay):
+        target.timer = self.loop.call_later(delay, self._probe, target)
+
+    def _probe(self, target):
+        if target.removed:
+            return
+        result = target.probe.start(self.loop, timeout=self.timeout)
+        result.add_done_callback(
+            lambda future: self._on_probe(target, future.result()))
+
+    def _on_probe(self, target, passed):
+        if target.removed:
+            return
+        self._schedule(target, self.interval)
+        target.failures = 0 if passed else target.failures + 1
+        if target.pending:
+            # Wait for the outstanding etcd call for the node. Failures are
+            # still counted and checked once the call completes.
+            return
+        if passed:
+            if not target.registered or \
+                    self.clock() - target.refreshed_at >= \
+                    self.client.refresh_interval(self.ttl):
+                self._register(target)
+        else:
+            if target.registered and \
+                    target.failures >= self.failure_threshold:
+                logger.info('Probe failed for %s/%s. Removing node',
+                            target.upstream, target.node_name)
+                self._deregister(target)
+
+    def _run_blocking(self, target, func, *args, **kwargs):
+        future = self.loop.run_in_executor(
+            self.executor, lambda: func(*args, **kwargs))
+        target.pending = future
+
+        def on_done(_):
+            target.pending = None
+
+        future.add_done_callback(on_done)
+        return future
+
+    def _register(self, target):
+        def on_done(future):
+            if future.exception() is not None:
+                logger.warning('Failed to register %s/%s: %s',
+                               target.upstream, target.node_name,
+                               future.exception())
+                return
+            target.registered = True
+            target.refreshed_at = self.clock()
+            if target.removed or target.failures >= self.failure_threshold:
+                # Removed or failed while the node was being registered
+                self._deregister(target)
+
+        self._run_blocking(
+            target, self.client.discover_node, target.upstream,
+            target.node_name, target.endpoint, ttl=self.ttl,
+            meta=target.meta).add_done_callback(on_done)
+
+    def _deregister(self, target):
+        def on_done(future):
+            if future.exception() is not None:
+                logger.warning('Failed to remove %s/%s: %s',
+                               target.upstream, target.node_name,
+                               future.exception())
+                return
+
+        target.registered = False
+        target.refreshed_at = None
+        self._run_blocking(
+            target, self.client.remove_node, target.upstream,
+            target.node_name).add_done_callback(on_done)
+
+    def run(self):
+        """
+        Runs the agent until :meth:`stop` is called.
+
+        :return: None
+        """
+        self.loop.run_forever()
+
+    def stop(self):
+        """
+        Stops the agent. Safe to be called from any thread. Registered nodes
+        are left to expire with their ttl.
+
+        :return: None
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,181 @@
+"""
+Streaming bulk mode for yoda operations.
+
+Operations are read as newline delimited JSON (NDJSON). Each line names the
+client method in `op` and passes its arguments as the remaining fields. An
+optional `id` is echoed back in the result. e.g.:
+
+    {"id": "1", "op": "discover_node", "upstream": "app-v1-8080",
+     "node_name": "node1", "endpoint": "host1:40001", "ttl": 60}
+    {"op": "wire_proxy", "host": {"hostname": "app.example.com",
+     "locations": [{"upstream": "app-v1-8080"}]}}
+
+Operations are applied by a bounded pool of workers sharing a single client
+(and hence a single etcd connection pool). Operations for the same entity
+(upstream, host, tcp listener or proxy node) are always applied by the same
+worker, in the order they were read. A result is written as one NDJSON line
+per operation, in completion order. e.g.:
+
+    {"id": "1", "line": 1, "ok": true, "op": "discover_node", "result": null}
+"""
+import json
+import threading
+from yoda.model import FrozenHost, TcpListener
+from yoda.util import DEFAULT_MAX_WORKERS
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+__author__ = 'sukrit'
+
+# Maximum number of operations queued for a single worker.
+DEFAULT_QUEUE_SIZE = 1000
+
+# Supported operations mapped to the function used for getting the ordering
+# key from the operation parameters.
+OPERATIONS = {
+    'register_upstream': lambda params: ('upstream', params['upstream']),
+    'remove_upstream': lambda params: ('upstream', params['upstream']),
+    'renew_upstream': lambda params: ('upstream', params['upstream']),
+    'discover_node': lambda params: ('upstream', params['upstream']),
+    'remove_node': lambda params: ('upstream', params['upstream']),
+    'discover_proxy_node': lambda params: ('proxy', params['node_name']),
+    'remove_proxy_node': lambda params: ('proxy', params['node_name']),
+    'wire_proxy': lambda params: ('host', params['host'].hostname),
+    'unwire_proxy': lambda params: ('host', params['hostname']),
+    'update_tcp_listener':
+        lambda params: ('listener', params['tcp_listener'].name),
+    'remove_tcp_listener': lambda params: ('listener',
+                                           params['listener_name']),
+}
+
+# Converters for parameters that are passed as models, keyed by operation
+# and parameter name.
+CONVERTERS = {
+    ('wire_proxy', 'host'): lambda value: FrozenHost(**value).thaw(),
+    ('update_tcp_listener', 'tcp_listener'):
+        lambda value: TcpListener(**value),
+}
+
+
+def parse_operation(line):
+    """
+    Parses single NDJSON operation.
+
+    :param line: JSON encoded operation
+    :type line: str
+    :return: Tuple of (operation id, operation name, ordering key,
+        parameters)
+    :rtype: tuple
+    :raises ValueError: If operation is invalid or not supported.
+    """
+    try:
+        params = json.loads(line)
+    except ValueError as exc:
+        raise ValueError('Invalid JSON: %s' % exc)
+    if not isinstance(params, dict):
+        raise ValueError('Operation must be a JSON object')
+    op_id = params.pop('id', None)
+    op = params.pop('op', None)
+    if op not in OPERATIONS:
+        raise ValueError('Unsupported operation: %s' % op)
+    try:
+        for (converter_op, name), converter in CONVERTERS.items():
+            if converter_op == op and name in params:
+                params[name] = converter(params[name])
+        key = OPERATIONS[op](params)
+    except (KeyError, TypeError) as exc:
+        raise ValueError('Invalid parameters for %s: %s' % (op, exc))
+    return op_id, op, key, params
+
+
+class BulkProcessor:
+    """
+    Applies a stream of NDJSON operations using a single client.
+    """
+
+    def __init__(self, client, max_workers=DEFAULT_MAX_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :param client: Yoda client
+        :type client: yoda.client.Client
+        :keyword max_workers: Number of workers applying operations.
+            (Default: DEFAULT_MAX_WORKERS)
+        :type max_workers: int
+        :keyword queue_size: Maximum number of operations queued for a
+            worker. Reading blocks once the queue is full.
+            (Default: DEFAULT_QUEUE_SIZE)
+        :type queue_size: int
+        """
+        self.client = client
+        self.max_workers = max(max_workers, 1)
+        self.queue_size = queue_size
+
+    def _write(self, output, lock, result, summary):
+        line = json.dumps(result, sort_keys=True, default=str)
+        with lock:
+            summary['ok' if result['ok'] else 'failed'] += 1
+            output.write(line)
+            output.write('\n')
+            output.flush()
+
+    def _apply(self, op, params):
+        return getattr(self.client, op)(**params)
+
+    def run(self, lines, output):
+        """
+        Applies operations and writes results.
+
+        :param lines: Iterable of NDJSON lines (e.g. file object)
+        :param output: Output stream for NDJSON results
+        :return: Dictionary with number of successful and failed operations.
+            e.g.: {'ok': 10, 'failed': 1}
+        :rtype: dict
+        """
+        lock = threading.Lock()
+        summary = {'ok': 0, 'failed': 0}
+        done = object()
+        queues = [queue.Queue(maxsize=self.queue_size)
+                  for _ in range(self.max_workers)]
+
+        def worker(pending):
+            while True:
+                item = pending.get()
+                if item is done:
+                    return
+                line_no, op_id, op, params = item
+                result = {'line': line_no, 'id': op_id, 'op': op}
+                try:
+                    result['result'] = self._apply(op, params)
+                    result['ok'] = True
+                except Exception as exc:
+                    result['ok'] = False
+                    result['error'] = '%s: %s' % (type(exc).__name__, exc)
+                self._write(output, lock, result, summary)
+
+        workers = [threading.Thread(target=worker, args=(pending,))
+                   for pending in queues]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        try:
+            for line_no, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    op_id, op, key, params = parse_operation(line)
+                except ValueError as exc:
+                    self._write(output, lock, {
+                        'line': line_no, 'ok': False, 'error': str(exc)},
+                        summary)
+                    continue
+                queues[hash(key) % len(queues)].put(
+                    (line_no, op_id, op, params))
+        finally:
+            for pending in queues:
+                pending.put(done)
+            for thread in workers:
+                thread.join()
+        return summary
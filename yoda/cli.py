@@ -0,0 +1,233 @@
+"""
+Command line interface for yoda.
+
+Usage:
+
+    yoda [--etcd-host HOST] [--etcd-port PORT] [--etcd-base BASE] \\
+        [--consistency LEVEL] \\
+        COMMAND [ARGS] [+ COMMAND [ARGS] ...]
+
+Multiple operations can be passed in a single invocation by separating them
+with a standalone `+`. e.g.:
+
+    yoda discover app-v1-8080 node1 host1:40001 \\
+        + discover app-v1-8080 node2 host2:40001
+
+Operations are executed in the given order and execution stops at the first
+failed operation. All operations share one client, created using the etcd
+options of the first operation. The etcd client library is only imported
+once the client is created.
+"""
+import argparse
+import json
+import os
+import sys
+from yoda.bulk import BulkProcessor
+from yoda.client import Client
+from yoda.consistency import LEVELS
+from yoda.model import Host, Location
+from yoda.util import DEFAULT_MAX_WORKERS
+
+__author__ = 'sukrit'
+
+OPERATION_SEPARATOR = '+'
+
+
+def _meta(values):
+    meta = dict()
+    for value in values or []:
+        key, _, meta_value = value.partition('=')
+        meta[key] = meta_value
+    return meta
+
+
+def _location(value):
+    """
+    Parses location in the format `UPSTREAM` or `PATH=UPSTREAM`.
+    """
+    path, _, upstream = value.rpartition('=')
+    return path or '/', upstream
+
+
+def discover(client, args):
+    client.discover_node(args.upstream, args.node, args.endpoint,
+                         ttl=args.ttl, meta=_meta(args.meta) or None)
+
+
+def remove(client, args):
+    client.remove_node(args.upstream, args.node)
+
+
+def register(client, args):
+    kwargs = dict()
+    if args.ttl:
+        kwargs['ttl'] = args.ttl
+    client.register_upstream(
+        args.upstream, mode=args.mode, health_uri=args.health_uri,
+        health_timeout=args.health_timeout,
+        health_interval=args.health_interval, **kwargs)
+
+
+def wire(client, args):
+    locations = [
+        Location(upstream, path=path, allowed_acls=args.allowed_acl,
+                 denied_acls=args.denied_acl, force_ssl=args.force_ssl)
+        for path, upstream in (_location(value) for value in args.locations)]
+    client.wire_proxy(Host(args.hostname, locations, aliases=args.alias))
+
+
+def unwire(client, args):
+    client.unwire_proxy(args.hostname, upstreams=args.upstreams)
+
+
+def get_nodes(client, args):
+    if args.meta:
+        nodes = client.get_nodes_with_meta(args.upstream)
+    else:
+        nodes = client.get_nodes(args.upstream)
+    args.output.write(json.dumps(nodes, sort_keys=True))
+    args.output.write('\n')
+
+
+def bulk(client, args):
+    processor = BulkProcessor(client, max_workers=args.workers)
+    if args.file == '-':
+        summary = processor.run(sys.stdin, args.output)
+    else:
+        with open(args.file) as lines:
+            summary = processor.run(lines, args.output)
+    if summary['failed']:
+        raise ValueError('%d of %d operation(s) failed' % (
+            summary['failed'], summary['failed'] + summary['ok']))
+
+
+def build_parser():
+    """
+    Builds the argument parser for a single operation.
+
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        prog='yoda', description='Controls yoda proxy using etcd.',
+        epilog='Multiple operations can be separated using "%s".' %
+        OPERATION_SEPARATOR)
+    parser.add_argument('--etcd-host',
+                        default=os.environ.get('ETCD_HOST', 'localhost'))
+    parser.add_argument('--etcd-port', type=int,
+                        default=int(os.environ.get('ETCD_PORT', 4001)))
+    parser.add_argument('--etcd-base',
+                        default=os.environ.get('ETCD_YODA_BASE', '/yoda'))
+    parser.add_argument('--consistency', choices=LEVELS,
+                        help='Consistency for reads. (Default: follower)')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    command = commands.add_parser('discover', help='Discover node')
+    command.add_argument('upstream')
+    command.add_argument('node')
+    command.add_argument('endpoint', help='Endpoint for node (host:port)')
+    command.add_argument('--ttl', type=int, default=120)
+    command.add_argument('--meta', action='append', metavar='KEY=VALUE')
+    command.set_defaults(func=discover)
+
+    command = commands.add_parser('remove', help='Remove node')
+    command.add_argument('upstream')
+    command.add_argument('node')
+    command.set_defaults(func=remove)
+
+    command = commands.add_parser('register', help='Register upstream')
+    command.add_argument('upstream')
+    command.add_argument('--mode', default='http', choices=('http', 'tcp'))
+    command.add_argument('--health-uri')
+    command.add_argument('--health-timeout')
+    command.add_argument('--health-interval')
+    command.add_argument('--ttl', type=int)
+    command.set_defaults(func=register)
+
+    command = commands.add_parser('wire', help='Wire proxy for host')
+    command.add_argument('hostname')
+    command.add_argument('locations', nargs='+',
+                         metavar='[PATH=]UPSTREAM')
+    command.add_argument('--alias', action='append')
+    command.add_argument('--allowed-acl', action='append')
+    command.add_argument('--denied-acl', action='append')
+    command.add_argument('--force-ssl', action='store_true')
+    command.set_defaults(func=wire)
+
+    command = commands.add_parser('unwire', help='Unwire proxy for host')
+    command.add_argument('hostname')
+    command.add_argument('upstreams', nargs='*', metavar='UPSTREAM',
+                         help='Upstreams to be removed along with the host')
+    command.set_defaults(func=unwire)
+
+    command = commands.add_parser('get-nodes',
+                                  help='Print nodes for upstream as JSON')
+    command.add_argument('upstream')
+    command.add_argument('--meta', action='store_true',
+                         help='Include meta information for the nodes')
+    command.set_defaults(func=get_nodes)
+
+    command = commands.add_parser(
+        'bulk', help='Apply NDJSON operations and print NDJSON results')
+    command.add_argument('file', nargs='?', default='-',
+                         help='File with operations. (Default: stdin)')
+    command.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS)
+    command.set_defaults(func=bulk)
+    return parser
+
+
+def split_operations(argv):
+    """
+    Splits command line arguments into arguments for each operation.
+
+    :param argv: Command line arguments
+    :type argv: list
+    :return: List of argument lists
+    :rtype: list
+    """
+    operations = [[]]
+    for arg in argv:
+        if arg == OPERATION_SEPARATOR:
+            operations.append([])
+        else:
+            operations[-1].append(arg)
+    return [operation for operation in operations if operation]
+
+
+def main(argv=None, client=None, output=None):
+    """
+    Entry point for `yoda` command.
+
+    :keyword argv: Command line arguments. (Default: sys.argv[1:])
+    :type argv: list
+    :keyword client: Yoda client. If None, client is created using the
+        etcd options for the first operation.
+    :type client: yoda.client.Client
+    :keyword output: Output stream. (Default: sys.stdout)
+    :return: Exit code
+    :rtype: int
+    """
+    parser = build_parser()
+    operations = split_operations(sys.argv[1:] if argv is None else argv)
+    if not operations:
+        parser.print_usage(sys.stderr)
+        return 2
+    # Validate all operations before executing any of them
+    parsed = [parser.parse_args(operation) for operation in operations]
+    for args in parsed:
+        args.output = output or sys.stdout
+        if client is None:
+            client = Client(etcd_host=args.etcd_host,
+                            etcd_port=args.etcd_port,
+                            etcd_base=args.etcd_base,
+                            consistency=args.consistency)
+        try:
+            args.func(client, args)
+        except Exception as exc:
+            sys.stderr.write('yoda %s failed: %s\n' % (args.command, exc))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
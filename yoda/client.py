@@ -1,11 +1,137 @@
-import etcd
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import json
 import os.path
-from yoda.util import dict_merge
+import random
+import re
+import threading
+import time
+from yoda.adaptive import TTL_NODE, TTL_PROXY_NODE, TTL_UPSTREAM
+from yoda.consistency import as_consistency, FOLLOWER, IndexTracker, \
+    LEADER_CACHE_TTL, LEVEL_FOLLOWER, LEVEL_LEADER, LINEARIZABLE
+from yoda.keyspace import ACL_ALLOWED, ACL_DENIED, FIELD_BIND, \
+    FIELD_FORCE_SSL, FIELD_PATH, FIELD_UPSTREAM, HOST_KINDS, KIND_LOCATION, \
+    UPSTREAM_KINDS, KeySpace
+from yoda.ratelimit import PRIORITY_REGISTER, PRIORITY_REMOVE, \
+    PRIORITY_RENEW, jitter
+from yoda.retry import Deadline, DeadlineExceeded, NO_RETRY, RetryPolicy, \
+    transient_errors
+from yoda.stats import ClusterStats, DEFAULT_EXPIRING_WITHIN
+from yoda.tracing import NOOP_SPAN
+from yoda.stream import iter_nodes, iter_response_children, node_to_tree, \
+    open_children
+from yoda.util import dict_merge, parallel_map, split_failures, \
+    DEFAULT_MAX_WORKERS
 
 __author__ = 'sukrit'
 
 DEFAULT_UPSTREAM_TTL = 3600 * 24 * 7
 
+# TTLs (in seconds) used when no ttl policy is configured
+DEFAULT_TTLS = {
+    TTL_NODE: 120,
+    TTL_PROXY_NODE: 300,
+    TTL_UPSTREAM: 3600,
+}
+
+# Fraction of TTL after which a record should be refreshed.
+REFRESH_RATIO = 1.0 / 3
+
+# Etcd verbs that modify the keys (and trigger watch events)
+MODIFYING_VERBS = ('set', 'write', 'delete', 'test_and_set')
+
+# Etcd verbs that are safe to be repeated. Writes are safe to be repeated
+# only when they update an existing key (prevExist=True).
+IDEMPOTENT_VERBS = ('read', 'stream', 'set', 'delete', 'refresh')
+
+# Etcd verbs that read keys. 'stream' starts a streaming read (see
+# yoda.stream.open_children).
+READ_VERBS = ('read', 'stream')
+
+
+DEFAULT_SWITCH_TIMEOUT = 300
+DEFAULT_SWITCH_POLL_INTERVAL = 2
+DEFAULT_ROLLBACK_TTL = 3600
+
+# Remainder of an upstream name after the application name (see
+# as_upstream): '<port>' or '<version>-<port>'
+APP_UPSTREAM_SUFFIX = re.compile(r'^(?:[^-]+-)?[0-9]+$')
+
+
+def _key_not_found_errors():
+    """
+    Gets the errors raised by etcd client when key does not exist. Used as
+    `except _key_not_found_errors():`, which is only evaluated once an
+    exception is raised, so that etcd is not imported eagerly.
+
+    :rtype: tuple
+    """
+    import etcd
+    return KeyError, etcd.EtcdKeyNotFound
+
+
+def _error_index(exc):
+    """
+    Gets the etcd index (X-Etcd-Index) reported along with an etcd error,
+    e.g. when the read key does not exist.
+
+    :param exc: Etcd error
+    :type exc: Exception
+    :return: Etcd index or None if not reported.
+    :rtype: int
+    """
+    payload = getattr(exc, 'payload', None)
+    return payload.get('index') if isinstance(payload, dict) else None
+
+
+def _traced(func):
+    """
+    Decorator for client methods. Records a span for the method if the
+    client has a tracer.
+    """
+    name = 'yoda.%s' % func.__name__
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.tracer is None:
+            return func(self, *args, **kwargs)
+        with self.tracer.span(name, attributes={
+                'yoda.args': ','.join(str(arg) for arg in args
+                                      if isinstance(arg, (str, int)))}):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _operation(func):
+    """
+    Decorator for client operations. If the client has an operation_timeout
+    and no deadline is active for the calling thread, a deadline is started
+    for the operation and shared by all etcd calls made by it. The operation
+    is traced using :func:`_traced`.
+    """
+    traced = _traced(func)
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not self.operation_timeout or \
+                self._context.deadline is not None:
+            return traced(self, *args, **kwargs)
+        with self.deadline(self.operation_timeout, func.__name__):
+            return traced(self, *args, **kwargs)
+    return wrapper
+
+
+class _OperationContext(threading.local):
+    """
+    Deadline, progress and change set for the operation running in the
+    current thread.
+    """
+    deadline = None
+    operation = None
+    completed = None
+    change_set = None
+
 
 def as_upstream(app_name, private_port, app_version=None):
     """
@@ -33,32 +159,629 @@ def as_endpoint(backend_host, backend_port):
     return '%s:%s' % (backend_host, backend_port)
 
 
+class UpstreamNotReady(Exception):
+    """
+    Raised when the upstream does not have enough ready nodes in time.
+    """
+
+    def __init__(self, upstream, ready_nodes, min_nodes):
+        Exception.__init__(
+            self, 'Upstream %s has %d ready node(s). Expected at least %d' %
+            (upstream, ready_nodes, min_nodes))
+        self.upstream = upstream
+        self.ready_nodes = ready_nodes
+        self.min_nodes = min_nodes
+
+
+class NoMatchingLocations(Exception):
+    """
+    Raised when no location routes to the upstream being switched (e.g. the
+    upstream name is misspelt).
+    """
+
+    def __init__(self, upstream, hostnames=None):
+        Exception.__init__(
+            self, 'No location%s routes to upstream %s' % (
+                ' for %s' % ', '.join(hostnames) if hostnames else '',
+                upstream))
+        self.upstream = upstream
+        self.hostnames = hostnames
+
+
+def matches_app(upstream, app_or_prefix, exact=True):
+    """
+    Checks if upstream belongs to an application (or upstream prefix), as
+    named by :func:`as_upstream`. e.g. 'mock-app' and 'mock-app-v1' both
+    match 'mock-app-v1-8080'.
+
+    :param upstream: Name of upstream
+    :type upstream: str
+    :param app_or_prefix: Application name or upstream prefix
+    :type app_or_prefix: str
+    :keyword exact: If True, the rest of the upstream name must be
+        '<port>' or '<version>-<port>', so that 'mock-app' does not match
+        'mock-app-two-v1-8080'. Note that 'mock-app-two-8080' still matches
+        (as version 'two' of 'mock-app'). If False, any upstream starting
+        with '<app_or_prefix>-' matches. (Default: True)
+    :type exact: bool
+    :rtype: bool
+    """
+    prefix = app_or_prefix.rstrip('-')
+    if upstream == prefix:
+        return True
+    if not upstream.startswith(prefix + '-'):
+        return False
+    return not exact or \
+        APP_UPSTREAM_SUFFIX.match(upstream[len(prefix) + 1:]) is not None
+
+
+class DecommissionResult:
+    """
+    Result of :meth:`Client.decommission`.
+    """
+
+    def __init__(self, upstreams, planned=None, deleted=None, failures=None,
+                 skipped=None, dry_run=False, still_routed=None):
+        """
+        :param upstreams: Upstreams matched for decommission
+        :type upstreams: list
+        :keyword planned: List of keys (hosts, locations, listeners and
+            upstreams) to be deleted, in the order of deletion
+        :type planned: list
+        :keyword deleted: List of keys (hosts, locations, listeners and
+            upstreams) that were deleted
+        :type deleted: list
+        :keyword failures: Dictionary of key to exception
+        :type failures: dict
+        :keyword skipped: List of upstream keys that were not deleted as
+            routes to them could not be deleted
+        :type skipped: list
+        :keyword dry_run: True if this is the plan of a dry run, i.e.
+            nothing was deleted. (Default: False)
+        :type dry_run: bool
+        :keyword still_routed: List of matching upstreams (including the
+            ones not found in the tree) still routed by routes that could
+            not be deleted
+        :type still_routed: list
+        """
+        self.upstreams = upstreams
+        self.planned = planned or []
+        self.dry_run = dry_run
+        self.deleted = deleted or []
+        self.failures = failures or {}
+        self.skipped = skipped or []
+        self.still_routed = still_routed or []
+
+    @property
+    def success(self):
+        """
+        True if all planned keys were deleted. Always False for a dry run,
+        as nothing was deleted.
+        """
+        return not self.dry_run and not self.failures and not self.skipped
+
+
+class SwitchResult:
+    """
+    Result of :meth:`Client.switch_upstream`.
+    """
+
+    def __init__(self, client, from_upstream, to_upstream, switched=None,
+                 failures=None, reverted=False):
+        """
+        :param client: Yoda client used for the switch
+        :type client: Client
+        :param from_upstream: Upstream the locations were switched from
+        :type from_upstream: str
+        :param to_upstream: Upstream the locations were switched to
+        :type to_upstream: str
+        :keyword switched: List of location upstream keys that were switched
+        :type switched: list
+        :keyword failures: Dictionary of location upstream key to exception
+        :type failures: dict
+        :keyword reverted: True if switched keys were reverted after a
+            failure.
+        :type reverted: bool
+        """
+        self.client = client
+        self.from_upstream = from_upstream
+        self.to_upstream = to_upstream
+        self.switched = switched or []
+        self.failures = failures or {}
+        self.reverted = reverted
+
+    @property
+    def success(self):
+        return not self.failures
+
+    def rollback(self, max_concurrency=None):
+        """
+        Switches the locations back to the old upstream (using compare and
+        swap). The old upstream must not have expired yet.
+
+        :keyword max_concurrency: Maximum number of locations switched in
+            parallel. (Default: None, i.e. all at once)
+        :type max_concurrency: int
+        :return: Result of the rollback
+        :rtype: SwitchResult
+        """
+        with self.client.change_set('rollback %s to %s' % (
+                self.to_upstream, self.from_upstream)):
+            switched, failures = self.client._switch_keys(
+                self.switched, self.to_upstream, self.from_upstream,
+                max_concurrency)
+        return SwitchResult(self.client, self.to_upstream, self.from_upstream,
+                            switched=switched, failures=failures)
+
+
 class Client:
     """
     Yoda Client that uses etcd API to control the proxy,
     """
     def __init__(self, etcd_cl=None, etcd_port=None,
-                 etcd_host=None, etcd_base=None):
+                 etcd_host=None, etcd_base=None, write_limiter=None,
+                 startup_jitter=None, refresh_jitter=0.1,
+                 operation_timeout=None, retry_policy=None, tracer=None,
+                 ttl_policy=None, consistency=None, read_clients=None):
         """
         Initializes etcd client.
         :param etcd_cl:
         :param etcd_port:
         :param etcd_host:
+        :keyword write_limiter: Optional limiter used for throttling etcd
+            writes. (Default: None)
+        :type write_limiter: yoda.ratelimit.TokenBucket
+        :keyword startup_jitter: Maximum random delay (in seconds) before the
+            first registration of an upstream or node. (Default: None)
+        :type startup_jitter: float
+        :keyword refresh_jitter: Fraction used for randomizing refresh
+            intervals returned by :meth:`refresh_interval`. (Default: 0.1)
+        :type refresh_jitter: float
+        :keyword operation_timeout: Optional deadline (in seconds) for every
+            client operation, shared by all etcd calls made by the operation.
+            (Default: None)
+        :type operation_timeout: float
+        :keyword retry_policy: Policy for retrying etcd calls that are safe
+            to be repeated. (Default: RetryPolicy())
+        :type retry_policy: yoda.retry.RetryPolicy
+        :keyword tracer: Optional tracer used for recording spans for client
+            methods and etcd requests. (Default: None)
+        :type tracer: yoda.tracing.Tracer
+        :keyword ttl_policy: Optional policy used for picking ttls (when not
+            passed explicitly) and refresh intervals based on observed etcd
+            write latency. If None, DEFAULT_TTLS are used. (Default: None)
+        :type ttl_policy: yoda.adaptive.AdaptiveTtlPolicy
+        :keyword consistency: Default consistency for reads that do not pass
+            one explicitly (Consistency or level name). Reads made before
+            writes (e.g. in :meth:`wire_proxy`) are always linearizable.
+            (Default: yoda.consistency.FOLLOWER)
+        :type consistency: yoda.consistency.Consistency
+        :keyword read_clients: Etcd clients (e.g. one per etcd member) across
+            which follower reads are spread. Leader reads are sent to the
+            client for the current leader. (Default: [etcd_cl])
+        :type read_clients: list
         :return:
         """
         if not etcd_cl:
+            # Imported lazily as etcd (with urllib3 and dnspython) is slow to
+            # import.
+            import etcd
             self.etcd_cl = etcd.Client(
                 host=etcd_host or 'localhost',
                 port=etcd_port or 4001)
         else:
             self.etcd_cl = etcd_cl
         self.etcd_base = etcd_base or '/yoda'
+        self.keyspace = KeySpace(self.etcd_base)
+        self.write_limiter = write_limiter
+        self.startup_jitter = startup_jitter
+        self.refresh_jitter = refresh_jitter
+        self.operation_timeout = operation_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.tracer = tracer
+        self.ttl_policy = ttl_policy
+        self.consistency = as_consistency(consistency) or FOLLOWER
+        self.read_clients = list(read_clients or [self.etcd_cl])
+        self.stale_reads = 0
+        self._index = IndexTracker()
+        self._next_read_client = 0
+        self._leader = None
+        self._context = _OperationContext()
+        self._registered = set()
+        self._written = {}
+        self._sleep = time.sleep
+        self._change_set_lock = threading.Lock()
+
+    def _etcd_op(self, verb, key, *args, **kwargs):
+        """
+        Executes etcd operation. All etcd calls made by the client go through
+        this method. Calls that are safe to be repeated are retried using
+        :attr:`retry_policy`. If a deadline is active, the call is not
+        started (or retried) once the deadline expires, and reads are made
+        with the remaining time as timeout.
+
+        :param verb: Name of etcd client method (e.g.: 'set', 'read') or
+            'stream' for a streaming read. Streaming reads return the HTTP
+            response once the headers are received, so failures while the
+            body is consumed are not retried.
+        :type verb: str
+        :param key: Etcd key
+        :type key: str
+        :keyword priority: Priority used for rate limiting writes.
+            (Default: PRIORITY_REGISTER)
+        :type priority: int
+        :keyword idempotent: Whether the call is safe to be repeated. If
+            None, it is determined using the verb (See IDEMPOTENT_VERBS).
+            (Default: None)
+        :type idempotent: bool
+        :keyword consistency: Consistency for reads (not used for watches).
+            (Default: :attr:`consistency`)
+        :type consistency: yoda.consistency.Consistency
+        :return: Result of etcd operation
+        :raises yoda.retry.DeadlineExceeded: If deadline for the operation
+            expires.
+        """
+        priority = kwargs.pop('priority', PRIORITY_REGISTER)
+        idempotent = kwargs.pop('idempotent', None)
+        consistency = as_consistency(kwargs.pop('consistency', None))
+        etcd_cl = self.etcd_cl
+        stale = False
+        if verb in READ_VERBS and not kwargs.get('wait'):
+            consistency = consistency or self.consistency
+            read_kwargs = dict(kwargs)
+            etcd_cl = self._read_client(consistency)
+            if etcd_cl is None:
+                # Leader is unknown. Linearizable reads are served by the
+                # leader as well.
+                consistency = LINEARIZABLE
+                etcd_cl = self.etcd_cl
+            kwargs.update(consistency.read_options)
+            seen_index = self._index.highest
+        else:
+            consistency = None
+        if idempotent is None:
+            idempotent = verb in IDEMPOTENT_VERBS or \
+                (verb == 'write' and kwargs.get('prevExist') is True)
+        policy = self.retry_policy if idempotent else NO_RETRY
+        context = self._context
+        deadline = context.deadline
+        read_timeout = kwargs.get('timeout')
+        attempt = 1
+        span_scope = NOOP_SPAN if self.tracer is None else self.tracer.span(
+            'etcd.%s' % verb, attributes={'etcd.verb': verb, 'etcd.key': key})
+        with span_scope as span:
+            if args and args[0] is not None and verb not in READ_VERBS:
+                span.set_attribute('etcd.bytes', len(str(args[0])))
+            while True:
+                if deadline is not None:
+                    if deadline.expired:
+                        raise DeadlineExceeded(context.operation,
+                                               deadline.timeout,
+                                               context.completed)
+                    if verb in READ_VERBS:
+                        kwargs['timeout'] = min(
+                            read_timeout or deadline.timeout,
+                            deadline.remaining())
+                if verb not in READ_VERBS and self.write_limiter:
+                    self.write_limiter.acquire(priority)
+                started = time.time()
+                try:
+                    if verb == 'stream':
+                        result = open_children(etcd_cl, key, *args, **kwargs)
+                    else:
+                        result = getattr(etcd_cl, verb)(key, *args,
+                                                        **kwargs)
+                    self._observe(verb, started)
+                    break
+                except Exception as exc:
+                    self._observe(verb, started,
+                                  isinstance(exc, transient_errors()))
+                    if consistency is not None and \
+                            consistency.level == LEVEL_LEADER:
+                        # Leader may have changed
+                        self._leader = None
+                    if attempt > 1 and verb == 'delete' and \
+                            isinstance(exc, _key_not_found_errors()):
+                        # Key was deleted by an earlier attempt
+                        result = None
+                        break
+                    span.set_attribute('etcd.retries', attempt - 1)
+                    if not policy.should_retry(exc, attempt):
+                        if deadline is not None and deadline.expired and \
+                                isinstance(exc, transient_errors()):
+                            raise DeadlineExceeded(
+                                context.operation, deadline.timeout,
+                                context.completed, cause=exc)
+                        raise
+                    delay = policy.backoff(attempt)
+                    if deadline is not None and \
+                            delay >= deadline.remaining():
+                        raise DeadlineExceeded(
+                            context.operation, deadline.timeout,
+                            context.completed, cause=exc)
+                    self._sleep(delay)
+                    attempt += 1
+            span.set_attribute('etcd.retries', attempt - 1)
+            if verb == 'read':
+                span.set_attribute('etcd.bytes', len(
+                    getattr(result, 'value', None) or ''))
+            index = getattr(result, 'etcd_index', None)
+            if consistency is not None and \
+                    consistency.is_stale(index, seen_index):
+                span.set_attribute('etcd.stale', True)
+                self.stale_reads += 1
+                stale = True
+            else:
+                self._index.observe(index)
+        if stale:
+            # Follower is lagging behind. Repeat as linearizable read
+            if verb == 'stream':
+                result.release_conn()
+            return self._etcd_op(verb, key, consistency=LINEARIZABLE,
+                                 **read_kwargs)
+        if verb in MODIFYING_VERBS:
+            self._record_change(key)
+        if verb not in READ_VERBS and context.completed is not None:
+            context.completed.append((verb, key))
+        return result
+
+    def _read_client(self, consistency):
+        """
+        Gets the etcd client for a read. Follower reads are spread across
+        :attr:`read_clients` (round robin) and leader reads are sent to the
+        client for the current leader.
+
+        :return: Etcd client or None for a leader read if the leader is not
+            known.
+        """
+        if consistency.level == LEVEL_LEADER:
+            return self._leader_client()
+        if consistency.level != LEVEL_FOLLOWER or len(self.read_clients) < 2:
+            return self.etcd_cl
+        index = self._next_read_client
+        self._next_read_client += 1
+        return self.read_clients[index % len(self.read_clients)]
+
+    def _leader_client(self):
+        """
+        Gets the read client for the current etcd leader. The leader is
+        looked up using `etcd.Client.leader` and cached for
+        LEADER_CACHE_TTL seconds.
+
+        :return: Etcd client or None if the leader can not be determined or
+            is not one of :attr:`read_clients`.
+        """
+        leader = self._leader
+        now = time.time()
+        if leader is not None and leader[0] > now:
+            return leader[1]
+        try:
+            urls = set(url.rstrip('/') for url in
+                       self.etcd_cl.leader.get('clientURLs') or [])
+        except Exception:
+            urls = set()
+        etcd_cl = None
+        for read_client in self.read_clients:
+            base_uri = read_client.base_uri
+            if isinstance(base_uri, str) and base_uri.rstrip('/') in urls:
+                etcd_cl = read_client
+                break
+        self._leader = (now + LEADER_CACHE_TTL, etcd_cl)
+        return etcd_cl
+
+    def _observe(self, verb, started, failed=False):
+        if self.ttl_policy is not None and verb not in READ_VERBS:
+            self.ttl_policy.observe(time.time() - started, failed=failed)
+
+    @contextmanager
+    def deadline(self, timeout, operation=None):
+        """
+        Runs client operations with a deadline, shared by all etcd calls
+        made within the context (including calls made by worker threads of
+        bulk operations). If a deadline is already active, it is used
+        instead.
+
+        Usage:
+
+            with client.deadline(5):
+                client.register_upstream(...)
+                client.wire_proxy(...)
+
+        :param timeout: Time budget (in seconds)
+        :type timeout: float
+        :keyword operation: Name of the operation used for reporting.
+        :type operation: str
+        :return: Deadline for the context
+        :rtype: yoda.retry.Deadline
+        """
+        context = self._context
+        if context.deadline is not None:
+            yield context.deadline
+            return
+        context.deadline = Deadline(timeout)
+        context.operation = operation or 'operation'
+        context.completed = []
+        try:
+            yield context.deadline
+        finally:
+            context.deadline = None
+            context.operation = None
+            context.completed = None
+
+    def _in_context(self, func):
+        """
+        Wraps function so that it runs with the deadline, the change set and
+        the active span of the calling thread (used for worker threads).
+        """
+        context = self._context
+        state = (context.deadline, context.operation, context.completed,
+                 context.change_set)
+        tracer = self.tracer
+        span = tracer.current_span() if tracer else None
+
+        def wrapper(*args, **kwargs):
+            previous = (context.deadline, context.operation,
+                        context.completed, context.change_set)
+            (context.deadline, context.operation, context.completed,
+             context.change_set) = state
+            try:
+                if span is None:
+                    return func(*args, **kwargs)
+                with tracer.activate(span):
+                    return func(*args, **kwargs)
+            finally:
+                (context.deadline, context.operation, context.completed,
+                 context.change_set) = previous
+        return wrapper
+
+    @property
+    def generation_key(self):
+        """
+        Key that gets updated after every successful change set.
+        """
+        return self.keyspace.generation_key
+
+    def _record_change(self, key):
+        current = self._context.change_set
+        if current is None:
+            return
+        info = self.keyspace.parse(key)
+        # Worker threads of a bulk operation share the change set
+        with self._change_set_lock:
+            current['changes'] += 1
+            if info is None or info.name is None:
+                return
+            if info.kind in UPSTREAM_KINDS:
+                current['upstreams'].add(info.name)
+            elif info.kind in HOST_KINDS:
+                current['hosts'].add(info.name)
+
+    @contextmanager
+    def change_set(self, summary=None):
+        """
+        Groups yoda operations into a single change set. Once all operations
+        inside the context succeed, :attr:`generation_key` is updated with a
+        summary of the changes, so that consumers (e.g. proxy) can watch a
+        single key and reload once per batch. Nested change sets are merged
+        into the outermost one. Change sets are tracked per thread (and
+        shared with worker threads of bulk operations), so threads sharing a
+        client get their own change sets. Generation key is not updated if
+        the operations fail or do not modify any key.
+
+        Usage:
 
-    def get_nodes(self, upstream):
+            with client.change_set('deploy mock-app v2'):
+                client.register_upstream(...)
+                client.wire_proxy(...)
+
+        :keyword summary: Optional summary for the change set.
+        :type summary: str
+        :return: Dictionary tracking the changes made within the change set.
+        :rtype: dict
+        """
+        context = self._context
+        outermost = context.change_set is None
+        if outermost:
+            context.change_set = {
+                'summary': summary,
+                'changes': 0,
+                'upstreams': set(),
+                'hosts': set(),
+            }
+        current = context.change_set
+        try:
+            yield current
+        finally:
+            if outermost:
+                context.change_set = None
+        if outermost and current['changes']:
+            self._etcd_op('set', self.generation_key, json.dumps({
+                    'summary': current['summary'],
+                    'changes': current['changes'],
+                    'upstreams': sorted(current['upstreams']),
+                    'hosts': sorted(current['hosts']),
+                    'timestamp': time.time()
+                }, sort_keys=True))
+
+    def _delay_registration(self, *registration):
+        """
+        Sleeps for a random duration (bounded by startup_jitter) the first
+        time a given registration is made by this client.
+        """
+        if registration in self._registered:
+            return
+        self._registered.add(registration)
+        if self.startup_jitter:
+            self._sleep(random.uniform(0, self.startup_jitter))
+
+    def _set_or_refresh(self, key, value, ttl, refresh=True):
+        """
+        Sets the value for given key with ttl. If the value was already
+        written by this client, only the ttl is refreshed so that watchers
+        are not notified. Falls back to a full write if the key has expired
+        or its value was modified by someone else.
+
+        :param key: Etcd key
+        :type key: str
+        :param value: Value for the key
+        :param ttl: Time to live for the key (in seconds)
+        :type ttl: int
+        :keyword refresh: If False, full write is always performed.
+            (Default: True)
+        :type refresh: bool
+        :return: True if ttl was refreshed, False otherwise.
+        :rtype: bool
+        """
+        if refresh and key in self._written and self._written[key] == value:
+            try:
+                self._etcd_op('refresh', key, ttl, prevValue=value,
+                              priority=PRIORITY_RENEW)
+                return True
+            except _key_not_found_errors() + (ValueError,):
+                # Key expired or value changed. Do a full write
+                pass
+        self._etcd_op('set', key, value, ttl=ttl)
+        self._written[key] = value
+        return False
+
+    def ttl(self, kind):
+        """
+        Gets the ttl used for a record type when no ttl is passed explicitly.
+
+        :param kind: Record type (e.g. yoda.adaptive.TTL_NODE)
+        :type kind: str
+        :return: Time to live (in seconds)
+        :rtype: int
+        """
+        if self.ttl_policy is None:
+            return DEFAULT_TTLS[kind]
+        return self.ttl_policy.ttl(kind)
+
+    def refresh_interval(self, ttl):
+        """
+        Gets the jittered interval after which a record with given ttl should
+        be refreshed.
+
+        :param ttl: Time to live for the record (in seconds)
+        :type ttl: int
+        :return: Refresh interval (in seconds)
+        :rtype: float
+        """
+        if self.ttl_policy is None:
+            interval = ttl * REFRESH_RATIO
+        else:
+            interval = self.ttl_policy.refresh_interval(ttl)
+        return jitter(interval, self.refresh_jitter)
+
+    @_operation
+    def get_nodes(self, upstream, consistency=None):
         """
         Get nodes for a given upstream
         :param upstream: Upstream whose nodes needs to be determined.
         :type upstream: str
+        :keyword consistency: Consistency for the read.
+            (Default: :attr:`consistency`)
+        :type consistency: yoda.consistency.Consistency
         :return: Dictionary of nodes for the upstream. e.g.:
         {
             'node1': 'host1:port1',
@@ -66,53 +789,220 @@ class Client:
         }
         :rtype: dict
         """
-        endpoints_key = '{etcd_base}/upstreams/{upstream}/endpoints'.format(
-            etcd_base=self.etcd_base, upstream=upstream
-        )
+        endpoints_key = self.keyspace.endpoints_key(upstream)
         try:
-            endpoints = self.etcd_cl.read(endpoints_key, recursive=True)
-        except KeyError:
+            endpoints = self._etcd_op('read', endpoints_key, recursive=True,
+                                      consistency=consistency)
+        except _key_not_found_errors():
             return dict()
-        return dict((os.path.basename(endpoint.key), endpoint.value)
+        parse = self.keyspace.parse
+        return dict((parse(endpoint.key).child, endpoint.value)
                     for endpoint in endpoints.children)
 
-    def get_nodes_with_meta(self, upstream):
+    @_operation
+    def get_nodes_with_meta(self, upstream, consistency=None):
         """
         Get nodes with meta information about the node for given upstream
         and node_name
         :param upstream: Upstream whose nodes needs to be determined.
         :type upstream: str
+        :keyword consistency: Consistency for the reads.
+            (Default: :attr:`consistency`)
+        :type consistency: yoda.consistency.Consistency
         :return: Dictionary of nodes for the upstream.
         :rtype: dict
         """
-        endpoints_key = '{etcd_base}/upstreams/{upstream}/endpoints'.format(
-            etcd_base=self.etcd_base, upstream=upstream
-        )
-        endpoints_meta_key = \
-            '{etcd_base}/upstreams/{upstream}/endpoints-meta'.format(
-                etcd_base=self.etcd_base, upstream=upstream)
+        endpoints_key = self.keyspace.endpoints_key(upstream)
+        endpoints_meta_key = self.keyspace.endpoints_meta_key(upstream)
+        parse = self.keyspace.parse
         try:
-            endpoints = self.etcd_cl.read(endpoints_key, recursive=True)
+            endpoints = self._etcd_op('read', endpoints_key, recursive=True,
+                                      consistency=consistency)
             endpoints = dict(
-                (os.path.basename(endpoint.key), {'endpoint': endpoint.value})
+                (parse(endpoint.key).child, {'endpoint': endpoint.value})
                 for endpoint in endpoints.children)
-        except KeyError:
+        except _key_not_found_errors():
             endpoints = None
 
         try:
-            endpoints_meta = self.etcd_cl.read(endpoints_meta_key,
-                                               recursive=True)
+            endpoints_meta = self._etcd_op('read', endpoints_meta_key,
+                                           recursive=True,
+                                           consistency=consistency)
             endpoints_m = dict()
             for endpoint_meta in endpoints_meta.children:
-                key = os.path.basename(os.path.dirname(endpoint_meta.key))
-                endpoints_m.setdefault(key, {})
-                endpoints_m[key][os.path.basename(endpoint_meta.key)] = \
-                    endpoint_meta.value
-        except KeyError:
+                info = parse(endpoint_meta.key)
+                endpoints_m.setdefault(info.child, {})
+                endpoints_m[info.child][info.field] = endpoint_meta.value
+        except _key_not_found_errors():
             endpoints_m = None
 
         return dict_merge(endpoints, endpoints_m)
 
+    @_operation
+    def read_tree(self, consistency=None):
+        """
+        Reads the complete yoda tree (under etcd_base) using a single
+        recursive read.
+
+        :keyword consistency: Consistency for the read.
+            (Default: :attr:`consistency`)
+        :type consistency: yoda.consistency.Consistency
+        :return: Tuple of nested dictionary mirroring the etcd keys (relative
+            to etcd_base) and the etcd index for the read. e.g.:
+            ({
+                'upstreams': {
+                    'upstream1': {
+                        'mode': 'http',
+                        'endpoints': {'node1': 'host1:port1'}
+                    }
+                },
+                'hosts': {...}
+            }, 1234)
+        :rtype: tuple
+        """
+        try:
+            result = self._etcd_op('read', self.etcd_base, recursive=True,
+                                   consistency=consistency)
+        except _key_not_found_errors() as exc:
+            # Index for the missing tree, so that it can be watched.
+            return dict(), _error_index(exc)
+        tree = dict()
+        relative_parts = self.keyspace.relative_parts
+        for leaf in result.leaves:
+            parts = None if leaf.dir else relative_parts(leaf.key)
+            if not parts:
+                continue
+            parent = tree
+            for part in parts[:-1]:
+                parent = parent.setdefault(part, dict())
+            parent[parts[-1]] = leaf.value
+        return tree, getattr(result, 'etcd_index', None)
+
+    def watch(self, index=None, timeout=None):
+        """
+        Waits for the next change under etcd_base.
+
+        :keyword index: Etcd index to watch from. If None, waits for the next
+            change. (Default: None)
+        :type index: int
+        :keyword timeout: Timeout for the watch (in seconds)
+        :type timeout: int
+        :return: Etcd result for the change
+        :rtype: etcd.EtcdResult
+        """
+        return self._etcd_op('read', self.etcd_base, recursive=True,
+                             wait=True, waitIndex=index, timeout=timeout)
+
+    @_operation
+    def stats(self, expiring_within=DEFAULT_EXPIRING_WITHIN,
+              streaming=False, consistency=None):
+        """
+        Computes capacity and expiry statistics for the yoda tree in a single
+        pass, using the ttl returned by etcd for every key.
+
+        :keyword expiring_within: Keys with ttl less than or equal to this
+            value (in seconds) are counted as expiring.
+            (Default: DEFAULT_EXPIRING_WITHIN)
+        :type expiring_within: int
+        :keyword streaming: If True, the tree is streamed one entity at a
+            time instead of being read in a single response.
+            (Default: False)
+        :type streaming: bool
+        :keyword consistency: Consistency for the read.
+            (Default: :attr:`consistency`)
+        :type consistency: yoda.consistency.Consistency
+        :return: Cluster statistics
+        :rtype: yoda.stats.ClusterStats
+        """
+        stats = ClusterStats(self.etcd_base, expiring_within=expiring_within)
+        try:
+            result = self._etcd_op('stream' if streaming else 'read',
+                                   self.etcd_base, recursive=True,
+                                   consistency=consistency)
+        except _key_not_found_errors() as exc:
+            stats.etcd_index = _error_index(exc)
+            return stats
+        stats.etcd_index = getattr(result, 'etcd_index', None)
+        if streaming:
+            # Entities are decoded one at a time, along with the top level
+            # keys (e.g. '/yoda/upstreams', '/yoda/generation') above them.
+            for child in iter_response_children(result, depth=2,
+                                                parents=True):
+                for node in iter_nodes(child):
+                    stats.add(node['key'], node.get('value'), node.get('ttl'),
+                              bool(node.get('dir')))
+            return stats
+        for node in result.get_subtree():
+            stats.add(node.key, node.value, node.ttl, bool(node.dir))
+        return stats
+
+    def _stream_children(self, key, depth=1, consistency=None):
+        """
+        Streams children of an etcd directory. The read is made using
+        :meth:`_etcd_op`, so it is retried, bounded by the active deadline,
+        traced and made with the read consistency like any other read.
+
+        :return: Generator of raw etcd nodes (dict). Nothing is yielded if
+            the key does not exist.
+        """
+        try:
+            response = self._etcd_op('stream', key, recursive=True,
+                                     consistency=consistency)
+        except _key_not_found_errors():
+            return
+        for child in iter_response_children(response, depth=depth):
+            yield child
+
+    def _iter_records(self, key):
+        for child in self._stream_children(key):
+            yield os.path.basename(child['key']), node_to_tree(child)
+
+    def iter_upstreams(self):
+        """
+        Streams upstreams one at a time.
+
+        :return: Generator of tuple (upstream, nested upstream record). e.g.:
+            ('upstream1', {
+                'mode': 'http',
+                'endpoints': {'node1': 'host1:port1'},
+                'endpoints-meta': {'node1': {'unit-no': '1'}}
+            })
+        """
+        return self._iter_records(self.keyspace.upstreams_key)
+
+    def iter_nodes(self, upstream):
+        """
+        Streams nodes for a given upstream.
+
+        :param upstream: Upstream whose nodes needs to be determined.
+        :type upstream: str
+        :return: Generator of tuple (node_name, endpoint)
+        """
+        return self._iter_records(self.keyspace.endpoints_key(upstream))
+
+    def iter_hosts(self):
+        """
+        Streams hosts one at a time.
+
+        :return: Generator of tuple (hostname, nested host record). e.g.:
+            ('myhost.example.com', {
+                'locations': {
+                    '-': {'path': '/', 'upstream': 'upstream1', ...}
+                },
+                'aliases': {'myalias.example.com': 'myalias.example.com'}
+            })
+        """
+        return self._iter_records(self.keyspace.hosts_key)
+
+    def iter_tcp_listeners(self):
+        """
+        Streams tcp listeners one at a time.
+
+        :return: Generator of tuple (listener_name, nested listener record)
+        """
+        return self._iter_records(self.keyspace.listeners_key)
+
+    @_operation
     def register_upstream(self, upstream, mode='http', health_uri=None,
                           health_timeout=None, health_interval=None,
                           ttl=DEFAULT_UPSTREAM_TTL):
@@ -138,21 +1028,27 @@ class Client:
         :type ttl: int
         :return: None
         """
-        upstream_key = '%s/upstreams/%s' % (self.etcd_base, upstream)
+        keyspace = self.keyspace
+        upstream_key = keyspace.upstream_key(upstream)
 
+        self._delay_registration(upstream)
         # Delete existing upstream if it exists.
-        self.remove_upstream(upstream)
-        self.etcd_cl.write(upstream_key, None, ttl=ttl, dir=True)
-        self.etcd_cl.set('%s/mode' % upstream_key, mode)
+        self._etcd_safe_delete(upstream_key, recursive=True, dir=True)
+        self._etcd_op('write', upstream_key, None, ttl=ttl, dir=True)
+        self._etcd_op('set', keyspace.upstream_key(upstream, 'mode'), mode)
         if health_uri:
-            self.etcd_cl.set('%s/health/uri' % upstream_key, health_uri)
+            self._etcd_op('set', keyspace.upstream_key(upstream, 'health/uri'),
+                          health_uri)
         if health_timeout:
-            self.etcd_cl.set('%s/health/timeout' % upstream_key,
-                             health_timeout)
+            self._etcd_op('set',
+                          keyspace.upstream_key(upstream, 'health/timeout'),
+                          health_timeout)
         if health_interval:
-            self.etcd_cl.set('%s/health/interval' % upstream_key,
-                             health_interval)
+            self._etcd_op('set',
+                          keyspace.upstream_key(upstream, 'health/interval'),
+                          health_interval)
 
+    @_operation
     def remove_upstream(self, upstream):
         """
         Removes upstream with given name if it exists.
@@ -161,26 +1057,34 @@ class Client:
         :type upstream: str
         :return:None
         """
-        self._etcd_safe_delete('%s/upstreams/%s' % (self.etcd_base, upstream),
-                               recursive=True, dir=True)
+        self._etcd_safe_delete(self.keyspace.upstream_key(upstream),
+                               recursive=True, dir=True,
+                               priority=PRIORITY_REMOVE)
 
-    def renew_upstream(self, upstream, ttl=3600):
+    @_operation
+    def renew_upstream(self, upstream, ttl=None):
         """
         Renews the TTL for an existing upstream to ensure that it does not get
         removed.
 
         :param upstream: Upstream for the node.
-        :keyword ttl: Time to live for Etcd record
+        :keyword ttl: Time to live for Etcd record. If None, ttl is picked
+            using :meth:`ttl`. (Default: None)
         :type ttl: int
         :return: None
         """
-        upstream_key = '%s/upstreams/%s' % (self.etcd_base, upstream)
-        self.etcd_cl.write(upstream_key, None, ttl=ttl, dir=True,
-                           prevExist=True)
+        ttl = ttl or self.ttl(TTL_UPSTREAM)
+        upstream_key = self.keyspace.upstream_key(upstream)
+        self._etcd_op('write', upstream_key, None, ttl=ttl, dir=True,
+                      prevExist=True, priority=PRIORITY_RENEW)
 
-    def discover_node(self, upstream, node_name, endpoint, ttl=120, meta=None):
+    @_operation
+    def discover_node(self, upstream, node_name, endpoint, ttl=None,
+                      meta=None, refresh=True):
         """
-        Discover nodes for a given upstream
+        Discover nodes for a given upstream. If the endpoint and meta are
+        unchanged since the last call, only the ttl is refreshed (without
+        triggering etcd watches).
 
         :param upstream: Upstream for the node.
         :type upstream: str
@@ -188,71 +1092,278 @@ class Client:
         :type node_name: str
         :param endpoint: Discover endpoint (host:port)
         :type endpoint: str
-        :param ttl: Time to live for Etcd record
+        :param ttl: Time to live for Etcd record. If None, ttl is picked
+            using :meth:`ttl`. (Default: None)
         :type ttl: int
         :keyword meta: Meta information about the endpoint (Default: None)
         :type meta: dict
+        :keyword refresh: If False, endpoint and meta are always re-written.
+            (Default: True)
+        :type refresh: bool
         :return:
         """
-        upstream_key = '{etcd_base}/upstreams/{upstream}' \
-            .format(etcd_base=self.etcd_base, upstream=upstream)
-        node_key = '{upstream_key}/endpoints/{node}' \
-            .format(upstream_key=upstream_key, node=node_name)
-        self.etcd_cl.set(node_key, endpoint, ttl=ttl)
+        ttl = ttl or self.ttl(TTL_NODE)
+        node_key = self.keyspace.endpoint_key(upstream, node_name)
+        self._delay_registration(upstream, node_name)
+        self._set_or_refresh(node_key, endpoint, ttl, refresh=refresh)
         for meta_key, meta_value in (meta or {}).items():
-            node_key = '{upstream_key}/endpoints-meta/{node}/{meta_key}' \
-                .format(upstream_key=upstream_key, node=node_name,
-                        meta_key=meta_key)
-            self.etcd_cl.set(node_key, meta_value, ttl=ttl)
+            node_key = self.keyspace.endpoints_meta_key(upstream, node_name,
+                                                        meta_key)
+            self._set_or_refresh(node_key, meta_value, ttl, refresh=refresh)
 
-    def discover_proxy_node(self, node_name, host='172.17.42.1', ttl=300):
-        node_key = '{etcd_base}/proxy-nodes/{node}' \
-            .format(etcd_base=self.etcd_base, node=node_name)
-        self.etcd_cl.set(node_key, host, ttl=ttl)
+    @_operation
+    def discover_proxy_node(self, node_name, host='172.17.42.1', ttl=None):
+        ttl = ttl or self.ttl(TTL_PROXY_NODE)
+        node_key = self.keyspace.proxy_node_key(node_name)
+        self._set_or_refresh(node_key, host, ttl)
 
     def _etcd_safe_delete(self, key, **kwargs):
+        kwargs.setdefault('priority', PRIORITY_REMOVE)
         try:
-            self.etcd_cl.delete(key, **kwargs)
-        except KeyError:
+            self._etcd_op('delete', key, **kwargs)
+        except _key_not_found_errors():
             # Ignore
             pass
 
+    @_operation
     def remove_node(self, upstream, node_name):
-        node_key = '{etcd_base}/upstreams/{upstream}/endpoints/{node}' \
-            .format(etcd_base=self.etcd_base, upstream=upstream,
-                    node=node_name)
+        node_key = self.keyspace.endpoint_key(upstream, node_name)
+        self._written.pop(node_key, None)
         self._etcd_safe_delete(node_key)
 
+    @_operation
+    def discover_nodes(self, nodes, ttl=None, refresh=True,
+                       max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Discovers multiple nodes. The endpoint and meta keys of all nodes are
+        written in parallel (over the pooled etcd connections), so the batch
+        takes about as long as the slowest write. Startup jitter (if any) is
+        applied once for the batch.
+
+        :param nodes: List of dictionaries with the parameters for
+            :meth:`discover_node` (upstream, node_name, endpoint and
+            optionally meta and ttl). e.g.:
+            [{'upstream': 'app-v1-8080', 'node_name': 'node1',
+              'endpoint': 'host1:40001', 'meta': {'version': 'v1'}}]
+            If a node is listed more than once, the last entry is used.
+        :type nodes: list of dict
+        :keyword ttl: Default ttl for the nodes. If None, ttl is picked using
+            :meth:`ttl`. (Default: None)
+        :type ttl: int
+        :keyword refresh: If False, endpoint and meta are always re-written.
+            (Default: True)
+        :type refresh: bool
+        :keyword max_concurrency: Maximum number of parallel writes.
+            (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Tuple of results (dictionary of tuple (upstream, node_name)
+            to number of keys set and refreshed) and failures (dictionary of
+            tuple (upstream, node_name) to exception). e.g.:
+            ({('app-v1-8080', 'node1'): {'set': 2, 'refreshed': 0}},
+             {('app-v1-8080', 'node2'): EtcdException()})
+        :rtype: tuple
+        """
+        ttl = ttl or self.ttl(TTL_NODE)
+        by_node = OrderedDict()
+        for node in sorted(nodes, key=lambda node: node['upstream']):
+            by_node[(node['upstream'], node['node_name'])] = node
+
+        keyspace = self.keyspace
+        writes = []
+        for (upstream, node_name), node in by_node.items():
+            node_ttl = node.get('ttl') or ttl
+            writes.append(((upstream, node_name),
+                           keyspace.endpoint_key(upstream, node_name),
+                           node['endpoint'], node_ttl))
+            for meta_key, meta_value in sorted(
+                    (node.get('meta') or {}).items()):
+                writes.append((
+                    (upstream, node_name),
+                    keyspace.endpoints_meta_key(upstream, node_name,
+                                                meta_key),
+                    meta_value, node_ttl))
+
+        new_nodes = [name for name in by_node if name not in self._registered]
+        if new_nodes:
+            self._registered.update(new_nodes)
+            if self.startup_jitter:
+                self._sleep(random.uniform(0, self.startup_jitter))
+
+        def write(item):
+            _, key, value, node_ttl = item
+            return self._set_or_refresh(key, value, node_ttl,
+                                        refresh=refresh)
+
+        return self._collect_node_results(
+            list(by_node), writes, parallel_map(
+                self._in_context(write), writes,
+                max_workers=max_concurrency, return_exceptions=True),
+            lambda refreshed: 'refreshed' if refreshed else 'set',
+            ('set', 'refreshed'))
+
+    @_operation
+    def remove_nodes(self, nodes, max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Removes multiple nodes along with their meta information
+        (endpoints-meta). All deletes are made in parallel.
+
+        :param nodes: List of tuple (upstream, node_name)
+        :type nodes: list of tuple
+        :keyword max_concurrency: Maximum number of parallel deletes.
+            (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Tuple of results (dictionary of tuple (upstream, node_name)
+            to number of existing keys deleted) and failures (dictionary of
+            tuple (upstream, node_name) to exception). e.g.:
+            ({('app-v1-8080', 'node1'): {'deleted': 2}}, {})
+        :rtype: tuple
+        """
+        names = list(OrderedDict.fromkeys(
+            sorted(nodes, key=lambda node: node[0])))
+        keyspace = self.keyspace
+        deletes = []
+        meta_prefixes = []
+        for upstream, node_name in names:
+            deletes.append(((upstream, node_name),
+                            keyspace.endpoint_key(upstream, node_name), {}))
+            meta_key = keyspace.endpoints_meta_key(upstream, node_name)
+            deletes.append(((upstream, node_name), meta_key,
+                            {'recursive': True, 'dir': True}))
+            meta_prefixes.append(meta_key + '/')
+
+        meta_prefixes = tuple(meta_prefixes)
+        for key in list(self._written):
+            if key.startswith(meta_prefixes):
+                self._written.pop(key, None)
+        for _, key, _ in deletes:
+            self._written.pop(key, None)
+
+        def delete(item):
+            _, key, kwargs = item
+            try:
+                self._etcd_op('delete', key, priority=PRIORITY_REMOVE,
+                              **kwargs)
+                return True
+            except _key_not_found_errors():
+                return False
+
+        return self._collect_node_results(
+            names, deletes, parallel_map(
+                self._in_context(delete), deletes,
+                max_workers=max_concurrency, return_exceptions=True),
+            lambda deleted: 'deleted' if deleted else None, ('deleted',))
+
+    @staticmethod
+    def _collect_node_results(names, items, results, counter_for, counters):
+        """
+        Aggregates results for the etcd calls made for each node by
+        :meth:`discover_nodes` and :meth:`remove_nodes`. A node fails with
+        the first error raised for any of its calls.
+        """
+        summaries = OrderedDict(
+            (name, dict.fromkeys(counters, 0)) for name in names)
+        failures = dict()
+        for item, result in zip(items, results):
+            name = item[0]
+            if isinstance(result, Exception):
+                failures.setdefault(name, result)
+                continue
+            counter = counter_for(result)
+            if counter:
+                summaries[name][counter] += 1
+        return dict((name, summary) for name, summary in summaries.items()
+                    if name not in failures), failures
+
+    @_operation
     def remove_proxy_node(self, node_name):
-        node_key = '{etcd_base}/proxy-nodes/{node}' \
-            .format(etcd_base=self.etcd_base, node=node_name)
+        node_key = self.keyspace.proxy_node_key(node_name)
+        self._written.pop(node_key, None)
         self._etcd_safe_delete(node_key)
 
-    def update_tcp_listener(self, tcp_listener):
+    def _listener_key(self, listener_name):
+        return self.keyspace.listener_key(listener_name)
+
+    def _listener_keys(self, tcp_listener):
         """
-        Creates or updates tcp listener for yoda proxy.
+        Gets the desired keys for a given tcp listener.
+
         :param tcp_listener:
         :type tcp_listener: yoda.model.TcpListener
-        :return: None
+        :return: Ordered dictionary of key to value.
+        :rtype: OrderedDict
         """
-        listener_key = '/global/listeners/tcp/%s' % tcp_listener.name
-        self.etcd_cl.set('%s/bind' % listener_key, tcp_listener.bind)
+        keyspace = self.keyspace
+        name = tcp_listener.name
+        keys = OrderedDict()
+        keys[keyspace.listener_key(name, FIELD_BIND)] = tcp_listener.bind
         if tcp_listener.upstream:
-            self.etcd_cl.set('%s/upstream' % listener_key,
-                             tcp_listener.upstream)
+            keys[keyspace.listener_key(name, FIELD_UPSTREAM)] = \
+                tcp_listener.upstream
+        for acl in tcp_listener.allowed_acls:
+            keys[keyspace.listener_acl_key(name, ACL_ALLOWED, acl)] = acl
+        for acl in tcp_listener.denied_acls:
+            keys[keyspace.listener_acl_key(name, ACL_DENIED, acl)] = acl
+        return keys
+
+    @_operation
+    def update_tcp_listener(self, tcp_listener):
+        """
+        Creates or updates tcp listener for yoda proxy. Only the changed keys
+        are written and ACLs (or upstream) no longer used by the listener are
+        removed.
+        :param tcp_listener:
+        :type tcp_listener: yoda.model.TcpListener
+        :return: Dictionary with number of keys set and deleted.
+        :rtype: dict
+        """
+        existing = self._read_leaves(self._listener_key(tcp_listener.name),
+                                     consistency=LINEARIZABLE)
+        return self._apply_diff(existing, self._listener_keys(tcp_listener))
 
-        def next_acl(acls):
-            for acl in acls:
-                yield acl
+    @_operation
+    def sync_tcp_listeners(self, tcp_listeners, prune=False,
+                           max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Creates or updates multiple tcp listeners. Listeners subtree is read
+        once and only the differences are written.
 
-        for acl in next_acl(tcp_listener.allowed_acls):
-            self.etcd_cl.set('%s/acls/allowed/%s' % (listener_key, acl),
-                             acl)
+        :param tcp_listeners: List of tcp listeners
+        :type tcp_listeners: list of yoda.model.TcpListener
+        :keyword prune: If True, existing listeners not in tcp_listeners are
+            removed. (Default: False)
+        :type prune: bool
+        :keyword max_concurrency: Maximum number of listeners synced in
+            parallel. (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Tuple of results (dictionary of listener name to number of
+            keys set and deleted) and failures (dictionary of listener name to
+            exception).
+        :rtype: tuple
+        """
+        parse = self.keyspace.parse
+        existing = dict()
+        for key, value in self._read_leaves(
+                self.keyspace.listeners_key,
+                consistency=LINEARIZABLE).items():
+            existing.setdefault(parse(key).name, dict())[key] = value
 
-        for acl in next_acl(tcp_listener.denied_acls):
-            self.etcd_cl.set('%s/acls/denied/%s' % (listener_key, acl),
-                             acl)
+        listeners = OrderedDict((tcp_listener.name, tcp_listener)
+                                for tcp_listener in tcp_listeners)
+        stale = [name for name in sorted(existing) if name not in listeners]
 
+        def sync(name):
+            if name not in listeners:
+                self.remove_tcp_listener(name)
+                return {'set': 0, 'deleted': 1}
+            return self._apply_diff(existing.get(name, dict()),
+                                    self._listener_keys(listeners[name]))
+
+        names = list(listeners) + (stale if prune else [])
+        return split_failures(names, parallel_map(
+            self._in_context(sync), names, max_workers=max_concurrency,
+            return_exceptions=True))
+
+    @_operation
     def remove_tcp_listener(self, listener_name):
         """
         Deletes listener with listener_name if it exists. Has no effect if
@@ -261,16 +1372,243 @@ class Client:
         :type listener_name: str
         :return: None
         """
-        listener_key = '{etcd_base}/global/listeners/tcp/{listener}' \
-            .format(etcd_base=self.etcd_base, node=listener_name)
-        self._etcd_safe_delete(listener_key)
+        self._etcd_safe_delete(self._listener_key(listener_name),
+                               recursive=True)
+
+    @_operation
+    def entities(self):
+        """
+        Lists the top level entities of the yoda tree (upstreams, hosts, tcp
+        listeners and proxy nodes) using a non recursive (linearizable) read
+        per container.
+
+        :return: List of tuple (name, etcd key)
+        :rtype: list
+        """
+        keyspace = self.keyspace
+        entities = []
+        for container in (keyspace.upstreams_key, keyspace.hosts_key,
+                          keyspace.listeners_key, keyspace.proxy_nodes_key):
+            try:
+                result = self._etcd_op('read', container,
+                                       consistency=LINEARIZABLE)
+            except _key_not_found_errors():
+                continue
+            entities.extend(
+                (os.path.basename(node.key), node.key)
+                for node in result.leaves if node.key != container)
+        return entities
+
+    @_operation
+    def move_subtrees(self, keys, target, max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Moves entities (e.g. upstreams or hosts as listed by
+        :meth:`entities`) to the yoda tree of another client. The subtree of
+        every entity is read once, copied to the same relative key under the
+        target's etcd base (with the remaining ttls) and only then deleted.
+        Keys that already exist on the target are left untouched, as they
+        were written after the target took over the entity. Entities are
+        moved in parallel, within a single change set on each client.
+
+        :param keys: Etcd keys for the entities
+        :type keys: list
+        :param target: Client for the destination tree
+        :type target: Client
+        :keyword max_concurrency: Maximum number of entities moved in
+            parallel. (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Tuple of results (dictionary of key to number of leaf keys
+            copied) and failures (dictionary of key to exception).
+        :rtype: tuple
+        """
+        import etcd
+        prefix_len = len(self.keyspace.prefix)
+        target_prefix = target.keyspace.prefix
+
+        def move(key):
+            try:
+                result = self._etcd_op('read', key, recursive=True,
+                                       consistency=LINEARIZABLE)
+            except _key_not_found_errors():
+                return 0
+            nodes = list(result.get_subtree())
+            leaves = [node for node in nodes if not node.dir]
+            copied = 0
+            for leaf in leaves:
+                try:
+                    target._etcd_op('write',
+                                    target_prefix + leaf.key[prefix_len:],
+                                    leaf.value, ttl=leaf.ttl, prevExist=False)
+                    copied += 1
+                except etcd.EtcdAlreadyExist:
+                    pass
+            for node in nodes:
+                if not node.dir or not node.ttl:
+                    continue
+                # Directory exists (and only its ttl is updated) if a leaf
+                # was written under it
+                kwargs = {'prevExist': True} if any(
+                    leaf.key.startswith(node.key + '/')
+                    for leaf in leaves) else {}
+                target._etcd_op('write', target_prefix + node.key[prefix_len:],
+                                None, ttl=node.ttl, dir=True, **kwargs)
+            for written_key in list(self._written):
+                if written_key == key or written_key.startswith(key + '/'):
+                    self._written.pop(written_key, None)
+            self._etcd_safe_delete(key, recursive=True)
+            return copied
+
+        keys = list(keys)
+        with self.change_set('move to %s' % target.etcd_base), \
+                target.change_set('move from %s' % self.etcd_base):
+            return split_failures(keys, parallel_map(
+                self._in_context(target._in_context(move)), keys,
+                max_workers=max_concurrency, return_exceptions=True))
+
+    def _read_leaves(self, key, **kwargs):
+        """
+        Reads all leaf values under given key using a single recursive read.
+
+        :param key: Etcd key
+        :type key: str
+        :return: Dictionary of leaf key to value. Empty if key does not exist.
+        :rtype: dict
+        """
+        try:
+            result = self._etcd_op('read', key, recursive=True, **kwargs)
+        except _key_not_found_errors():
+            return dict()
+        return dict((leaf.key, leaf.value) for leaf in result.leaves
+                    if not leaf.dir)
+
+    def _apply_diff(self, existing, desired, prune_dirs=()):
+        """
+        Writes only the differences between existing and desired keys.
+        Existing keys that are not desired get deleted. Keys under
+        prune_dirs are deleted using a single recursive delete per directory.
+        Existing dictionary is updated to reflect the applied changes.
+
+        :param existing: Dictionary of existing key to value
+        :type existing: dict
+        :param desired: Ordered dictionary of desired key to value.
+        :type desired: OrderedDict
+        :keyword prune_dirs: Directory keys to be removed recursively.
+        :type prune_dirs: list
+        :return: Dictionary with number of keys set and deleted.
+        :rtype: dict
+        """
+        summary = {'set': 0, 'deleted': 0}
+        for key, value in desired.items():
+            if existing.get(key) != value:
+                self._etcd_op('set', key, value)
+                existing[key] = value
+                summary['set'] += 1
+
+        for prune_dir in prune_dirs:
+            self._etcd_safe_delete(prune_dir, recursive=True)
+            summary['deleted'] += 1
+            for key in [key for key in existing
+                        if key.startswith(prune_dir + '/')]:
+                del existing[key]
+
+        for key in [key for key in existing if key not in desired]:
+            self._etcd_safe_delete(key)
+            del existing[key]
+            summary['deleted'] += 1
+        return summary
+
+    def _host_keys(self, host):
+        """
+        Gets the desired keys for a given host.
+
+        :param host:
+        :type host: yoda.model.Host
+        :return: Ordered dictionary of key to value.
+        :rtype: OrderedDict
+        """
+        keyspace = self.keyspace
+        hostname = host.hostname
+        keys = OrderedDict()
+        for location in host.locations:
+            name = location.location_name
+            keys[keyspace.location_key(hostname, name, FIELD_PATH)] = \
+                location.path
+            for acl in location.allowed_acls:
+                keys[keyspace.location_acl_key(
+                    hostname, name, ACL_ALLOWED, acl)] = acl
+            for acl in location.denied_acls:
+                keys[keyspace.location_acl_key(
+                    hostname, name, ACL_DENIED, acl)] = acl
+            keys[keyspace.location_key(hostname, name, FIELD_UPSTREAM)] = \
+                location.upstream
+            keys[keyspace.location_key(hostname, name, FIELD_FORCE_SSL)] = \
+                'true' if location.force_ssl else 'false'
+        for alias in host.aliases or []:
+            keys[keyspace.alias_key(host.hostname, alias)] = alias
+        return keys
+
+    def _wire_host(self, host, existing):
+        desired = self._host_keys(host)
+        keyspace = self.keyspace
+        mapped_locations = set(location.location_name
+                               for location in host.locations)
+        prune_dirs = set()
+        for key in existing:
+            info = keyspace.parse(key)
+            if info and info.kind == KIND_LOCATION and info.child and \
+                    info.child not in mapped_locations:
+                prune_dirs.add(keyspace.location_key(info.name, info.child))
+        return self._apply_diff(existing, desired, sorted(prune_dirs))
+
+    @_operation
+    def wire_proxies(self, hosts, max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Wires the proxy for multiple hosts. The hosts subtree is read once,
+        and only the differences (including stale locations, acls and
+        aliases) are written using a pool of workers. Hosts with the same
+        hostname are applied in the given order.
+
+        :param hosts: List of hosts to be wired
+        :type hosts: list of yoda.model.Host
+        :keyword max_concurrency: Maximum number of hosts wired in parallel.
+            (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Tuple of results (dictionary of hostname to number of keys
+            set and deleted) and failures (dictionary of hostname to
+            exception). e.g.:
+            ({'host1': {'set': 5, 'deleted': 1}}, {'host2': EtcdException()})
+        :rtype: tuple
+        """
+        parse = self.keyspace.parse
+        existing = dict()
+        for key, value in self._read_leaves(self.keyspace.hosts_key,
+                                            consistency=LINEARIZABLE).items():
+            existing.setdefault(parse(key).name, dict())[key] = value
+
+        hosts_by_name = OrderedDict()
+        for host in hosts:
+            hosts_by_name.setdefault(host.hostname, []).append(host)
+
+        def wire(hostname):
+            host_existing = existing.get(hostname, dict())
+            summary = {'set': 0, 'deleted': 0}
+            for host in hosts_by_name[hostname]:
+                for field, count in self._wire_host(
+                        host, host_existing).items():
+                    summary[field] += count
+            return summary
+
+        hostnames = list(hosts_by_name)
+        return split_failures(hostnames, parallel_map(
+            self._in_context(wire), hostnames, max_workers=max_concurrency,
+            return_exceptions=True))
 
     def _setup_aliases(self, hostname, aliases):
-        aliases_key = '{etcd_base}/hosts/{hostname}/aliases'.format(
-            etcd_base=self.etcd_base, hostname=hostname)
         for alias in aliases or []:
-            self.etcd_cl.set('{0}/{1}'.format(aliases_key, alias), alias)
+            self._etcd_op('set', self.keyspace.alias_key(hostname, alias),
+                          alias)
 
+    @_operation
     def wire_proxy(self, host):
         """
         Wires the proxy for all locations of a given host.
@@ -280,36 +1618,316 @@ class Client:
         :return:
         """
         mapped_locations = []
-        locations_key = '{etcd_base}/hosts/{hostname}/locations'.format(
-            etcd_base=self.etcd_base, hostname=host.hostname
-        )
+        keyspace = self.keyspace
+        hostname = host.hostname
         for location in host.locations:
-            location_key = '%s/%s' % (locations_key, location.location_name)
-            self.etcd_cl.set('%s/path' % (location_key), location.path)
+            name = location.location_name
+            self._etcd_op('set', keyspace.location_key(hostname, name,
+                                                       FIELD_PATH),
+                          location.path)
             for acl in location.allowed_acls:
-                self.etcd_cl.set('%s/acls/allowed/%s' % (location_key, acl),
-                                 acl)
+                self._etcd_op('set', keyspace.location_acl_key(
+                    hostname, name, ACL_ALLOWED, acl), acl)
             for acl in location.denied_acls:
-                self.etcd_cl.set('%s/acls/denied/%s' % (location_key, acl),
-                                 acl)
-            self.etcd_cl.set('%s/upstream' % location_key, location.upstream)
+                self._etcd_op('set', keyspace.location_acl_key(
+                    hostname, name, ACL_DENIED, acl), acl)
+            self._etcd_op('set', keyspace.location_key(hostname, name,
+                                                       FIELD_UPSTREAM),
+                          location.upstream)
             force_ssl = 'true' if location.force_ssl else 'false'
-            self.etcd_cl.set('%s/force-ssl' % location_key, force_ssl)
-            mapped_locations.append(location.location_name)
+            self._etcd_op('set', keyspace.location_key(hostname, name,
+                                                       FIELD_FORCE_SSL),
+                          force_ssl)
+            mapped_locations.append(name)
 
         # Now cleanup unmapped paths
-        for location in self.etcd_cl.read(
-                locations_key, consistent=True).children:
-            location_name = os.path.basename(location.key)
+        for location in self._etcd_op(
+                'read', keyspace.locations_key(host.hostname),
+                consistency=LINEARIZABLE).children:
+            location_name = keyspace.parse(location.key).child
             if location_name not in mapped_locations:
                 self._etcd_safe_delete(location.key, recursive=True)
         self._setup_aliases(host.hostname, host.aliases)
 
+    @_operation
     def unwire_proxy(self, hostname, upstreams=[]):
-        host_base = '{etcd_base}/hosts/{hostname}'.format(
-            etcd_base=self.etcd_base, hostname=hostname)
-        self._etcd_safe_delete(host_base, recursive=True)
+        self._etcd_safe_delete(self.keyspace.host_key(hostname),
+                               recursive=True)
         for upstream in upstreams:
-            upstream_base = '{etcd_base}/upstreams/{upstream}'.format(
-                etcd_base=self.etcd_base, upstream=upstream)
-            self._etcd_safe_delete(upstream_base, recursive=True)
+            self._etcd_safe_delete(self.keyspace.upstream_key(upstream),
+                                   recursive=True)
+
+    @_operation
+    def decommission(self, app_or_prefix, dry_run, exact=True,
+                     remove_upstreams=True,
+                     max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Removes an application from the proxy. Matching upstreams (see
+        :func:`matches_app`), the hosts and locations routing to them (with
+        aliases) and the tcp listeners routing to them are found using a
+        single (linearizable) read of the tree. Routes are deleted in
+        parallel first, followed by the upstreams, so that the proxy never
+        routes to a deleted upstream. An upstream is kept if a route to it
+        could not be deleted. A host is deleted as a whole only if all its
+        locations route to matching upstreams, otherwise only the matching
+        locations are deleted.
+
+        The mode must always be given explicitly. With dry_run=True nothing
+        is deleted and the returned result only lists the planned deletes
+        (and is never successful), so that the plan can be reviewed before
+        decommissioning with dry_run=False. e.g.:
+
+            plan = client.decommission('app', dry_run=True)
+            ...
+            result = client.decommission('app', dry_run=False)
+
+        :param app_or_prefix: Application name or upstream prefix
+        :type app_or_prefix: str
+        :param dry_run: If True, keys to be deleted are found but not
+            deleted.
+        :type dry_run: bool
+        :keyword exact: Whether upstreams are matched exactly (see
+            :func:`matches_app`). (Default: True)
+        :type exact: bool
+        :keyword remove_upstreams: If False, only the routes are deleted.
+            Used when routes and upstreams are stored on different shards
+            (see :meth:`yoda.sharding.ShardedClient.decommission`).
+            (Default: True)
+        :type remove_upstreams: bool
+        :keyword max_concurrency: Maximum number of parallel deletes.
+            (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Result of the decommission
+        :rtype: DecommissionResult
+        """
+        tree, _ = self.read_tree(consistency=LINEARIZABLE)
+        keyspace = self.keyspace
+        upstreams = sorted(
+            upstream for upstream in tree.get('upstreams') or {}
+            if matches_app(upstream, app_or_prefix, exact=exact))
+
+        # Route key to the set of matching upstreams it routes to
+        routes = OrderedDict()
+        for hostname, record in sorted((tree.get('hosts') or {}).items()):
+            locations = record.get('locations') or {}
+            matching = dict(
+                (name, location.get(FIELD_UPSTREAM))
+                for name, location in locations.items()
+                if matches_app(location.get(FIELD_UPSTREAM) or '',
+                               app_or_prefix, exact=exact))
+            if not matching:
+                continue
+            if len(matching) == len(locations):
+                routes[keyspace.host_key(hostname)] = set(matching.values())
+            else:
+                for name, upstream in sorted(matching.items()):
+                    routes[keyspace.location_key(hostname, name)] = \
+                        set([upstream])
+        listeners = ((tree.get('global') or {}).get('listeners') or {}) \
+            .get('tcp') or {}
+        for name, listener in sorted(listeners.items()):
+            upstream = listener.get(FIELD_UPSTREAM)
+            if upstream and matches_app(upstream, app_or_prefix,
+                                        exact=exact):
+                routes[keyspace.listener_key(name)] = set([upstream])
+
+        removed_upstreams = upstreams if remove_upstreams else []
+        planned = list(routes) + [keyspace.upstream_key(upstream)
+                                  for upstream in removed_upstreams]
+        if dry_run:
+            return DecommissionResult(upstreams, planned=planned,
+                                      dry_run=True)
+
+        def delete(key):
+            self._etcd_safe_delete(key, recursive=True)
+
+        deleted, failures = [], dict()
+        with self.change_set('decommission %s' % app_or_prefix):
+            route_keys = list(routes)
+            removed, route_failures = split_failures(
+                route_keys, parallel_map(
+                    self._in_context(delete), route_keys,
+                    max_workers=max_concurrency, return_exceptions=True))
+            deleted.extend(key for key in route_keys if key in removed)
+            failures.update(route_failures)
+
+            still_routed = set()
+            for key in route_failures:
+                still_routed.update(routes[key])
+            upstream_keys = [keyspace.upstream_key(upstream)
+                             for upstream in removed_upstreams
+                             if upstream not in still_routed]
+            removed, upstream_failures = split_failures(
+                upstream_keys, parallel_map(
+                    self._in_context(delete), upstream_keys,
+                    max_workers=max_concurrency, return_exceptions=True))
+            deleted.extend(key for key in upstream_keys if key in removed)
+            failures.update(upstream_failures)
+
+        return DecommissionResult(
+            upstreams, planned=planned, deleted=deleted, failures=failures,
+            skipped=[keyspace.upstream_key(upstream)
+                     for upstream in removed_upstreams
+                     if upstream in still_routed],
+            still_routed=sorted(still_routed))
+
+    @_traced
+    def wait_for_upstream(self, upstream, min_nodes=1, ready=None,
+                          timeout=DEFAULT_SWITCH_TIMEOUT,
+                          poll_interval=DEFAULT_SWITCH_POLL_INTERVAL):
+        """
+        Waits until the upstream has at least min_nodes ready nodes.
+
+        :param upstream: Upstream to be checked
+        :type upstream: str
+        :keyword min_nodes: Minimum number of ready nodes. (Default: 1)
+        :type min_nodes: int
+        :keyword ready: Optional predicate invoked with node name and node
+            info (dictionary with endpoint and meta as returned by
+            :meth:`get_nodes_with_meta`). If None, all discovered nodes are
+            considered ready.
+        :keyword timeout: Maximum time to wait (in seconds).
+            (Default: DEFAULT_SWITCH_TIMEOUT)
+        :type timeout: float
+        :keyword poll_interval: Interval between checks (in seconds).
+            (Default: DEFAULT_SWITCH_POLL_INTERVAL)
+        :type poll_interval: float
+        :return: Dictionary of ready nodes
+        :rtype: dict
+        :raises UpstreamNotReady: If upstream does not have enough ready
+            nodes within the timeout.
+        """
+        deadline = time.time() + timeout
+        while True:
+            if ready:
+                nodes = dict(
+                    (node, info) for node, info in
+                    self.get_nodes_with_meta(
+                        upstream, consistency=LINEARIZABLE).items()
+                    if 'endpoint' in info and ready(node, info))
+            else:
+                nodes = self.get_nodes(upstream,
+                                       consistency=LINEARIZABLE) or {}
+            if len(nodes) >= min_nodes:
+                return nodes
+            if time.time() + poll_interval > deadline:
+                raise UpstreamNotReady(upstream, len(nodes), min_nodes)
+            self._sleep(poll_interval)
+
+    def _switch_keys(self, keys, from_upstream, to_upstream,
+                     max_concurrency=None):
+        """
+        Switches location upstream keys using compare and swap in parallel.
+
+        :return: Tuple of list of switched keys and dictionary of key to
+            exception for failed keys.
+        :rtype: tuple
+        """
+        keys = list(keys)
+        switched, failures = split_failures(keys, parallel_map(
+            self._in_context(
+                lambda key: self._etcd_op('test_and_set', key, to_upstream,
+                                          from_upstream)),
+            keys, max_workers=max_concurrency or len(keys),
+            return_exceptions=True))
+        return [key for key in keys if key in switched], failures
+
+    @_traced
+    def switch_upstream(self, from_upstream, to_upstream, hostnames=None,
+                        min_nodes=1, ready=None,
+                        timeout=DEFAULT_SWITCH_TIMEOUT,
+                        poll_interval=DEFAULT_SWITCH_POLL_INTERVAL,
+                        rollback_ttl=DEFAULT_ROLLBACK_TTL,
+                        revert_on_failure=True, max_concurrency=None):
+        """
+        Switches all locations routing to from_upstream over to to_upstream
+        (blue green switch).
+
+        The switch waits until to_upstream has at least min_nodes ready
+        nodes. Location upstream keys are then flipped using compare and swap
+        in parallel, to keep the window with mixed routing as small as
+        possible (etcd v2 does not support multi key transactions). All
+        flips are grouped in a single change set, so that consumers watching
+        :attr:`generation_key` reload once. The old upstream is kept alive
+        for rollback_ttl seconds so that the switch can be rolled back.
+
+        Usage:
+
+            result = client.switch_upstream(
+                as_upstream('app', 8080, 'v1'),
+                as_upstream('app', 8080, 'v2'), min_nodes=2)
+            ...
+            result.rollback()
+
+        :param from_upstream: Upstream currently in use (blue)
+        :type from_upstream: str
+        :param to_upstream: Upstream to be switched to (green)
+        :type to_upstream: str
+        :keyword hostnames: Optional list of hostnames to be switched. If
+            None, all hosts routing to from_upstream are switched.
+        :type hostnames: list
+        :keyword min_nodes: Minimum number of ready nodes for to_upstream.
+            (Default: 1)
+        :type min_nodes: int
+        :keyword ready: Optional readiness predicate for a node. See
+            :meth:`wait_for_upstream`.
+        :keyword timeout: Maximum time to wait for ready nodes (in seconds).
+            (Default: DEFAULT_SWITCH_TIMEOUT)
+        :type timeout: float
+        :keyword poll_interval: Interval between readiness checks (in
+            seconds). (Default: DEFAULT_SWITCH_POLL_INTERVAL)
+        :type poll_interval: float
+        :keyword rollback_ttl: Time (in seconds) for which from_upstream is
+            kept for rollback. If None, ttl for from_upstream is not changed.
+            (Default: DEFAULT_ROLLBACK_TTL)
+        :type rollback_ttl: int
+        :keyword revert_on_failure: If True, switched locations are reverted
+            when any location fails to switch. (Default: True)
+        :type revert_on_failure: bool
+        :keyword max_concurrency: Maximum number of locations switched in
+            parallel. (Default: None, i.e. all at once)
+        :type max_concurrency: int
+        :return: Result of the switch
+        :rtype: SwitchResult
+        :raises UpstreamNotReady: If to_upstream does not have enough ready
+            nodes within the timeout.
+        :raises NoMatchingLocations: If no location (for the hostnames)
+            routes to from_upstream. Nothing is switched.
+        """
+        self.wait_for_upstream(to_upstream, min_nodes=min_nodes, ready=ready,
+                               timeout=timeout, poll_interval=poll_interval)
+
+        parse = self.keyspace.parse
+        keys = []
+        for key, value in sorted(self._read_leaves(
+                self.keyspace.hosts_key, consistency=LINEARIZABLE).items()):
+            info = parse(key)
+            if info.kind == KIND_LOCATION and \
+                    info.field == FIELD_UPSTREAM and \
+                    value == from_upstream and \
+                    (hostnames is None or info.name in hostnames):
+                keys.append(key)
+        if not keys:
+            raise NoMatchingLocations(from_upstream, hostnames=hostnames)
+
+        with self.change_set('switch %s to %s' % (from_upstream,
+                                                  to_upstream)):
+            switched, failures = self._switch_keys(
+                keys, from_upstream, to_upstream, max_concurrency)
+            reverted = False
+            if failures and switched and revert_on_failure:
+                _, revert_failures = self._switch_keys(
+                    switched, to_upstream, from_upstream, max_concurrency)
+                switched = [key for key in switched
+                            if key in revert_failures]
+                reverted = True
+
+        if switched and rollback_ttl:
+            try:
+                self.renew_upstream(from_upstream, ttl=rollback_ttl)
+            except _key_not_found_errors():
+                # Old upstream is already gone. Nothing to keep for rollback.
+                pass
+        return SwitchResult(self, from_upstream, to_upstream,
+                            switched=switched, failures=failures,
+                            reverted=reverted)
@@ -0,0 +1,136 @@
+"""
+Read consistency levels for etcd reads.
+
+    - linearizable: Read goes through raft (`quorum=true`) and reflects all
+      writes completed before the read started.
+    - leader: Read is served by the current leader from its local state,
+      without a raft round trip. The leader is looked up (and cached for
+      LEADER_CACHE_TTL seconds) among the read clients of the yoda client.
+      If the leader can not be determined or is not one of the read
+      clients, the read is made as a linearizable read.
+    - follower: Read is served by any member from its local state. With
+      max_staleness, the etcd index returned by the read is checked against
+      the highest index seen by the client, and reads lagging by more than
+      max_staleness are repeated as linearizable reads.
+
+Follower reads can be spread across all etcd members (see `read_clients`
+for :class:`yoda.client.Client`), while diff-before-write paths use
+linearizable reads.
+"""
+import numbers
+import threading
+
+__author__ = 'sukrit'
+
+LEVEL_LINEARIZABLE = 'linearizable'
+LEVEL_LEADER = 'leader'
+LEVEL_FOLLOWER = 'follower'
+
+LEVELS = (LEVEL_LINEARIZABLE, LEVEL_LEADER, LEVEL_FOLLOWER)
+
+# Time (in seconds) for which the leader of the etcd cluster is cached
+LEADER_CACHE_TTL = 10
+
+# Leader reads are routed to the leader member, so they need no read option
+_READ_OPTIONS = {
+    LEVEL_LINEARIZABLE: {'quorum': True},
+    LEVEL_LEADER: {},
+    LEVEL_FOLLOWER: {},
+}
+
+
+class Consistency:
+    """
+    Consistency level for a read.
+    """
+
+    def __init__(self, level, max_staleness=None):
+        """
+        :param level: One of LEVELS
+        :type level: str
+        :keyword max_staleness: Maximum number of etcd indexes by which a
+            follower read may lag behind the highest index seen by the
+            client. If None, staleness is not checked. (Default: None)
+        :type max_staleness: int
+        :raises ValueError: If level is invalid or max_staleness is used
+            with a level other than follower.
+        """
+        if level not in LEVELS:
+            raise ValueError('Invalid consistency level: %s' % level)
+        if max_staleness is not None and level != LEVEL_FOLLOWER:
+            raise ValueError('max_staleness is only supported for %s reads'
+                             % LEVEL_FOLLOWER)
+        self.level = level
+        self.max_staleness = max_staleness
+
+    @property
+    def read_options(self):
+        """
+        :return: Options for :meth:`etcd.Client.read`
+        :rtype: dict
+        """
+        return dict(_READ_OPTIONS[self.level])
+
+    def is_stale(self, index, seen_index):
+        """
+        :param index: Etcd index returned by the read
+        :type index: int
+        :param seen_index: Highest etcd index seen before the read
+        :type seen_index: int
+        :return: True if the read lags by more than max_staleness.
+        :rtype: bool
+        """
+        if self.max_staleness is None or \
+                not isinstance(index, numbers.Integral) or \
+                not isinstance(seen_index, numbers.Integral):
+            return False
+        return seen_index - index > self.max_staleness
+
+    def __eq__(self, other):
+        return isinstance(other, Consistency) and \
+            (self.level, self.max_staleness) == \
+            (other.level, other.max_staleness)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'Consistency(%r, max_staleness=%r)' % (self.level,
+                                                      self.max_staleness)
+
+
+LINEARIZABLE = Consistency(LEVEL_LINEARIZABLE)
+LEADER = Consistency(LEVEL_LEADER)
+FOLLOWER = Consistency(LEVEL_FOLLOWER)
+
+
+def as_consistency(value):
+    """
+    :param value: Consistency, level name or None
+    :return: Consistency (or None if value is None)
+    :rtype: Consistency
+    """
+    if value is None or isinstance(value, Consistency):
+        return value
+    return Consistency(value)
+
+
+class IndexTracker:
+    """
+    Tracks the highest etcd index seen in responses.
+    """
+
+    def __init__(self):
+        self.highest = None
+        self._lock = threading.Lock()
+
+    def observe(self, index):
+        """
+        :param index: Etcd index for a response. Ignored if not an integer.
+        :return: None
+        """
+        if not isinstance(index, numbers.Integral):
+            return
+        with self._lock:
+            if self.highest is None or index > self.highest:
+                self.highest = index
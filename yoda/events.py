@@ -0,0 +1,296 @@
+"""
+Semantic change stream for the yoda tree.
+
+Raw etcd watch events (e.g. on `.../endpoints-meta/<node>/<field>`) are
+translated into typed domain events, and bursts of events for the same
+entity within a small window are merged into a single event. When the watch
+has to start over from a snapshot of the tree (e.g. after the watched index
+was compacted), a :class:`TreeResynced` event carrying the snapshot replaces
+the pending events, so that consumers can rebuild their state.
+"""
+from collections import namedtuple, OrderedDict
+import threading
+import time
+from yoda.keyspace import HOST_KINDS, KIND_ALIAS, KIND_ENDPOINT, \
+    KIND_ENDPOINT_META, KIND_HOST, KIND_LISTENER, KIND_LOCATION, \
+    KIND_UPSTREAM, UPSTREAM_KINDS, keyspace_for
+from yoda.routing import DELETE_ACTIONS
+from yoda.watch import ResumableWatcher
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+__author__ = 'sukrit'
+
+DEFAULT_WINDOW = 0.2
+
+NodeDiscovered = namedtuple('NodeDiscovered', 'upstream, node, endpoint')
+NodeRemoved = namedtuple('NodeRemoved', 'upstream, node')
+NodeMetaChanged = namedtuple('NodeMetaChanged', 'upstream, node, fields')
+UpstreamRegistered = namedtuple('UpstreamRegistered', 'upstream')
+UpstreamExpired = namedtuple('UpstreamExpired', 'upstream')
+LocationChanged = namedtuple('LocationChanged', 'hostname, location_name')
+HostAliasesChanged = namedtuple('HostAliasesChanged', 'hostname')
+HostUnwired = namedtuple('HostUnwired', 'hostname')
+TcpListenerChanged = namedtuple('TcpListenerChanged', 'name')
+TreeResynced = namedtuple('TreeResynced', 'tree, etcd_index')
+
+
+def to_domain_event(event, etcd_base='/yoda'):
+    """
+    Translates raw watch event into a typed domain event.
+
+    :param event: Raw watch event
+    :type event: yoda.watch.WatchEvent
+    :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+    :type etcd_base: str
+    :return: Tuple of (entity key, domain event) or None if the event is not
+        relevant.
+    :rtype: tuple
+    """
+    info = keyspace_for(etcd_base).parse(event.key)
+    if info is None or info.name is None:
+        return None
+    deleted = event.action in DELETE_ACTIONS
+    kind = info.kind
+
+    if kind in UPSTREAM_KINDS:
+        upstream, node = info.name, info.child
+        if kind == KIND_ENDPOINT and node is not None and info.field is None:
+            if deleted:
+                return ('node', upstream, node), NodeRemoved(upstream, node)
+            return ('node', upstream, node), \
+                NodeDiscovered(upstream, node, event.value)
+        if kind == KIND_ENDPOINT_META and node is not None:
+            fields = [] if info.field is None else [info.field.split('/')[0]]
+            return ('node-meta', upstream, node), NodeMetaChanged(
+                upstream, node, frozenset(fields))
+        if kind == KIND_UPSTREAM and info.field is None and deleted:
+            return ('upstream', upstream), UpstreamExpired(upstream)
+        if kind == KIND_UPSTREAM and not deleted:
+            return ('upstream', upstream), UpstreamRegistered(upstream)
+        return None
+
+    if kind in HOST_KINDS:
+        hostname = info.name
+        if (kind == KIND_HOST and info.field is None) or \
+                (kind == KIND_LOCATION and info.child is None):
+            if deleted:
+                return ('host', hostname), HostUnwired(hostname)
+            return None
+        if kind == KIND_LOCATION:
+            return ('location', hostname, info.child), \
+                LocationChanged(hostname, info.child)
+        if kind == KIND_ALIAS:
+            return ('aliases', hostname), HostAliasesChanged(hostname)
+        return None
+
+    if kind == KIND_LISTENER:
+        return ('listener', info.name), TcpListenerChanged(info.name)
+    return None
+
+
+class Coalescer:
+    """
+    Merges domain events for the same entity. The last event for an entity
+    wins (fields for :class:`NodeMetaChanged` are merged). Events are
+    emitted in the order entities were first seen.
+    """
+
+    def __init__(self, etcd_base='/yoda'):
+        self.etcd_base = etcd_base
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, event):
+        """
+        Adds raw watch event.
+
+        :param event: Raw watch event
+        :type event: yoda.watch.WatchEvent
+        :return: True if event was relevant, False otherwise.
+        :rtype: bool
+        """
+        translated = to_domain_event(event, self.etcd_base)
+        if not translated:
+            return False
+        entity, domain_event = translated
+        previous = self._pending.get(entity)
+        if isinstance(previous, NodeMetaChanged) and \
+                isinstance(domain_event, NodeMetaChanged):
+            domain_event = domain_event._replace(
+                fields=previous.fields | domain_event.fields)
+        self._pending[entity] = domain_event
+        # Host removal supersedes pending location changes for the host
+        if isinstance(domain_event, HostUnwired):
+            for key in list(self._pending):
+                if key[0] in ('location', 'aliases') and \
+                        key[1] == domain_event.hostname:
+                    del self._pending[key]
+        return True
+
+    def resync(self, event):
+        """
+        Replaces pending events with a resync event, as the snapshot
+        supersedes them.
+
+        :param event: Resync event
+        :type event: TreeResynced
+        :return: None
+        """
+        self._pending.clear()
+        self._pending[('tree',)] = event
+
+    def flush(self):
+        """
+        Gets merged events and clears pending events.
+
+        :return: List of domain events
+        :rtype: list
+        """
+        events = list(self._pending.values())
+        self._pending.clear()
+        return events
+
+
+class ChangeStream:
+    """
+    Stream of merged domain events built from raw watch events.
+
+    Raw events are pulled in a background thread. Once an event arrives,
+    further events are collected for `window` seconds and emitted as one
+    batch with a single event per changed entity. A batch is committed (e.g.
+    checkpointed) only after the consumer has processed it, i.e. when the
+    next batch is requested.
+    """
+
+    def __init__(self, source, etcd_base='/yoda', window=DEFAULT_WINDOW,
+                 commit=None):
+        """
+        :param source: Iterable of raw watch events
+            (:class:`yoda.watch.WatchEvent`)
+        :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+        :type etcd_base: str
+        :keyword window: Window (in seconds) for merging bursts of events.
+            (Default: DEFAULT_WINDOW)
+        :type window: float
+        :keyword commit: Optional callable invoked with the highest etcd
+            index of a batch once the batch has been processed.
+            (Default: None)
+        """
+        self.source = source
+        self.etcd_base = etcd_base
+        self.window = window
+        self.commit = commit
+        self._queue = queue.Queue()
+        self._done = object()
+        self._thread = None
+
+    @classmethod
+    def from_client(cls, client, checkpoint, window=DEFAULT_WINDOW,
+                    stop=None):
+        """
+        Creates change stream using resumable watch for the client. Batches
+        are checkpointed once processed, and a :class:`TreeResynced` event
+        is emitted whenever the watch starts from a snapshot (i.e. without a
+        checkpoint or after the checkpointed index was compacted).
+
+        :param client: Yoda client
+        :type client: yoda.client.Client
+        :param checkpoint: Checkpoint store for the watch
+        :keyword window: Window (in seconds) for merging bursts of events.
+        :type window: float
+        :keyword stop: Optional event used to stop the watch.
+        :rtype: ChangeStream
+        """
+        stream = cls(None, etcd_base=client.etcd_base, window=window)
+        watcher = ResumableWatcher(client, checkpoint,
+                                   on_snapshot=stream.resync,
+                                   auto_commit=False)
+        stream.source = watcher.events(stop=stop)
+        stream.commit = watcher.commit
+        return stream
+
+    def resync(self, tree, etcd_index):
+        """
+        Emits a :class:`TreeResynced` event (in order with the raw events).
+        Used as `on_snapshot` callback for
+        :class:`yoda.watch.ResumableWatcher`.
+
+        :param tree: Yoda tree
+        :type tree: dict
+        :param etcd_index: Etcd index for the snapshot
+        :type etcd_index: int
+        :return: None
+        """
+        self._queue.put(TreeResynced(tree, etcd_index))
+
+    def _pull(self):
+        try:
+            for event in self.source:
+                self._queue.put(event)
+        finally:
+            self._queue.put(self._done)
+
+    @staticmethod
+    def _add(coalescer, event, index):
+        """
+        Adds raw event (or resync event) to the batch.
+
+        :return: Highest etcd index for the batch
+        """
+        if isinstance(event, TreeResynced):
+            coalescer.resync(event)
+            event_index = event.etcd_index
+        else:
+            coalescer.add(event)
+            event_index = event.modified_index
+        if index is None or (event_index is not None and event_index > index):
+            return event_index
+        return index
+
+    def batches(self):
+        """
+        Generator of merged batches of domain events.
+
+        :return: Generator of list of domain events
+        """
+        if not self._thread:
+            self._thread = threading.Thread(target=self._pull)
+            self._thread.daemon = True
+            self._thread.start()
+        coalescer = Coalescer(self.etcd_base)
+        done = False
+        while not done:
+            event = self._queue.get()
+            if event is self._done:
+                break
+            index = self._add(coalescer, event, None)
+            deadline = time.time() + self.window
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is self._done:
+                    done = True
+                    break
+                index = self._add(coalescer, event, index)
+            events = coalescer.flush()
+            if events:
+                yield events
+            if self.commit is not None and index is not None:
+                # Batch has been processed by the consumer
+                self.commit(index)
+
+    def __iter__(self):
+        for events in self.batches():
+            for event in events:
+                yield event
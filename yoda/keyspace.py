@@ -0,0 +1,237 @@
+"""
+Layout of the yoda tree in etcd.
+
+All keys are built and parsed using :class:`KeySpace`, which precomputes
+the prefixes for a given etcd base:
+
+    <base>/generation
+    <base>/upstreams/<upstream>/(mode|health/...)
+    <base>/upstreams/<upstream>/endpoints/<node>
+    <base>/upstreams/<upstream>/endpoints-meta/<node>/<field>
+    <base>/hosts/<hostname>/locations/<location>/(path|upstream|force-ssl)
+    <base>/hosts/<hostname>/locations/<location>/acls/(allowed|denied)/<acl>
+    <base>/hosts/<hostname>/aliases/<alias>
+    <base>/global/listeners/tcp/<listener>/(bind|upstream)
+    <base>/global/listeners/tcp/<listener>/acls/(allowed|denied)/<acl>
+    <base>/proxy-nodes/<node>
+"""
+from collections import namedtuple
+
+__author__ = 'sukrit'
+
+KIND_GENERATION = 'generation'
+KIND_UPSTREAM = 'upstream'
+KIND_ENDPOINT = 'endpoint'
+KIND_ENDPOINT_META = 'endpoint-meta'
+KIND_HOST = 'host'
+KIND_LOCATION = 'location'
+KIND_ALIAS = 'alias'
+KIND_LISTENER = 'listener'
+KIND_PROXY_NODE = 'proxy-node'
+
+UPSTREAM_KINDS = frozenset([KIND_UPSTREAM, KIND_ENDPOINT, KIND_ENDPOINT_META])
+HOST_KINDS = frozenset([KIND_HOST, KIND_LOCATION, KIND_ALIAS])
+
+# Fields of locations and tcp listeners
+FIELD_PATH = 'path'
+FIELD_UPSTREAM = 'upstream'
+FIELD_FORCE_SSL = 'force-ssl'
+FIELD_BIND = 'bind'
+
+ACL_ALLOWED = 'allowed'
+ACL_DENIED = 'denied'
+
+# Parsed etcd key:
+#   kind: One of KIND_* constants
+#   name: Upstream, hostname, listener or proxy node name. None for the
+#       container directory (e.g. <base>/upstreams).
+#   child: Node, location or alias name. None for the container directory
+#       (e.g. <base>/upstreams/<upstream>/endpoints) and for kinds without
+#       children.
+#   field: Remaining path relative to the entity (e.g. 'mode', 'health/uri',
+#       'acls/allowed/public'). None if there is no remaining path.
+KeyInfo = namedtuple('KeyInfo', 'kind, name, child, field')
+
+
+def _new_key_info(*fields):
+    # Skips argument handling in KeyInfo.__new__ (parse is on the hot path
+    # for watch events and full tree reads)
+    return tuple.__new__(KeyInfo, fields)
+
+
+_UPSTREAM_CHILDREN = {
+    'endpoints': KIND_ENDPOINT,
+    'endpoints-meta': KIND_ENDPOINT_META,
+}
+
+_HOST_CHILDREN = {
+    'locations': KIND_LOCATION,
+    'aliases': KIND_ALIAS,
+}
+
+_LISTENERS_PATH = 'global/listeners/tcp'
+
+
+def acl_field(acl_type, acl):
+    """
+    :param acl_type: ACL_ALLOWED or ACL_DENIED
+    :type acl_type: str
+    :param acl: Name of the acl
+    :type acl: str
+    :return: Field (relative to location or listener) for the acl
+    :rtype: str
+    """
+    return 'acls/' + acl_type + '/' + acl
+
+
+class KeySpace:
+    """
+    Builds and parses keys for the yoda tree under a given etcd base.
+    """
+
+    def __init__(self, etcd_base='/yoda'):
+        """
+        :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+        :type etcd_base: str
+        """
+        self.base = etcd_base.rstrip('/')
+        self.prefix = self.base + '/'
+        self.generation_key = self.prefix + 'generation'
+        self.upstreams_key = self.prefix + 'upstreams'
+        self.hosts_key = self.prefix + 'hosts'
+        self.listeners_key = self.prefix + _LISTENERS_PATH
+        self.proxy_nodes_key = self.prefix + 'proxy-nodes'
+        self._upstreams_prefix = self.upstreams_key + '/'
+        self._hosts_prefix = self.hosts_key + '/'
+        self._listeners_prefix = self.listeners_key + '/'
+        self._proxy_nodes_prefix = self.proxy_nodes_key + '/'
+        self._prefix_len = len(self.prefix)
+
+    def upstream_key(self, upstream, field=None):
+        key = self._upstreams_prefix + upstream
+        return key if field is None else key + '/' + field
+
+    def endpoints_key(self, upstream):
+        return self._upstreams_prefix + upstream + '/endpoints'
+
+    def endpoint_key(self, upstream, node):
+        return self._upstreams_prefix + upstream + '/endpoints/' + node
+
+    def endpoints_meta_key(self, upstream, node=None, field=None):
+        key = self._upstreams_prefix + upstream + '/endpoints-meta'
+        if node is not None:
+            key += '/' + node
+            if field is not None:
+                key += '/' + field
+        return key
+
+    def host_key(self, hostname):
+        return self._hosts_prefix + hostname
+
+    def locations_key(self, hostname):
+        return self._hosts_prefix + hostname + '/locations'
+
+    def location_key(self, hostname, location_name, field=None):
+        key = self._hosts_prefix + hostname + '/locations/' + location_name
+        return key if field is None else key + '/' + field
+
+    def location_acl_key(self, hostname, location_name, acl_type, acl):
+        return self.location_key(hostname, location_name,
+                                 acl_field(acl_type, acl))
+
+    def aliases_key(self, hostname):
+        return self._hosts_prefix + hostname + '/aliases'
+
+    def alias_key(self, hostname, alias):
+        return self._hosts_prefix + hostname + '/aliases/' + alias
+
+    def listener_key(self, listener_name, field=None):
+        key = self._listeners_prefix + listener_name
+        return key if field is None else key + '/' + field
+
+    def listener_acl_key(self, listener_name, acl_type, acl):
+        return self.listener_key(listener_name, acl_field(acl_type, acl))
+
+    def proxy_node_key(self, node_name):
+        return self._proxy_nodes_prefix + node_name
+
+    def relative_parts(self, key):
+        """
+        :return: Parts of the key relative to the etcd base or None if key is
+            not under the etcd base.
+        :rtype: list
+        """
+        if not key.startswith(self.prefix):
+            return None
+        return key[self._prefix_len:].split('/')
+
+    def parse(self, key):
+        """
+        Parses etcd key using a single split.
+
+        :param key: Absolute etcd key
+        :type key: str
+        :return: Parsed key or None if key is not part of the yoda tree
+            layout.
+        :rtype: KeyInfo
+        """
+        if not key.startswith(self.prefix):
+            return None
+        parts = key[self._prefix_len:].split('/')
+        top = parts[0]
+        size = len(parts)
+
+        if top == 'upstreams' or top == 'hosts':
+            if size < 3:
+                return _new_key_info(
+                    KIND_UPSTREAM if top == 'upstreams' else KIND_HOST,
+                    parts[1] if size == 2 else None, None, None)
+            if top == 'upstreams':
+                kind = _UPSTREAM_CHILDREN.get(parts[2])
+                if kind is None:
+                    return _new_key_info(KIND_UPSTREAM, parts[1], None,
+                                         '/'.join(parts[2:]))
+            else:
+                kind = _HOST_CHILDREN.get(parts[2])
+                if kind is None:
+                    return _new_key_info(KIND_HOST, parts[1], None,
+                                         '/'.join(parts[2:]))
+            if size < 5:
+                return _new_key_info(kind, parts[1],
+                                     parts[3] if size == 4 else None, None)
+            return _new_key_info(
+                kind, parts[1], parts[3],
+                parts[4] if size == 5 else '/'.join(parts[4:]))
+
+        if top == 'global':
+            if size < 3 or parts[1] != 'listeners' or parts[2] != 'tcp':
+                return None
+            return _new_key_info(KIND_LISTENER,
+                                 parts[3] if size > 3 else None, None,
+                                 '/'.join(parts[4:]) if size > 4 else None)
+
+        if top == 'proxy-nodes':
+            return _new_key_info(
+                KIND_PROXY_NODE, parts[1] if size > 1 else None, None,
+                '/'.join(parts[2:]) if size > 2 else None)
+
+        if top == 'generation' and size == 1:
+            return _new_key_info(KIND_GENERATION, None, None, None)
+        return None
+
+
+_KEYSPACES = dict()
+
+
+def keyspace_for(etcd_base):
+    """
+    Gets (cached) key space for given etcd base.
+
+    :param etcd_base: Base key for yoda tree
+    :type etcd_base: str
+    :rtype: KeySpace
+    """
+    keyspace = _KEYSPACES.get(etcd_base)
+    if keyspace is None:
+        keyspace = _KEYSPACES[etcd_base] = KeySpace(etcd_base)
+    return keyspace
@@ -45,6 +45,18 @@ class Location:
     def __repr__(self):
         return 'Location(%s)' % str(self)
 
+    def freeze(self):
+        """
+        Gets immutable (hashable) copy of this location.
+
+        :rtype: FrozenLocation
+        """
+        return FrozenLocation(self.upstream, path=self.path,
+                              location_name=self.location_name,
+                              allowed_acls=self.allowed_acls,
+                              denied_acls=self.denied_acls,
+                              force_ssl=self.force_ssl)
+
     def __eq__(self, other):
         return self.upstream == other.upstream and \
             self.path == other.path and \
@@ -77,6 +89,14 @@ class Host:
     def __repr__(self):
         return 'Host(%s)' % str(self)
 
+    def freeze(self):
+        """
+        Gets immutable (hashable) copy of this host.
+
+        :rtype: FrozenHost
+        """
+        return FrozenHost(self.hostname, self.locations, aliases=self.aliases)
+
     def __eq__(self, other):
         return self.locations == other.locations and \
             self.hostname == other.hostname and \
@@ -121,9 +141,173 @@ class TcpListener:
     def __repr__(self):
         return 'TcpListener(%s)' % str(self)
 
+    def freeze(self):
+        """
+        Gets immutable (hashable) copy of this tcp listener.
+
+        :rtype: FrozenTcpListener
+        """
+        return FrozenTcpListener(self.name, self.bind, upstream=self.upstream,
+                                 allowed_acls=self.allowed_acls,
+                                 denied_acls=self.denied_acls)
+
     def __eq__(self, other):
         return self.name == other.name and \
             self.bind == other.bind and \
             self.upstream == other.upstream and \
             self.allowed_acls == other.allowed_acls and \
             self.denied_acls == other.denied_acls
+
+
+class _FrozenModel(object):
+    """
+    Base class for slotted, immutable models. Hash is computed once on
+    creation and equality compares the cached hash before comparing fields.
+    """
+    __slots__ = ('_hash',)
+    _fields = ()
+
+    def _init(self, *values):
+        for field, value in zip(self._fields, values):
+            object.__setattr__(self, field, value)
+        object.__setattr__(self, '_hash', hash(self._key()))
+
+    def _key(self):
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return self.__class__ is other.__class__ and \
+            self._hash == other._hash and \
+            self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, str(self))
+
+    def __reduce__(self):
+        return self.__class__.from_dict, (self.to_dict(),)
+
+    @staticmethod
+    def _to_value(value):
+        if isinstance(value, _FrozenModel):
+            return value.to_dict()
+        if isinstance(value, frozenset):
+            return sorted(value)
+        if isinstance(value, tuple):
+            return [_FrozenModel._to_value(item) for item in value]
+        return value
+
+    def to_dict(self):
+        """
+        Gets the fields as dictionary (compatible with the constructor).
+        Frozensets are returned as sorted lists and nested models as
+        dictionaries.
+
+        :rtype: dict
+        """
+        return dict((field, self._to_value(getattr(self, field)))
+                    for field in self._fields)
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+
+class FrozenLocation(_FrozenModel):
+    """
+    Immutable, hashable variant of :class:`Location`. ACLs are stored as
+    frozensets.
+    """
+    __slots__ = ('upstream', 'path', 'location_name', 'allowed_acls',
+                 'denied_acls', 'force_ssl')
+    _fields = __slots__
+
+    def __init__(self, upstream, path='/', location_name=None,
+                 allowed_acls=None, denied_acls=None, force_ssl=False):
+        """
+        Constructor (compatible with :class:`Location`)
+        """
+        self._init(upstream, path,
+                   INVALID_LOCATION_CHARS.sub('-', location_name or path),
+                   frozenset(allowed_acls or ['public']),
+                   frozenset(denied_acls or ['global-black-list']),
+                   bool(force_ssl))
+
+    def thaw(self):
+        """
+        Gets mutable copy of this location.
+
+        :rtype: Location
+        """
+        return Location(**self.to_dict())
+
+
+class FrozenHost(_FrozenModel):
+    """
+    Immutable, hashable variant of :class:`Host`. Locations are stored as a
+    tuple of :class:`FrozenLocation` and aliases as frozenset.
+    """
+    __slots__ = ('hostname', 'locations', 'aliases')
+    _fields = __slots__
+
+    def __init__(self, hostname, locations, aliases=None):
+        """
+        Constructor (compatible with :class:`Host`)
+        """
+        self._init(hostname, tuple(
+            location if isinstance(location, FrozenLocation) else
+            (location.freeze() if isinstance(location, Location) else
+             FrozenLocation(**location))
+            for location in locations or []),
+            frozenset(aliases or []))
+
+    def thaw(self):
+        """
+        Gets mutable copy of this host.
+
+        :rtype: Host
+        """
+        return Host(self.hostname,
+                    [location.thaw() for location in self.locations],
+                    aliases=sorted(self.aliases) or None)
+
+
+class FrozenTcpListener(_FrozenModel):
+    """
+    Immutable, hashable variant of :class:`TcpListener`. ACLs are stored as
+    frozensets.
+    """
+    __slots__ = ('name', 'bind', 'upstream', 'allowed_acls', 'denied_acls')
+    _fields = __slots__
+
+    def __init__(self, name, bind, upstream=None, allowed_acls=None,
+                 denied_acls=None):
+        """
+        Constructor (compatible with :class:`TcpListener`)
+        """
+        self._init(name, bind, upstream, frozenset(allowed_acls or []),
+                   frozenset(denied_acls or []))
+
+    def thaw(self):
+        """
+        Gets mutable copy of this tcp listener.
+
+        :rtype: TcpListener
+        """
+        return TcpListener(**self.to_dict())
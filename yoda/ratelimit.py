@@ -0,0 +1,154 @@
+"""
+Client side rate limiting for etcd writes.
+
+A cluster restart makes every container register at the same time. The
+:class:`TokenBucket` limiter smooths those writes out and lets removals and
+renewals go ahead of fresh registrations so that existing TTLs do not expire
+while the cluster is busy.
+"""
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__author__ = 'sukrit'
+
+# Lower value means higher priority.
+PRIORITY_REMOVE = 0
+PRIORITY_RENEW = 1
+PRIORITY_REGISTER = 2
+
+
+def jitter(value, fraction):
+    """
+    Randomizes given value by +/- fraction of the value.
+
+    :param value: Value to be randomized (e.g. interval in seconds)
+    :type value: float
+    :param fraction: Fraction of the value used for jitter (e.g.: 0.1 for
+        +/- 10%)
+    :type fraction: float
+    :return: Jittered value
+    :rtype: float
+    """
+    if not fraction:
+        return value
+    return value * (1 + random.uniform(-fraction, fraction))
+
+
+class TokenBucket:
+    """
+    Token bucket limiter with priorities.
+
+    Callers block in :meth:`acquire` until a token is available. A waiter is
+    only granted a token when no waiter with higher priority is pending.
+    When `lock_file` is given, the bucket state is kept in that file and
+    guarded with :func:`fcntl.flock` so that all processes on a host share
+    the same budget. Priorities are honoured within a process only.
+    """
+
+    def __init__(self, rate, burst=None, lock_file=None, clock=time.time):
+        """
+        :param rate: Number of tokens added per second
+        :type rate: float
+        :keyword burst: Maximum number of tokens in the bucket. Defaults to
+            rate.
+        :type burst: float
+        :keyword lock_file: Optional path for lock file used to share the
+            bucket across processes. (Default: None)
+        :type lock_file: str
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        if lock_file and not fcntl:
+            raise ValueError('lock_file is not supported on this platform')
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.lock_file = lock_file
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._cond = threading.Condition()
+        self._waiting = {}
+
+    def _refill(self, tokens, updated, now):
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def _take_local(self, tokens):
+        now = self._clock()
+        self._tokens = self._refill(self._tokens, self._updated, now)
+        self._updated = now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0
+        return (tokens - self._tokens) / self.rate
+
+    def _take_shared(self, tokens):
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.read(fd, 64).decode('ascii').split()
+            now = self._clock()
+            try:
+                available = self._refill(float(raw[0]), float(raw[1]), now)
+            except (IndexError, ValueError):
+                available = self.burst
+            wait = 0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / self.rate
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, ('%f %f' % (available, now)).encode('ascii'))
+            return wait
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _has_priority_waiters(self, priority):
+        return any(count for waiting_priority, count in self._waiting.items()
+                   if waiting_priority < priority)
+
+    def acquire(self, priority=PRIORITY_REGISTER, tokens=1):
+        """
+        Blocks until requested tokens are available.
+
+        :keyword priority: Priority for the request. Lower value takes
+            precedence. (Default: PRIORITY_REGISTER)
+        :type priority: int
+        :keyword tokens: Number of tokens to acquire. (Default: 1)
+        :type tokens: int
+        :return: Time spent waiting (in seconds)
+        :rtype: float
+        :raises ValueError: If more tokens than burst are requested, as the
+            request could never be granted.
+        """
+        if tokens > self.burst:
+            raise ValueError('Can not acquire %s tokens with burst of %s' %
+                             (tokens, self.burst))
+        take = self._take_shared if self.lock_file else self._take_local
+        started = None
+        with self._cond:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    if not self._has_priority_waiters(priority):
+                        wait = take(tokens)
+                        if not wait:
+                            return 0 if started is None else \
+                                self._clock() - started
+                    else:
+                        wait = 1 / self.rate
+                    if started is None:
+                        started = self._clock()
+                    # Waiters are woken up early when tokens are released
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
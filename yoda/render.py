@@ -0,0 +1,313 @@
+"""
+Incremental rendering of proxy config from the yoda tree.
+
+The config is split into sections: a frontend section per host, a backend
+section per upstream and a section per tcp listener. Watch events mark the
+sections they affect, and only those sections are re-rendered. Each section
+has a checksum, so a change that renders to the same text (e.g. a refreshed
+ttl) does not require a reload.
+
+Usage:
+
+    renderer = Renderer.from_client(client)
+    watcher = ResumableWatcher(client, checkpoint,
+                               on_snapshot=renderer.reset)
+    for event in watcher.events():
+        renderer.apply(event)
+        if renderer.render():
+            write_and_reload(renderer.config())
+"""
+import hashlib
+import re
+from yoda.keyspace import HOST_KINDS, KIND_LISTENER, KIND_UPSTREAM, \
+    UPSTREAM_KINDS, keyspace_for
+from yoda.model import FrozenHost
+from yoda.routing import RoutingTable
+
+__author__ = 'sukrit'
+
+SECTION_FRONTEND = 'frontend'
+SECTION_BACKEND = 'backend'
+SECTION_LISTENER = 'listener'
+
+# Order in which section types appear in the config
+SECTION_ORDER = (SECTION_FRONTEND, SECTION_BACKEND, SECTION_LISTENER)
+
+INVALID_NAME_CHARS = re.compile('[^A-Za-z0-9_]+')
+
+
+def _name(value):
+    return INVALID_NAME_CHARS.sub('_', value)
+
+
+def checksum(text):
+    """
+    :param text: Rendered text
+    :type text: str
+    :return: Hex encoded SHA-1 checksum for the text
+    :rtype: str
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class HaproxyTemplates:
+    """
+    Default templates producing haproxy style config. Subclass and override
+    the methods (or pass any object with the same methods) to customize
+    rendering. A section method returning None omits the section.
+    """
+
+    def header(self):
+        """
+        :return: Text placed before all sections.
+        :rtype: str
+        """
+        return 'frontend http\n    bind *:80\n    mode http\n'
+
+    def frontend(self, host, table):
+        """
+        Renders acls and routing rules for a host. Frontend sections of all
+        hosts are placed under the frontend declared in :meth:`header`.
+
+        :param host: Host with its locations and aliases
+        :type host: yoda.model.FrozenHost
+        :param table: Routing table
+        :type table: yoda.routing.RoutingTable
+        :rtype: str
+        """
+        host_acl = 'host_%s' % _name(host.hostname)
+        lines = ['    acl %s hdr(host) -i %s' % (
+            host_acl, ' '.join([host.hostname] + sorted(host.aliases)))]
+        # Longest path wins
+        for location in sorted(host.locations,
+                               key=lambda loc: (-len(loc.path),
+                                                loc.location_name)):
+            if location.upstream not in table.upstreams:
+                continue
+            path_acl = 'path_%s_%s' % (_name(host.hostname),
+                                       _name(location.location_name))
+            lines.append('    acl %s path_beg %s' % (path_acl, location.path))
+            condition = '%s %s' % (host_acl, path_acl)
+            if location.force_ssl:
+                lines.append('    redirect scheme https if %s !{ ssl_fc }' %
+                             condition)
+            rules = [condition] + sorted(location.allowed_acls) + \
+                ['!%s' % acl for acl in sorted(location.denied_acls)]
+            lines.append('    use_backend %s if %s' % (
+                location.upstream, ' '.join(rules)))
+        return '\n'.join(lines) + '\n'
+
+    def backend(self, upstream, nodes, table):
+        """
+        :param upstream: Name of upstream
+        :type upstream: str
+        :param nodes: Dictionary of node name to endpoint
+        :type nodes: dict
+        :param table: Routing table
+        :type table: yoda.routing.RoutingTable
+        :rtype: str
+        """
+        lines = ['backend %s' % upstream]
+        for node, endpoint in sorted(nodes.items()):
+            lines.append('    server %s %s check' % (node, endpoint))
+        return '\n'.join(lines) + '\n'
+
+    def listener(self, listener, table):
+        """
+        :param listener: Tcp listener
+        :type listener: yoda.model.FrozenTcpListener
+        :param table: Routing table
+        :type table: yoda.routing.RoutingTable
+        :rtype: str
+        """
+        if not listener.upstream or listener.upstream not in table.upstreams:
+            return None
+        return 'frontend tcp_%s\n    bind %s\n    mode tcp\n' \
+            '    default_backend %s\n' % (_name(listener.name), listener.bind,
+                                          listener.upstream)
+
+
+class Renderer:
+    """
+    Renders proxy config from a routing table, re-rendering only the
+    sections affected by changes.
+    """
+
+    def __init__(self, table, templates=None):
+        """
+        :param table: Routing table for the yoda tree
+        :type table: yoda.routing.RoutingTable
+        :keyword templates: Templates for the sections.
+            (Default: HaproxyTemplates())
+        """
+        self.table = table
+        self.templates = templates or HaproxyTemplates()
+        self.keyspace = keyspace_for(table.etcd_base)
+        self._sections = dict()
+        self._dirty = set()
+        self._mark_all()
+
+    @classmethod
+    def from_tree(cls, tree, etcd_base='/yoda', templates=None):
+        """
+        :param tree: Yoda tree (as returned by
+            :meth:`yoda.client.Client.read_tree`)
+        :type tree: dict
+        :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+        :type etcd_base: str
+        :rtype: Renderer
+        """
+        return cls(RoutingTable.from_tree(tree, etcd_base=etcd_base),
+                   templates=templates)
+
+    @classmethod
+    def from_client(cls, client, templates=None):
+        """
+        Builds the renderer using a single recursive read.
+
+        :param client: Yoda client
+        :type client: yoda.client.Client
+        :rtype: Renderer
+        """
+        return cls(RoutingTable.from_client(client), templates=templates)
+
+    def _mark_all(self):
+        dirty = self._dirty
+        dirty.update(self._sections)
+        dirty.update((SECTION_FRONTEND, hostname)
+                     for hostname in self.table.hostnames)
+        dirty.update((SECTION_BACKEND, upstream)
+                     for upstream in self.table.upstreams)
+        dirty.update((SECTION_LISTENER, name)
+                     for name in self.table.listener_names)
+
+    def _mark_upstream_dependents(self, upstream):
+        self._dirty.update(
+            (SECTION_FRONTEND, hostname) for hostname, _ in
+            self.table.get_locations_for_upstream(upstream))
+        self._dirty.update(
+            (SECTION_LISTENER, name) for name in
+            self.table.get_listeners_for_upstream(upstream))
+
+    def reset(self, tree, etcd_index=None):
+        """
+        Replaces the routing table with a snapshot of the yoda tree (e.g.
+        as `on_snapshot` callback for :class:`yoda.watch.ResumableWatcher`).
+        All sections are re-rendered on the next :meth:`render`.
+
+        :param tree: Yoda tree
+        :type tree: dict
+        :keyword etcd_index: Etcd index for the snapshot (ignored)
+        :return: None
+        """
+        self.table = RoutingTable.from_tree(tree,
+                                            etcd_base=self.table.etcd_base)
+        self._mark_all()
+
+    def apply(self, event):
+        """
+        Applies a watch event to the routing table and marks the affected
+        sections.
+
+        :param event: Watch event
+        :type event: yoda.watch.WatchEvent
+        :return: True if event was relevant, False otherwise.
+        :rtype: bool
+        """
+        info = self.keyspace.parse(event.key)
+        if info is None or info.name is None:
+            return False
+        table = self.table
+        kind = info.kind
+        if kind in UPSTREAM_KINDS:
+            existed = info.name in table.upstreams
+            if not table.apply_event(event.action, event.key, event.value,
+                                     event.is_dir):
+                return False
+            self._dirty.add((SECTION_BACKEND, info.name))
+            if existed != (info.name in table.upstreams) or \
+                    (kind == KIND_UPSTREAM and info.field is None):
+                self._mark_upstream_dependents(info.name)
+            return True
+        if kind in HOST_KINDS:
+            if not table.apply_event(event.action, event.key, event.value,
+                                     event.is_dir):
+                return False
+            self._dirty.add((SECTION_FRONTEND, info.name))
+            return True
+        if kind == KIND_LISTENER:
+            if not table.apply_event(event.action, event.key, event.value,
+                                     event.is_dir):
+                return False
+            self._dirty.add((SECTION_LISTENER, info.name))
+            return True
+        return False
+
+    def _render_section(self, section_type, name):
+        table = self.table
+        templates = self.templates
+        if section_type == SECTION_FRONTEND:
+            locations = table.get_locations(name)
+            if not locations:
+                return None
+            return templates.frontend(
+                FrozenHost(name, sorted(locations.values(),
+                                        key=lambda loc: loc.location_name),
+                           aliases=table.get_aliases(name)), table)
+        if section_type == SECTION_BACKEND:
+            if name not in table.upstreams:
+                return None
+            return templates.backend(name, table.get_nodes(name), table)
+        listener = table.get_listener(name)
+        if listener is None:
+            return None
+        return templates.listener(listener, table)
+
+    def render(self):
+        """
+        Re-renders the sections marked by :meth:`apply` (or all sections
+        after :meth:`reset`).
+
+        :return: List of sections (tuple of section type and name) that were
+            added, changed or removed. An empty list means that the config
+            is unchanged.
+        :rtype: list
+        """
+        changed = []
+        dirty, self._dirty = self._dirty, set()
+        for section in sorted(dirty):
+            text = self._render_section(*section)
+            previous = self._sections.get(section)
+            if text is None:
+                if previous is not None:
+                    del self._sections[section]
+                    changed.append(section)
+                continue
+            text_checksum = checksum(text)
+            if previous is None or previous[1] != text_checksum:
+                self._sections[section] = (text, text_checksum)
+                changed.append(section)
+        return changed
+
+    def checksums(self):
+        """
+        :return: Dictionary of section (tuple of section type and name) to
+            checksum for rendered sections.
+        :rtype: dict
+        """
+        return dict((section, value[1])
+                    for section, value in self._sections.items())
+
+    def config(self):
+        """
+        Assembles the rendered sections into the complete config.
+
+        :rtype: str
+        """
+        sections = self._sections
+        parts = [self.templates.header()]
+        for section_type in SECTION_ORDER:
+            parts.extend(sections[section][0] for section in sorted(
+                section for section in sections
+                if section[0] == section_type))
+        return ''.join(parts)
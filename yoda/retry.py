@@ -0,0 +1,160 @@
+"""
+Deadlines and retries for yoda operations.
+
+A single client operation (e.g. :meth:`yoda.client.Client.wire_proxy`) is a
+chain of etcd calls. A :class:`Deadline` bounds the total time spent on the
+chain and a :class:`RetryPolicy` retries calls that failed with a transient
+error, if (and only if) they are safe to be repeated.
+"""
+import time
+from yoda.ratelimit import jitter
+
+__author__ = 'sukrit'
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.1
+DEFAULT_MAX_DELAY = 2.0
+DEFAULT_JITTER = 0.5
+
+
+def transient_errors():
+    """
+    Gets the etcd errors that are considered transient. Imported lazily, so
+    that etcd is not loaded on import.
+
+    :rtype: tuple
+    """
+    import etcd
+    return etcd.EtcdConnectionFailed, etcd.EtcdLeaderElectionInProgress
+
+
+def watch_timeout_errors():
+    """
+    Gets the etcd errors raised when a watch times out without changes.
+    These are subclasses of transient errors, but are never retried: a
+    timeout is the expected outcome of an idle watch and the caller decides
+    whether to watch again.
+
+    :rtype: tuple
+    """
+    import etcd
+    return etcd.EtcdWatchTimedOut,
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when an operation does not complete within its deadline.
+    """
+
+    def __init__(self, operation, timeout, completed=None, cause=None):
+        """
+        :param operation: Name of the operation
+        :type operation: str
+        :param timeout: Timeout (in seconds) for the operation
+        :type timeout: float
+        :keyword completed: List of tuple (verb, key) for etcd writes that
+            completed before the deadline, i.e. the partial progress of the
+            operation.
+        :type completed: list
+        :keyword cause: Error for the last etcd call (if any)
+        :type cause: Exception
+        """
+        self.operation = operation
+        self.timeout = timeout
+        self.completed = list(completed or [])
+        self.cause = cause
+        Exception.__init__(
+            self, '%s did not complete within %ss (%d write(s) completed)%s'
+            % (operation, timeout, len(self.completed),
+               ': %s' % cause if cause else ''))
+
+
+class Deadline:
+    """
+    Time budget shared by all etcd calls made within an operation.
+    """
+
+    def __init__(self, timeout, clock=time.time):
+        """
+        :param timeout: Time budget (in seconds)
+        :type timeout: float
+        :keyword clock: Clock used for measuring time. (Default: time.time)
+        """
+        self.timeout = timeout
+        self.clock = clock
+        self.expires_at = clock() + timeout
+
+    def remaining(self):
+        """
+        :return: Remaining time (in seconds). 0 if deadline has expired.
+        :rtype: float
+        """
+        return max(self.expires_at - self.clock(), 0)
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class RetryPolicy:
+    """
+    Retries with exponential backoff and jitter. The delay before attempt n
+    (n > 1) is base_delay * 2 ^ (n - 2), capped at max_delay and randomized
+    by the jitter fraction.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 jitter_fraction=DEFAULT_JITTER, retryable=None):
+        """
+        :keyword max_attempts: Maximum number of attempts for a call
+            (including the first one). (Default: DEFAULT_MAX_ATTEMPTS)
+        :type max_attempts: int
+        :keyword base_delay: Delay (in seconds) before the first retry.
+            (Default: DEFAULT_BASE_DELAY)
+        :type base_delay: float
+        :keyword max_delay: Maximum delay (in seconds) between attempts.
+            (Default: DEFAULT_MAX_DELAY)
+        :type max_delay: float
+        :keyword jitter_fraction: Fraction used for randomizing the delay.
+            (Default: DEFAULT_JITTER)
+        :type jitter_fraction: float
+        :keyword retryable: Tuple of exception types that are retried. If
+            None, :func:`transient_errors` are retried. Watch timeouts (see
+            :func:`watch_timeout_errors`) are never retried.
+        :type retryable: tuple
+        """
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter_fraction = jitter_fraction
+        self.retryable = retryable
+
+    def backoff(self, attempt):
+        """
+        Gets the delay after a failed attempt.
+
+        :param attempt: Number of the failed attempt (starting from 1)
+        :type attempt: int
+        :return: Delay (in seconds)
+        :rtype: float
+        """
+        return jitter(min(self.base_delay * 2 ** (attempt - 1),
+                          self.max_delay), self.jitter_fraction)
+
+    def should_retry(self, exc, attempt):
+        """
+        :param exc: Error for the failed attempt
+        :type exc: Exception
+        :param attempt: Number of the failed attempt (starting from 1)
+        :type attempt: int
+        :return: True if the call should be retried.
+        :rtype: bool
+        """
+        return attempt < self.max_attempts and \
+            isinstance(exc, self.retryable or transient_errors()) and \
+            not isinstance(exc, watch_timeout_errors())
+
+
+# Policy that never retries
+NO_RETRY = RetryPolicy(max_attempts=1)
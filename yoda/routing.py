@@ -0,0 +1,373 @@
+"""
+Indexed in-memory routing table for the yoda tree.
+"""
+from collections import defaultdict
+import sys
+from yoda.keyspace import HOST_KINDS, KIND_ALIAS, KIND_ENDPOINT, KIND_HOST, \
+    KIND_LISTENER, KIND_LOCATION, KIND_UPSTREAM, UPSTREAM_KINDS, keyspace_for
+from yoda.model import FrozenLocation, FrozenTcpListener
+
+__author__ = 'sukrit'
+
+try:
+    intern = sys.intern
+except AttributeError:  # pragma: no cover
+    intern = intern  # noqa
+
+SET_ACTIONS = ('set', 'create', 'update', 'compareAndSwap')
+DELETE_ACTIONS = ('delete', 'expire', 'compareAndDelete')
+
+
+def _intern(value):
+    return intern(value) if isinstance(value, str) else value
+
+
+def _acls(raw, kind):
+    return list(((raw.get('acls') or {}).get(kind) or {}).values())
+
+
+class RoutingTable:
+    """
+    In-memory routing table built from the yoda tree. It can be maintained
+    incrementally using etcd watch events via :meth:`apply_event`.
+
+    All lookups are O(1):
+        - hostname -> locations (:meth:`get_locations`)
+        - alias -> hostname (:meth:`get_hostname_for_alias`)
+        - upstream -> locations (:meth:`get_locations_for_upstream`)
+        - upstream -> listeners (:meth:`get_listeners_for_upstream`)
+        - endpoint -> nodes (:meth:`get_nodes_for_endpoint`)
+        - upstreams without nodes (:attr:`empty_upstreams`)
+    """
+
+    def __init__(self, etcd_base='/yoda'):
+        """
+        :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+        :type etcd_base: str
+        """
+        self.etcd_base = etcd_base.rstrip('/')
+        self.keyspace = keyspace_for(etcd_base)
+        self.upstreams = set()
+        self.empty_upstreams = set()
+        self._nodes = defaultdict(dict)
+        self._endpoints = defaultdict(set)
+        self._locations = defaultdict(dict)
+        self._raw_locations = defaultdict(dict)
+        self._aliases = defaultdict(set)
+        self._alias_hosts = dict()
+        self._upstream_locations = defaultdict(set)
+        self._listeners = dict()
+        self._raw_listeners = dict()
+        self._upstream_listeners = defaultdict(set)
+
+    @classmethod
+    def from_tree(cls, tree, etcd_base='/yoda'):
+        """
+        Builds the routing table from the yoda tree.
+
+        :param tree: Yoda tree (as returned by
+            :meth:`yoda.client.Client.read_tree`)
+        :type tree: dict
+        :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+        :type etcd_base: str
+        :rtype: RoutingTable
+        """
+        table = cls(etcd_base=etcd_base)
+        for upstream, record in (tree.get('upstreams') or {}).items():
+            table._add_upstream(upstream)
+            for node, endpoint in (record.get('endpoints') or {}).items():
+                table._set_node(upstream, node, endpoint)
+        for hostname, record in (tree.get('hosts') or {}).items():
+            for name, raw in (record.get('locations') or {}).items():
+                table._raw_locations[_intern(hostname)][_intern(name)] = raw
+                table._index_location(hostname, name)
+            for alias in (record.get('aliases') or {}).values():
+                table._set_alias(hostname, alias)
+        listeners = ((tree.get('global') or {}).get('listeners') or {}) \
+            .get('tcp') or {}
+        for name, raw in listeners.items():
+            table._raw_listeners[_intern(name)] = raw
+            table._index_listener(name)
+        return table
+
+    @classmethod
+    def from_client(cls, client):
+        """
+        Builds the routing table using a single recursive read.
+
+        :param client: Yoda client
+        :type client: yoda.client.Client
+        :rtype: RoutingTable
+        """
+        tree, _ = client.read_tree()
+        return cls.from_tree(tree, etcd_base=client.etcd_base)
+
+    def get_nodes(self, upstream):
+        """
+        :return: Dictionary of node name to endpoint for given upstream
+        :rtype: dict
+        """
+        return dict(self._nodes.get(upstream) or {})
+
+    def get_nodes_for_endpoint(self, endpoint):
+        """
+        :return: Set of tuple (upstream, node) registered with the endpoint
+        :rtype: set
+        """
+        return set(self._endpoints.get(endpoint) or ())
+
+    def get_locations(self, hostname):
+        """
+        :return: Dictionary of location name to FrozenLocation for given host
+        :rtype: dict
+        """
+        return dict(self._locations.get(hostname) or {})
+
+    def get_aliases(self, hostname):
+        return set(self._aliases.get(hostname) or ())
+
+    def get_hostname_for_alias(self, alias):
+        return self._alias_hosts.get(alias)
+
+    def get_locations_for_upstream(self, upstream):
+        """
+        :return: Set of tuple (hostname, location_name) routing to upstream
+        :rtype: set
+        """
+        return set(self._upstream_locations.get(upstream) or ())
+
+    def get_listeners_for_upstream(self, upstream):
+        """
+        :return: Set of tcp listener names routing to upstream
+        :rtype: set
+        """
+        return set(self._upstream_listeners.get(upstream) or ())
+
+    def get_listener(self, name):
+        return self._listeners.get(name)
+
+    @property
+    def hostnames(self):
+        return set(self._locations) | set(self._aliases)
+
+    @property
+    def listener_names(self):
+        return set(self._listeners)
+
+    def _add_upstream(self, upstream):
+        upstream = _intern(upstream)
+        if upstream not in self.upstreams:
+            self.upstreams.add(upstream)
+            if not self._nodes.get(upstream):
+                self.empty_upstreams.add(upstream)
+
+    def _remove_upstream(self, upstream):
+        for node in list(self._nodes.get(upstream) or {}):
+            self._remove_node(upstream, node)
+        self.upstreams.discard(upstream)
+        self.empty_upstreams.discard(upstream)
+        self._nodes.pop(upstream, None)
+
+    def _set_node(self, upstream, node, endpoint):
+        self._add_upstream(upstream)
+        self._remove_node(upstream, node)
+        upstream, node, endpoint = \
+            _intern(upstream), _intern(node), _intern(endpoint)
+        self._nodes[upstream][node] = endpoint
+        self._endpoints[endpoint].add((upstream, node))
+        self.empty_upstreams.discard(upstream)
+
+    def _remove_node(self, upstream, node):
+        nodes = self._nodes.get(upstream)
+        if not nodes or node not in nodes:
+            return
+        endpoint = nodes.pop(node)
+        refs = self._endpoints.get(endpoint)
+        if refs is not None:
+            refs.discard((upstream, node))
+            if not refs:
+                del self._endpoints[endpoint]
+        if not nodes and upstream in self.upstreams:
+            self.empty_upstreams.add(upstream)
+
+    def _set_alias(self, hostname, alias):
+        hostname, alias = _intern(hostname), _intern(alias)
+        self._aliases[hostname].add(alias)
+        self._alias_hosts[alias] = hostname
+
+    def _remove_alias(self, hostname, alias):
+        aliases = self._aliases.get(hostname)
+        if aliases is not None:
+            aliases.discard(alias)
+            if not aliases:
+                del self._aliases[hostname]
+        if self._alias_hosts.get(alias) == hostname:
+            del self._alias_hosts[alias]
+
+    def _unindex_location(self, hostname, name):
+        location = (self._locations.get(hostname) or {}).pop(name, None)
+        if location is not None and location.upstream:
+            refs = self._upstream_locations[location.upstream]
+            refs.discard((hostname, name))
+            if not refs:
+                del self._upstream_locations[location.upstream]
+        if hostname in self._locations and not self._locations[hostname]:
+            del self._locations[hostname]
+
+    def _index_location(self, hostname, name):
+        hostname, name = _intern(hostname), _intern(name)
+        self._unindex_location(hostname, name)
+        raw = (self._raw_locations.get(hostname) or {}).get(name)
+        if raw is None:
+            return
+        upstream = _intern(raw.get('upstream'))
+        location = FrozenLocation(
+            upstream, path=raw.get('path') or '/', location_name=name,
+            allowed_acls=_acls(raw, 'allowed'),
+            denied_acls=_acls(raw, 'denied'),
+            force_ssl=raw.get('force-ssl') == 'true')
+        self._locations[hostname][name] = location
+        if upstream:
+            self._upstream_locations[upstream].add((hostname, name))
+
+    def _remove_host(self, hostname):
+        for name in list(self._raw_locations.get(hostname) or {}):
+            self._raw_locations[hostname].pop(name)
+            self._unindex_location(hostname, name)
+        self._raw_locations.pop(hostname, None)
+        for alias in list(self._aliases.get(hostname) or ()):
+            self._remove_alias(hostname, alias)
+
+    def _unindex_listener(self, name):
+        listener = self._listeners.pop(name, None)
+        if listener is not None and listener.upstream:
+            refs = self._upstream_listeners[listener.upstream]
+            refs.discard(name)
+            if not refs:
+                del self._upstream_listeners[listener.upstream]
+
+    def _index_listener(self, name):
+        name = _intern(name)
+        self._unindex_listener(name)
+        raw = self._raw_listeners.get(name)
+        if raw is None:
+            return
+        upstream = _intern(raw.get('upstream'))
+        self._listeners[name] = FrozenTcpListener(
+            name, raw.get('bind'), upstream=upstream,
+            allowed_acls=_acls(raw, 'allowed'),
+            denied_acls=_acls(raw, 'denied'))
+        if upstream:
+            self._upstream_listeners[upstream].add(name)
+
+    @staticmethod
+    def _update_raw(raw, path, value, deleted):
+        """
+        Updates nested raw record at given relative path.
+        """
+        if not path:
+            return
+        parent = raw
+        for part in path[:-1]:
+            if deleted and part not in parent:
+                return
+            parent = parent.setdefault(part, dict())
+        if deleted:
+            parent.pop(path[-1], None)
+        else:
+            parent[path[-1]] = value
+
+    def apply_event(self, action, key, value=None, is_dir=False):
+        """
+        Incrementally applies etcd watch event to the routing table.
+
+        :param action: Etcd action (e.g.: 'set', 'delete', 'expire')
+        :type action: str
+        :param key: Absolute etcd key for the event
+        :type key: str
+        :keyword value: Value for the key (for set actions)
+        :type value: str
+        :keyword is_dir: True if the key is a directory. (Default: False)
+        :type is_dir: bool
+        :return: True if event was relevant for routing table.
+        :rtype: bool
+        """
+        deleted = action in DELETE_ACTIONS
+        if not deleted and action not in SET_ACTIONS:
+            return False
+        info = self.keyspace.parse(key)
+        if info is None or info.name is None:
+            return False
+        kind = info.kind
+
+        if kind in UPSTREAM_KINDS:
+            upstream = info.name
+            if kind == KIND_UPSTREAM and info.field is None:
+                if deleted:
+                    self._remove_upstream(upstream)
+                else:
+                    self._add_upstream(upstream)
+            elif kind == KIND_ENDPOINT and info.child is not None and \
+                    info.field is None and not is_dir:
+                if deleted:
+                    self._remove_node(upstream, info.child)
+                else:
+                    self._set_node(upstream, info.child, value)
+            elif kind == KIND_ENDPOINT and info.child is None and deleted:
+                for node in list(self._nodes.get(upstream) or {}):
+                    self._remove_node(upstream, node)
+            elif not deleted:
+                self._add_upstream(upstream)
+            return True
+
+        if kind in HOST_KINDS:
+            hostname = info.name
+            if kind == KIND_HOST:
+                if info.field is None and deleted:
+                    self._remove_host(hostname)
+            elif kind == KIND_ALIAS:
+                if info.child is None and deleted:
+                    for alias in list(self._aliases.get(hostname) or ()):
+                        self._remove_alias(hostname, alias)
+                elif info.child is not None and info.field is None and \
+                        not is_dir:
+                    if deleted:
+                        self._remove_alias(hostname, info.child)
+                    else:
+                        self._set_alias(hostname, value)
+            elif kind == KIND_LOCATION:
+                if info.child is None:
+                    if deleted:
+                        for name in list(
+                                self._raw_locations.get(hostname) or {}):
+                            self._raw_locations[hostname].pop(name)
+                            self._unindex_location(hostname, name)
+                    return True
+                name = info.child
+                locations = self._raw_locations[_intern(hostname)]
+                if info.field is None:
+                    if deleted:
+                        locations.pop(name, None)
+                    else:
+                        locations.setdefault(_intern(name), dict())
+                elif not is_dir or deleted:
+                    self._update_raw(
+                        locations.setdefault(_intern(name), dict()),
+                        info.field.split('/'), value, deleted)
+                self._index_location(hostname, name)
+            return True
+
+        if kind == KIND_LISTENER:
+            name = info.name
+            if info.field is None:
+                if deleted:
+                    self._raw_listeners.pop(name, None)
+                else:
+                    self._raw_listeners.setdefault(_intern(name), dict())
+            elif not is_dir or deleted:
+                self._update_raw(
+                    self._raw_listeners.setdefault(_intern(name), dict()),
+                    info.field.split('/'), value, deleted)
+            self._index_listener(name)
+            return True
+        return False
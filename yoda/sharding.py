@@ -0,0 +1,543 @@
+"""
+Sharding of yoda data across multiple etcd clusters (and/or base paths).
+
+Upstreams, hosts, proxy nodes and tcp listeners are placed on a shard using
+consistent hashing of their name. Adding a shard only moves the names that
+hash to the new shard (roughly 1/N of the keys). Their data is moved using
+:meth:`ShardedClient.rebalance`.
+"""
+import bisect
+from collections import defaultdict
+import hashlib
+from yoda.client import Client, DecommissionResult, NoMatchingLocations, \
+    DEFAULT_SWITCH_TIMEOUT, DEFAULT_SWITCH_POLL_INTERVAL, \
+    DEFAULT_ROLLBACK_TTL, _key_not_found_errors
+from yoda.stats import ClusterStats, DEFAULT_EXPIRING_WITHIN
+from yoda.util import parallel_map, DEFAULT_MAX_WORKERS
+
+__author__ = 'sukrit'
+
+DEFAULT_REPLICAS = 128
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    Consistent hash ring using virtual nodes.
+    """
+
+    def __init__(self, nodes=None, replicas=DEFAULT_REPLICAS):
+        """
+        :keyword nodes: List of node (shard) names. (Default: None)
+        :type nodes: list
+        :keyword replicas: Number of virtual nodes per node.
+            (Default: DEFAULT_REPLICAS)
+        :type replicas: int
+        """
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+        for node in nodes or []:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return sorted(set(self._nodes.values()))
+
+    def add(self, node):
+        """
+        Adds node to the ring.
+
+        :param node: Name of the node
+        :type node: str
+        :return: None
+        """
+        for replica in range(self.replicas):
+            point = _hash('%s#%d' % (node, replica))
+            if point not in self._nodes:
+                bisect.insort(self._hashes, point)
+            self._nodes[point] = node
+
+    def remove(self, node):
+        """
+        Removes node from the ring.
+
+        :param node: Name of the node
+        :type node: str
+        :return: None
+        """
+        for replica in range(self.replicas):
+            point = _hash('%s#%d' % (node, replica))
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._hashes.remove(point)
+
+    def get(self, key):
+        """
+        Gets the node for a given key.
+
+        :param key: Key to be placed (e.g. upstream name)
+        :type key: str
+        :return: Name of the node
+        :rtype: str
+        """
+        if not self._hashes:
+            raise ValueError('Hash ring is empty')
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+
+class ShardedSwitchResult:
+    """
+    Result of :meth:`ShardedClient.switch_upstream`, combining the
+    :class:`yoda.client.SwitchResult` of every shard with switched (or
+    failed) locations.
+    """
+
+    def __init__(self, results, reverted=False):
+        """
+        :param results: Dictionary of shard name to
+            :class:`yoda.client.SwitchResult`
+        :type results: dict
+        :keyword reverted: True if switched keys were reverted after a
+            failure.
+        :type reverted: bool
+        """
+        self.results = results
+        self.reverted = reverted
+
+    @property
+    def switched(self):
+        return [key for name in sorted(self.results)
+                for key in self.results[name].switched]
+
+    @property
+    def failures(self):
+        failures = dict()
+        for result in self.results.values():
+            failures.update(result.failures)
+        return failures
+
+    @property
+    def success(self):
+        return not self.failures
+
+    def rollback(self, max_concurrency=None):
+        """
+        Switches the locations on every shard back to the old upstream.
+        Shards are rolled back in parallel.
+
+        :keyword max_concurrency: Maximum number of locations switched in
+            parallel per shard. (Default: None, i.e. all at once)
+        :type max_concurrency: int
+        :return: Result of the rollback
+        :rtype: ShardedSwitchResult
+        """
+        names = sorted(name for name, result in self.results.items()
+                       if result.switched)
+        return ShardedSwitchResult(dict(zip(names, parallel_map(
+            lambda name: self.results[name].rollback(
+                max_concurrency=max_concurrency), names))))
+
+
+class ShardedClient:
+    """
+    Yoda client that routes every operation to one of multiple
+    :class:`yoda.client.Client` shards.
+    """
+
+    def __init__(self, shards, replicas=DEFAULT_REPLICAS,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param shards: Dictionary of shard name to either
+            :class:`yoda.client.Client` instance or dictionary of keyword
+            arguments for creating one. e.g.:
+            {
+                'shard1': {'etcd_host': 'etcd1', 'etcd_base': '/yoda'},
+                'shard2': {'etcd_host': 'etcd2', 'etcd_base': '/yoda'},
+            }
+        :type shards: dict
+        :keyword replicas: Number of virtual nodes per shard.
+        :type replicas: int
+        :keyword max_workers: Maximum concurrency for cross shard calls.
+        :type max_workers: int
+        """
+        self.shards = {}
+        self.ring = HashRing(replicas=replicas)
+        self.max_workers = max_workers
+        for name, shard in shards.items():
+            self.add_shard(name, shard)
+
+    def add_shard(self, name, shard):
+        """
+        Adds a new shard. Only the names that hash to the new shard get
+        relocated. Existing data is not migrated until :meth:`rebalance` is
+        called, so lookups for relocated names do not find it in between.
+
+        :param name: Name of the shard
+        :type name: str
+        :param shard: Client instance or keyword arguments for the client.
+        :type shard: yoda.client.Client or dict
+        :return: None
+        """
+        if isinstance(shard, dict):
+            shard = Client(**shard)
+        self.shards[name] = shard
+        self.ring.add(name)
+
+    def rebalance(self, max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Moves the entities (upstreams, hosts, tcp listeners and proxy nodes)
+        that are not stored on their owning shard (e.g. after
+        :meth:`add_shard`). Only the entities whose owner changed are read,
+        copied to the new owner and then deleted from the old shard (see
+        :meth:`yoda.client.Client.move_subtrees`). Shards are listed and
+        moves between different pairs of shards are made in parallel.
+
+        :keyword max_concurrency: Maximum number of entities moved in
+            parallel between a pair of shards.
+            (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Tuple of results (dictionary of tuple (shard, etcd key) to
+            dictionary with new shard and number of leaf keys copied) and
+            failures (dictionary of tuple (shard, etcd key) to exception).
+            e.g.:
+            ({('shard1', '/yoda/upstreams/app-8080'):
+                {'shard': 'shard3', 'copied': 4}}, {})
+        :rtype: tuple
+        """
+        moves = defaultdict(list)
+        for name, entities in self.fan_out('entities').items():
+            for entity, key in entities:
+                owner = self.ring.get(entity)
+                if owner != name:
+                    moves[(name, owner)].append(key)
+
+        def move(pair):
+            source, target = pair
+            return self.shards[source].move_subtrees(
+                moves[pair], self.shards[target],
+                max_concurrency=max_concurrency)
+
+        pairs = sorted(moves)
+        results, failures = dict(), dict()
+        for (source, target), (moved, failed) in zip(
+                pairs, parallel_map(move, pairs,
+                                    max_workers=self.max_workers)):
+            results.update(
+                ((source, key), {'shard': target, 'copied': copied})
+                for key, copied in moved.items())
+            failures.update(((source, key), error)
+                            for key, error in failed.items())
+        return results, failures
+
+    def shard_for(self, name):
+        """
+        Gets the client for the shard owning given name (upstream, hostname,
+        proxy node or listener name).
+
+        :param name: Name to be placed
+        :type name: str
+        :return: Client for the shard
+        :rtype: yoda.client.Client
+        """
+        return self.shards[self.ring.get(name)]
+
+    def group_by_shard(self, names):
+        """
+        Groups names by the shard owning them.
+
+        :param names: List of names
+        :type names: list
+        :return: Dictionary of shard name to list of names
+        :rtype: dict
+        """
+        grouped = defaultdict(list)
+        for name in names:
+            grouped[self.ring.get(name)].append(name)
+        return dict(grouped)
+
+    @staticmethod
+    def _merge_results(shard_results):
+        results, failures = dict(), dict()
+        for shard_result, shard_failures in shard_results:
+            results.update(shard_result)
+            failures.update(shard_failures)
+        return results, failures
+
+    def fan_out(self, method, *args, **kwargs):
+        """
+        Invokes client method on every shard in parallel.
+
+        :param method: Name of :class:`yoda.client.Client` method
+        :type method: str
+        :return: Dictionary of shard name to result
+        :rtype: dict
+        """
+        names = sorted(self.shards)
+        results = parallel_map(
+            lambda name: getattr(self.shards[name], method)(*args, **kwargs),
+            names, max_workers=self.max_workers)
+        return dict(zip(names, results))
+
+    def _apply_grouped(self, grouped, method, *args, **kwargs):
+        """
+        Invokes client method on every shard with the items grouped for it.
+        Shards are invoked in parallel and their results (tuple of results
+        and failures) are merged.
+
+        :param grouped: Dictionary of shard name to list of items
+        :type grouped: dict
+        :param method: Name of :class:`yoda.client.Client` method
+        :type method: str
+        :return: Tuple of merged results and failures
+        :rtype: tuple
+        """
+        return self._merge_results(parallel_map(
+            lambda name: getattr(self.shards[name], method)(
+                grouped[name], *args, **kwargs),
+            sorted(grouped), max_workers=self.max_workers))
+
+    def get_nodes(self, upstream, **kwargs):
+        return self.shard_for(upstream).get_nodes(upstream, **kwargs)
+
+    def get_nodes_with_meta(self, upstream, **kwargs):
+        return self.shard_for(upstream).get_nodes_with_meta(upstream,
+                                                            **kwargs)
+
+    def stats(self, expiring_within=DEFAULT_EXPIRING_WITHIN, **kwargs):
+        """
+        Computes statistics on every shard (in parallel) and adds them up.
+        The etcd index is not set for the combined statistics.
+
+        :rtype: yoda.stats.ClusterStats
+        """
+        stats = ClusterStats(expiring_within=expiring_within)
+        for shard_stats in self.fan_out(
+                'stats', expiring_within=expiring_within, **kwargs).values():
+            stats.merge(shard_stats)
+        return stats
+
+    def register_upstream(self, upstream, *args, **kwargs):
+        return self.shard_for(upstream).register_upstream(
+            upstream, *args, **kwargs)
+
+    def remove_upstream(self, upstream):
+        return self.shard_for(upstream).remove_upstream(upstream)
+
+    def renew_upstream(self, upstream, *args, **kwargs):
+        return self.shard_for(upstream).renew_upstream(
+            upstream, *args, **kwargs)
+
+    def discover_node(self, upstream, *args, **kwargs):
+        return self.shard_for(upstream).discover_node(
+            upstream, *args, **kwargs)
+
+    def remove_node(self, upstream, node_name):
+        return self.shard_for(upstream).remove_node(upstream, node_name)
+
+    def discover_nodes(self, nodes, **kwargs):
+        """
+        Discovers nodes on the shards owning their upstreams. Shards are
+        written in parallel.
+        """
+        grouped = defaultdict(list)
+        for node in nodes:
+            grouped[self.ring.get(node['upstream'])].append(node)
+        return self._apply_grouped(grouped, 'discover_nodes', **kwargs)
+
+    def remove_nodes(self, nodes, **kwargs):
+        """
+        Removes nodes from the shards owning their upstreams. Shards are
+        written in parallel.
+        """
+        grouped = defaultdict(list)
+        for upstream, node_name in nodes:
+            grouped[self.ring.get(upstream)].append((upstream, node_name))
+        return self._apply_grouped(grouped, 'remove_nodes', **kwargs)
+
+    def discover_proxy_node(self, node_name, *args, **kwargs):
+        return self.shard_for(node_name).discover_proxy_node(
+            node_name, *args, **kwargs)
+
+    def remove_proxy_node(self, node_name):
+        return self.shard_for(node_name).remove_proxy_node(node_name)
+
+    def update_tcp_listener(self, tcp_listener):
+        return self.shard_for(tcp_listener.name).update_tcp_listener(
+            tcp_listener)
+
+    def sync_tcp_listeners(self, tcp_listeners, prune=False,
+                           max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Syncs listeners on their owning shards. Shards are synced in
+        parallel.
+        """
+        grouped = dict((name, []) for name in self.shards)
+        for tcp_listener in tcp_listeners:
+            grouped[self.ring.get(tcp_listener.name)].append(tcp_listener)
+        return self._apply_grouped(grouped, 'sync_tcp_listeners',
+                                   prune=prune,
+                                   max_concurrency=max_concurrency)
+
+    def remove_tcp_listener(self, listener_name):
+        return self.shard_for(listener_name).remove_tcp_listener(
+            listener_name)
+
+    def wire_proxy(self, host):
+        return self.shard_for(host.hostname).wire_proxy(host)
+
+    def wire_proxies(self, hosts, max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Wires hosts on their owning shards. Shards are wired in parallel.
+        """
+        grouped = defaultdict(list)
+        for host in hosts:
+            grouped[self.ring.get(host.hostname)].append(host)
+        return self._apply_grouped(grouped, 'wire_proxies',
+                                   max_concurrency=max_concurrency)
+
+    def unwire_proxy(self, hostname, upstreams=[]):
+        """
+        Unwires the host and removes the upstreams. Upstreams are removed in
+        parallel across shards after the host has been unwired.
+        """
+        self.shard_for(hostname).unwire_proxy(hostname)
+        parallel_map(
+            lambda upstream: self.shard_for(upstream).remove_upstream(
+                upstream),
+            upstreams, max_workers=self.max_workers)
+
+    def decommission(self, app_or_prefix, dry_run, exact=True,
+                     max_concurrency=DEFAULT_MAX_WORKERS):
+        """
+        Removes an application from the proxy across all shards (see
+        :meth:`yoda.client.Client.decommission`). Hosts and listeners may be
+        stored on a different shard than the upstreams they route to, so the
+        routes are first deleted on all shards (in parallel) and the
+        upstreams are removed only after that. An upstream is kept if a
+        route to it (on any shard) could not be deleted.
+
+        :param app_or_prefix: Application name or upstream prefix
+        :type app_or_prefix: str
+        :param dry_run: If True, keys to be deleted are found but not
+            deleted.
+        :type dry_run: bool
+        :keyword exact: Whether upstreams are matched exactly.
+            (Default: True)
+        :type exact: bool
+        :keyword max_concurrency: Maximum number of parallel deletes per
+            shard. (Default: DEFAULT_MAX_WORKERS)
+        :type max_concurrency: int
+        :return: Combined result of the decommission
+        :rtype: yoda.client.DecommissionResult
+        """
+        routed = self.fan_out(
+            'decommission', app_or_prefix, dry_run=dry_run, exact=exact,
+            remove_upstreams=False, max_concurrency=max_concurrency)
+        names = sorted(routed)
+        planned, deleted, failures = [], [], dict()
+        still_routed = set()
+        for name in names:
+            planned.extend(routed[name].planned)
+            deleted.extend(routed[name].deleted)
+            failures.update(routed[name].failures)
+            still_routed.update(routed[name].still_routed)
+        upstreams = dict((name, routed[name].upstreams) for name in names)
+        planned.extend(self.shards[name].keyspace.upstream_key(upstream)
+                       for name in names for upstream in upstreams[name])
+        all_upstreams = sorted(upstream for name in names
+                               for upstream in upstreams[name])
+        if dry_run:
+            return DecommissionResult(all_upstreams, planned=planned,
+                                      dry_run=True)
+
+        def remove_upstreams(name):
+            shard = self.shards[name]
+            removed, removal_failures = [], dict()
+            with shard.change_set('decommission %s' % app_or_prefix):
+                for upstream in upstreams[name]:
+                    if upstream in still_routed:
+                        continue
+                    key = shard.keyspace.upstream_key(upstream)
+                    try:
+                        shard.remove_upstream(upstream)
+                        removed.append(key)
+                    except Exception as exc:
+                        removal_failures[key] = exc
+            return removed, removal_failures
+
+        for removed, removal_failures in parallel_map(
+                remove_upstreams, names, max_workers=self.max_workers):
+            deleted.extend(removed)
+            failures.update(removal_failures)
+        return DecommissionResult(
+            all_upstreams, planned=planned, deleted=deleted,
+            failures=failures,
+            skipped=[self.shards[name].keyspace.upstream_key(upstream)
+                     for name in names for upstream in upstreams[name]
+                     if upstream in still_routed],
+            still_routed=sorted(still_routed))
+
+    def switch_upstream(self, from_upstream, to_upstream, hostnames=None,
+                        min_nodes=1, ready=None,
+                        timeout=DEFAULT_SWITCH_TIMEOUT,
+                        poll_interval=DEFAULT_SWITCH_POLL_INTERVAL,
+                        rollback_ttl=DEFAULT_ROLLBACK_TTL,
+                        revert_on_failure=True, max_concurrency=None):
+        """
+        Switches all locations routing to from_upstream over to to_upstream
+        on every shard (see :meth:`yoda.client.Client.switch_upstream`).
+        Readiness is checked on the shard owning to_upstream and the old
+        upstream is kept for rollback on the shard owning from_upstream.
+        Shards are switched in parallel. If any location fails to switch,
+        the switched locations on all shards are reverted.
+
+        :return: Combined result of the switch
+        :rtype: ShardedSwitchResult
+        :raises UpstreamNotReady: If to_upstream does not have enough ready
+            nodes within the timeout.
+        :raises NoMatchingLocations: If no location (on any shard) routes to
+            from_upstream.
+        """
+        self.shard_for(to_upstream).wait_for_upstream(
+            to_upstream, min_nodes=min_nodes, ready=ready, timeout=timeout,
+            poll_interval=poll_interval)
+
+        def switch(name):
+            try:
+                # Readiness was checked above
+                return self.shards[name].switch_upstream(
+                    from_upstream, to_upstream, hostnames=hostnames,
+                    min_nodes=0, rollback_ttl=None, revert_on_failure=False,
+                    max_concurrency=max_concurrency)
+            except NoMatchingLocations:
+                return None
+
+        names = sorted(self.shards)
+        results = dict(
+            (name, result) for name, result in zip(names, parallel_map(
+                switch, names, max_workers=self.max_workers))
+            if result is not None)
+        if not results:
+            raise NoMatchingLocations(from_upstream, hostnames=hostnames)
+        result = ShardedSwitchResult(results)
+        if result.failures and result.switched and revert_on_failure:
+            revert_failures = result.rollback(
+                max_concurrency=max_concurrency).failures
+            for shard_result in results.values():
+                shard_result.switched = [key for key in shard_result.switched
+                                         if key in revert_failures]
+            result.reverted = True
+
+        if result.switched and rollback_ttl:
+            try:
+                self.shard_for(from_upstream).renew_upstream(
+                    from_upstream, ttl=rollback_ttl)
+            except _key_not_found_errors():
+                # Old upstream is already gone. Nothing to keep for rollback.
+                pass
+        return result
@@ -0,0 +1,433 @@
+"""
+Persistent last-known-good snapshot of the yoda tree.
+
+The snapshot is stored in a compact binary file which is memory mapped on
+load, so that lookups can be served immediately on startup (and during etcd
+outages) without decoding the complete file.
+
+File layout (big endian):
+
+    header:  magic (4s) | version (H) | etcd index (q) | entries (I) |
+             crc32 of everything after header (I)
+    index:   entries * (key offset (I) | key length (I) |
+                        value offset (I) | value length (I)), sorted by key
+    data:    utf-8 encoded keys and json encoded values
+
+Every top level entity gets its own entry with key `<kind>/<name>` (e.g.
+`upstreams/upstream1`, `hosts/myhost.example.com`).
+
+:class:`SnapshotCache` keeps the snapshot up to date by watching etcd from
+the stored index, so a full read of the tree is only made when there is no
+snapshot or when etcd has compacted the stored index.
+"""
+import copy
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from yoda.keyspace import keyspace_for
+from yoda.routing import DELETE_ACTIONS
+from yoda.util import dict_merge
+
+__author__ = 'sukrit'
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'YODA'
+VERSION = 1
+HEADER = struct.Struct('>4sHqII')
+INDEX_ENTRY = struct.Struct('>IIII')
+DEFAULT_REFRESH_INTERVAL = 10
+
+# Timeout (in seconds) for the watch request after which the cache is
+# considered to have caught up with etcd.
+DEFAULT_CATCH_UP_TIMEOUT = 1
+
+
+def nodes_from_upstream(upstream):
+    """
+    Gets nodes from an upstream record (in the same format as
+    :meth:`yoda.client.Client.get_nodes`)
+
+    :param upstream: Nested upstream record from the yoda tree
+    :type upstream: dict
+    :return: Dictionary of node name to endpoint
+    :rtype: dict
+    """
+    return dict((upstream or {}).get('endpoints') or {})
+
+
+def nodes_with_meta_from_upstream(upstream):
+    """
+    Gets nodes with meta from an upstream record (in the same format as
+    :meth:`yoda.client.Client.get_nodes_with_meta`)
+
+    :param upstream: Nested upstream record from the yoda tree
+    :type upstream: dict
+    :return: Dictionary of nodes for the upstream.
+    :rtype: dict
+    """
+    upstream = upstream or {}
+    endpoints = dict(
+        (node, {'endpoint': endpoint})
+        for node, endpoint in (upstream.get('endpoints') or {}).items())
+    return dict_merge(endpoints, upstream.get('endpoints-meta'))
+
+
+def _update_nested(record, path, value, is_dir, deleted):
+    parent = record
+    for part in path[:-1]:
+        if deleted and part not in parent:
+            return
+        child = parent.get(part)
+        if not isinstance(child, dict):
+            child = parent[part] = dict()
+        parent = child
+    if deleted:
+        parent.pop(path[-1], None)
+    elif is_dir:
+        if not isinstance(parent.get(path[-1]), dict):
+            parent[path[-1]] = dict()
+    else:
+        parent[path[-1]] = value
+
+
+def apply_event(tree, path, value=None, is_dir=False, deleted=False):
+    """
+    Applies a change to the yoda tree. Entity records (e.g. an upstream) are
+    copied before they are modified, so records already handed out by
+    lookups never change.
+
+    :param tree: Yoda tree (as returned by
+        :meth:`yoda.client.Client.read_tree`)
+    :type tree: dict
+    :param path: Parts of the changed key relative to the etcd base (e.g.
+        ['upstreams', 'upstream1', 'endpoints', 'node1'])
+    :type path: list
+    :keyword value: Value for the key (ignored for directories and deletes)
+    :keyword is_dir: True if the key is a directory. (Default: False)
+    :type is_dir: bool
+    :keyword deleted: True if the key was deleted (or expired).
+        (Default: False)
+    :type deleted: bool
+    :return: None
+    """
+    if len(path) < 3:
+        _update_nested(tree, path, value, is_dir, deleted)
+        return
+    children = tree.get(path[0])
+    if not isinstance(children, dict):
+        if deleted:
+            return
+        children = tree[path[0]] = dict()
+    record = children.get(path[1])
+    if deleted and not isinstance(record, dict):
+        return
+    record = copy.deepcopy(record) if isinstance(record, dict) else dict()
+    _update_nested(record, path[2:], value, is_dir, deleted)
+    children[path[1]] = record
+
+
+def write_snapshot(path, tree, etcd_index):
+    """
+    Atomically writes snapshot for the yoda tree to given path.
+
+    :param path: Path for the snapshot file
+    :type path: str
+    :param tree: Yoda tree (as returned by
+        :meth:`yoda.client.Client.read_tree`)
+    :type tree: dict
+    :param etcd_index: Etcd index for the tree
+    :type etcd_index: int
+    :return: None
+    """
+    entries = []
+    for kind, children in tree.items():
+        if isinstance(children, dict):
+            for name, value in children.items():
+                entries.append(('%s/%s' % (kind, name), value))
+        else:
+            entries.append((kind, children))
+    entries = sorted(
+        (key.encode('utf-8'),
+         json.dumps(value, sort_keys=True, separators=(',', ':'))
+         .encode('utf-8'))
+        for key, value in entries)
+
+    data_offset = HEADER.size + INDEX_ENTRY.size * len(entries)
+    index = []
+    data = []
+    offset = data_offset
+    for key, value in entries:
+        index.append(INDEX_ENTRY.pack(offset, len(key), offset + len(key),
+                                      len(value)))
+        data.append(key)
+        data.append(value)
+        offset += len(key) + len(value)
+    body = b''.join(index + data)
+    header = HEADER.pack(MAGIC, VERSION, etcd_index or 0, len(entries),
+                         zlib.crc32(body) & 0xffffffff)
+
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(body)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.rename(tmp_path, path)
+
+
+class SnapshotReader:
+    """
+    Memory mapped reader for snapshot file.
+    """
+
+    def __init__(self, path, verify=True):
+        """
+        :param path: Path for the snapshot file
+        :type path: str
+        :keyword verify: If True, checksum for the file is verified.
+            (Default: True)
+        :type verify: bool
+        :raises ValueError: If snapshot file is invalid or corrupt
+        """
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER.size:
+            raise ValueError('Snapshot %s is truncated' % path)
+        magic, version, self.etcd_index, self.count, checksum = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Snapshot %s has unsupported format' % path)
+        if verify and \
+                zlib.crc32(self._mmap[HEADER.size:]) & 0xffffffff != checksum:
+            raise ValueError('Snapshot %s is corrupt' % path)
+
+    def _entry(self, position):
+        return INDEX_ENTRY.unpack_from(
+            self._mmap, HEADER.size + position * INDEX_ENTRY.size)
+
+    def _key(self, position):
+        key_offset, key_len, _, _ = self._entry(position)
+        return self._mmap[key_offset:key_offset + key_len]
+
+    def get(self, key, default=None):
+        """
+        Gets the value for given key using binary search over the index.
+
+        :param key: Entry key (e.g. 'upstreams/upstream1')
+        :type key: str
+        :return: Decoded value for the key or default if not found.
+        """
+        key = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.count and self._key(low) == key:
+            _, _, value_offset, value_len = self._entry(low)
+            return json.loads(self._mmap[value_offset:value_offset + value_len]
+                              .decode('utf-8'))
+        return default
+
+    def keys(self):
+        """
+        Iterates over all entry keys (in sorted order).
+        """
+        for position in range(self.count):
+            yield self._key(position).decode('utf-8')
+
+    def tree(self):
+        """
+        Decodes all entries into the yoda tree (in the same format as
+        :meth:`yoda.client.Client.read_tree`).
+
+        :rtype: dict
+        """
+        tree = dict()
+        for key in self.keys():
+            parts = key.split('/', 1)
+            if len(parts) == 1:
+                tree[key] = self.get(key)
+            else:
+                tree.setdefault(parts[0], dict())[parts[1]] = self.get(key)
+        return tree
+
+    def close(self):
+        self._mmap.close()
+
+
+class _IndexCheckpoint:
+    """
+    Checkpoint for the watch made by :class:`SnapshotCache`. The index is
+    kept with the in-memory tree (and persisted along with the snapshot).
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def load(self):
+        return self.cache.etcd_index
+
+    def save(self, index):
+        self.cache.etcd_index = index
+
+
+class SnapshotCache:
+    """
+    Serves yoda lookups from the last-known-good snapshot while refreshing it
+    from etcd in background.
+    """
+
+    def __init__(self, client, path,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 catch_up_timeout=DEFAULT_CATCH_UP_TIMEOUT):
+        """
+        :param client: Yoda client used for refreshing the snapshot
+        :type client: yoda.client.Client
+        :param path: Path for the snapshot file
+        :type path: str
+        :keyword refresh_interval: Interval (in seconds) for background
+            refresh. (Default: DEFAULT_REFRESH_INTERVAL)
+        :type refresh_interval: float
+        :keyword catch_up_timeout: Timeout (in seconds) for the watch
+            request after which a refresh is considered to have caught up.
+            (Default: DEFAULT_CATCH_UP_TIMEOUT)
+        :type catch_up_timeout: float
+        """
+        self.client = client
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.catch_up_timeout = catch_up_timeout
+        self.etcd_index = None
+        self._reader = None
+        self._tree = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.load()
+
+    def load(self):
+        """
+        Loads the snapshot file if it exists and is valid.
+
+        :return: True if snapshot was loaded, False otherwise.
+        :rtype: bool
+        """
+        try:
+            reader = SnapshotReader(self.path)
+        except (IOError, OSError, ValueError) as error:
+            logger.info('Ignoring snapshot %s: %s', self.path, error)
+            return False
+        with self._lock:
+            previous, self._reader = self._reader, reader
+            self._tree = None
+            self.etcd_index = reader.etcd_index
+            if previous:
+                previous.close()
+        return True
+
+    def _get(self, kind, name):
+        tree = self._tree
+        if tree is not None:
+            return (tree.get(kind) or {}).get(name)
+        with self._lock:
+            if self._tree is not None:
+                return (self._tree.get(kind) or {}).get(name)
+            if self._reader:
+                return self._reader.get('%s/%s' % (kind, name))
+        return None
+
+    def get_nodes(self, upstream):
+        return nodes_from_upstream(self._get('upstreams', upstream))
+
+    def get_nodes_with_meta(self, upstream):
+        return nodes_with_meta_from_upstream(self._get('upstreams', upstream))
+
+    def get_host(self, hostname):
+        """
+        Gets the host record from the snapshot.
+
+        :param hostname: Hostname for the proxy
+        :type hostname: str
+        :return: Nested host record or None if host does not exist.
+        :rtype: dict
+        """
+        return self._get('hosts', hostname)
+
+    def _replace_tree(self, tree, etcd_index=None):
+        """
+        Replaces the in-memory tree (e.g. with a full snapshot taken by the
+        watcher) and closes the snapshot file reader.
+        """
+        with self._lock:
+            reader, self._reader = self._reader, None
+            self._tree = tree
+            if reader:
+                reader.close()
+
+    def refresh(self):
+        """
+        Catches up with the changes made since the stored etcd index using a
+        watch (see :class:`yoda.watch.ResumableWatcher`) and persists the
+        snapshot if it has changed. The tree is only read completely when
+        there is no snapshot or when the stored index has been compacted.
+
+        :return: True if snapshot was updated, False otherwise.
+        :rtype: bool
+        """
+        # Imported lazily, as etcd is slow to import
+        from yoda.watch import ResumableWatcher
+        if self._tree is None and self._reader is not None:
+            self._replace_tree(self._reader.tree())
+        keyspace = keyspace_for(self.client.etcd_base)
+        previous_index = self.etcd_index
+        watcher = ResumableWatcher(self.client, _IndexCheckpoint(self),
+                                   on_snapshot=self._replace_tree,
+                                   timeout=self.catch_up_timeout)
+        for event in watcher.events(stop=self._stop, until_idle=True):
+            path = keyspace.relative_parts(event.key)
+            if path and path[0]:
+                apply_event(self._tree, path, value=event.value,
+                            is_dir=event.is_dir,
+                            deleted=event.action in DELETE_ACTIONS)
+        if self.etcd_index == previous_index and \
+                os.path.exists(self.path):
+            return False
+        write_snapshot(self.path, self._tree, self.etcd_index)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving last-known-good snapshot
+                logger.exception('Failed to refresh yoda snapshot')
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """
+        Starts background refresh thread.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops background refresh thread.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
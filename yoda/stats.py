@@ -0,0 +1,188 @@
+"""
+Capacity and expiry statistics for the yoda tree.
+"""
+from collections import defaultdict
+from yoda.keyspace import HOST_KINDS, KIND_ENDPOINT, KIND_LISTENER, \
+    KIND_LOCATION, KIND_PROXY_NODE, KIND_UPSTREAM, keyspace_for
+
+__author__ = 'sukrit'
+
+DEFAULT_EXPIRING_WITHIN = 30
+
+
+class ClusterStats:
+    """
+    Aggregates computed in a single pass over the keys of the yoda tree.
+    """
+
+    def __init__(self, etcd_base='/yoda',
+                 expiring_within=DEFAULT_EXPIRING_WITHIN):
+        """
+        :keyword etcd_base: Base key for yoda tree. (Default: '/yoda')
+        :type etcd_base: str
+        :keyword expiring_within: Keys with ttl less than or equal to this
+            value (in seconds) are counted as expiring.
+            (Default: DEFAULT_EXPIRING_WITHIN)
+        :type expiring_within: int
+        """
+        self.etcd_base = etcd_base.rstrip('/')
+        self.keyspace = keyspace_for(etcd_base)
+        self.expiring_within = expiring_within
+        self.keys = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.etcd_index = None
+        self.nodes_per_upstream = defaultdict(int)
+        self.expiring_nodes_per_upstream = defaultdict(int)
+        self.expiring_upstreams = set()
+        self.hosts = set()
+        self.locations = 0
+        self.tcp_listeners = set()
+        self.proxy_nodes = 0
+
+    def add(self, key, value=None, ttl=None, is_dir=False):
+        """
+        Adds etcd key to the statistics.
+
+        :param key: Absolute etcd key
+        :type key: str
+        :keyword value: Value for the key
+        :type value: str
+        :keyword ttl: Remaining ttl (in seconds) as returned by etcd
+        :type ttl: int
+        :keyword is_dir: True if key is a directory
+        :type is_dir: bool
+        :return: None
+        """
+        if not key.startswith(self.keyspace.prefix):
+            return
+        expiring = ttl is not None and ttl <= self.expiring_within
+        if is_dir:
+            self.dirs += 1
+        else:
+            self.keys += 1
+            self.bytes += len(key) + len(value or '')
+
+        info = self.keyspace.parse(key)
+        if info is None or info.name is None:
+            return
+        kind = info.kind
+        if kind == KIND_UPSTREAM:
+            if info.field is None:
+                # Make sure upstreams without nodes are counted
+                self.nodes_per_upstream[info.name] += 0
+                if expiring:
+                    self.expiring_upstreams.add(info.name)
+        elif kind == KIND_ENDPOINT:
+            if info.child is not None and info.field is None and not is_dir:
+                self.nodes_per_upstream[info.name] += 1
+                if expiring:
+                    self.expiring_nodes_per_upstream[info.name] += 1
+        elif kind in HOST_KINDS:
+            self.hosts.add(info.name)
+            if kind == KIND_LOCATION and info.child is not None and \
+                    info.field is None:
+                self.locations += 1
+        elif kind == KIND_PROXY_NODE:
+            if info.field is None and not is_dir:
+                self.proxy_nodes += 1
+        elif kind == KIND_LISTENER:
+            self.tcp_listeners.add(info.name)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another tree (e.g. another shard). The etcd
+        index is not merged, as indexes of different trees can not be
+        compared.
+
+        :param other: Statistics to be added
+        :type other: ClusterStats
+        :return: self
+        :rtype: ClusterStats
+        """
+        self.keys += other.keys
+        self.dirs += other.dirs
+        self.bytes += other.bytes
+        for upstream, count in other.nodes_per_upstream.items():
+            self.nodes_per_upstream[upstream] += count
+        for upstream, count in other.expiring_nodes_per_upstream.items():
+            self.expiring_nodes_per_upstream[upstream] += count
+        self.expiring_upstreams.update(other.expiring_upstreams)
+        self.hosts.update(other.hosts)
+        self.locations += other.locations
+        self.tcp_listeners.update(other.tcp_listeners)
+        self.proxy_nodes += other.proxy_nodes
+        return self
+
+    @property
+    def upstreams(self):
+        return len(self.nodes_per_upstream)
+
+    @property
+    def nodes(self):
+        return sum(self.nodes_per_upstream.values())
+
+    @property
+    def expiring_nodes(self):
+        return sum(self.expiring_nodes_per_upstream.values())
+
+    @property
+    def empty_upstreams(self):
+        return sorted(upstream for upstream, count
+                      in self.nodes_per_upstream.items() if not count)
+
+    def to_dict(self):
+        return {
+            'etcd_index': self.etcd_index,
+            'keys': self.keys,
+            'dirs': self.dirs,
+            'bytes': self.bytes,
+            'upstreams': self.upstreams,
+            'nodes': self.nodes,
+            'nodes_per_upstream': dict(self.nodes_per_upstream),
+            'expiring_within': self.expiring_within,
+            'expiring_nodes': self.expiring_nodes,
+            'expiring_nodes_per_upstream':
+                dict(self.expiring_nodes_per_upstream),
+            'expiring_upstreams': sorted(self.expiring_upstreams),
+            'empty_upstreams': self.empty_upstreams,
+            'hosts': len(self.hosts),
+            'locations': self.locations,
+            'tcp_listeners': len(self.tcp_listeners),
+            'proxy_nodes': self.proxy_nodes,
+        }
+
+    def to_metrics(self, prefix='yoda'):
+        """
+        Gets the statistics as flat gauges, suitable for exporting to
+        metrics systems (statsd, prometheus etc).
+
+        :keyword prefix: Prefix for metric names. (Default: 'yoda')
+        :type prefix: str
+        :return: Dictionary of metric name to numeric value. e.g.:
+            {
+                'yoda.nodes': 10,
+                'yoda.upstream.upstream1.nodes': 2,
+                ...
+            }
+        :rtype: dict
+        """
+        metrics = dict(('%s.%s' % (prefix, name), value) for name, value in (
+            ('keys', self.keys),
+            ('dirs', self.dirs),
+            ('bytes', self.bytes),
+            ('upstreams', self.upstreams),
+            ('upstreams.empty', len(self.empty_upstreams)),
+            ('upstreams.expiring', len(self.expiring_upstreams)),
+            ('nodes', self.nodes),
+            ('nodes.expiring', self.expiring_nodes),
+            ('hosts', len(self.hosts)),
+            ('locations', self.locations),
+            ('tcp_listeners', len(self.tcp_listeners)),
+            ('proxy_nodes', self.proxy_nodes),
+        ))
+        for upstream, count in self.nodes_per_upstream.items():
+            metrics['%s.upstream.%s.nodes' % (prefix, upstream)] = count
+            metrics['%s.upstream.%s.nodes.expiring' % (prefix, upstream)] = \
+                self.expiring_nodes_per_upstream.get(upstream, 0)
+        return metrics
@@ -0,0 +1,237 @@
+"""
+Streaming reads for large yoda trees.
+
+Children of an etcd directory are decoded one at a time from the HTTP
+response, so peak memory is bounded by a single record (plus the parser
+buffer) rather than the complete tree. Incremental parsing requires the
+optional `ijson` package (`pip install yoda-py[stream]`). Without it, a
+RuntimeWarning is issued and the response is decoded in one go.
+"""
+import json
+import os.path
+import socket
+import warnings
+
+__author__ = 'sukrit'
+
+# Parser events for scalar JSON values
+SCALAR_EVENTS = ('string', 'number', 'boolean', 'null')
+
+
+def _load_ijson():
+    # Imported lazily so that importing yoda stays cheap.
+    try:
+        import ijson
+    except ImportError:  # pragma: no cover
+        return None
+    return ijson
+
+
+def node_to_tree(node):
+    """
+    Converts raw etcd node (as returned by etcd API) into nested dictionary
+    of values keyed by relative key names.
+
+    :param node: Raw etcd node
+    :type node: dict
+    :return: Value for leaf node or nested dictionary for directory node.
+    """
+    if not node.get('dir'):
+        return node.get('value')
+    return dict((os.path.basename(child['key']), node_to_tree(child))
+                for child in node.get('nodes') or [])
+
+
+def iter_leaves(node):
+    """
+    Iterates over all leaf (non directory) nodes for a raw etcd node.
+
+    :param node: Raw etcd node
+    :type node: dict
+    :return: Generator of raw leaf nodes
+    """
+    if not node.get('dir'):
+        yield node
+        return
+    for child in node.get('nodes') or []:
+        for leaf in iter_leaves(child):
+            yield leaf
+
+
+def iter_nodes(node):
+    """
+    Iterates over a raw etcd node and all nodes (including directories) in
+    its subtree.
+
+    :param node: Raw etcd node
+    :type node: dict
+    :return: Generator of raw nodes
+    """
+    yield node
+    for child in node.get('nodes') or []:
+        for descendant in iter_nodes(child):
+            yield descendant
+
+
+def open_children(etcd_cl, key, recursive=True, timeout=None, **params):
+    """
+    Starts a streaming read for an etcd directory. Only the response headers
+    are read, the body is decoded by :func:`iter_response_children`. Errors
+    are raised as the corresponding etcd errors, so that the read can be
+    made (and retried) like any other etcd call (see
+    :meth:`yoda.client.Client._etcd_op`).
+
+    :param etcd_cl: Etcd client
+    :type etcd_cl: etcd.Client
+    :param key: Etcd directory key
+    :type key: str
+    :keyword recursive: If True, children include their complete subtree.
+        (Default: True)
+    :type recursive: bool
+    :keyword timeout: Timeout (in seconds) for the request.
+        (Default: read_timeout of etcd client)
+    :type timeout: float
+    :keyword params: Additional read options (e.g. quorum=True)
+    :return: HTTP response with `etcd_index` attribute
+    :raises etcd.EtcdKeyNotFound: If key does not exist.
+    :raises etcd.EtcdConnectionFailed: If etcd can not be reached.
+    :raises etcd.EtcdException: If etcd fails the request.
+    """
+    # Imported lazily, as etcd (with urllib3) is slow to import
+    import etcd
+    import urllib3
+    try:
+        from http.client import HTTPException
+    except ImportError:  # pragma: no cover
+        from httplib import HTTPException
+    fields = {'recursive': 'true' if recursive else 'false'}
+    for name, value in params.items():
+        fields[name] = ('true' if value else 'false') \
+            if isinstance(value, bool) else value
+    try:
+        response = etcd_cl.http.request(
+            'GET', '%s%s%s' % (etcd_cl.base_uri, etcd_cl.key_endpoint, key),
+            fields=fields, headers=etcd_cl._get_headers(),
+            timeout=timeout or etcd_cl.read_timeout or None,
+            preload_content=False)
+    except (urllib3.exceptions.HTTPError, HTTPException,
+            socket.error) as error:
+        raise etcd.EtcdConnectionFailed(
+            'Connection to etcd failed due to %r' % error, cause=error)
+    index = (getattr(response, 'headers', None) or {}).get('x-etcd-index')
+    index = int(index) if index else None
+    if response.status != 200:
+        try:
+            body = response.read()
+        finally:
+            response.release_conn()
+        if response.status == 404:
+            raise etcd.EtcdKeyNotFound('Key not found : %s' % key,
+                                       {'errorCode': 100, 'index': index})
+        raise etcd.EtcdException(
+            'Failed to read %s: %s %s' % (key, response.status, body))
+    response.etcd_index = index
+    return response
+
+
+def _without_children(node):
+    return dict((name, value) for name, value in node.items()
+                if name != 'nodes')
+
+
+def _parse_children(ijson, response, depth, parents):
+    item_prefix = 'node' + '.nodes.item' * depth
+    if not parents:
+        for child in ijson.items(response, item_prefix):
+            yield child
+        return
+    parent_prefixes = set('node' + '.nodes.item' * level
+                          for level in range(1, depth))
+    open_parents = []
+    builder = None
+    for prefix, event, value in ijson.parse(response):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == item_prefix and event == 'end_map':
+                yield builder.value
+                builder = None
+        elif prefix == item_prefix and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix in parent_prefixes:
+            if event == 'start_map':
+                open_parents.append(dict())
+            elif event == 'end_map':
+                yield open_parents.pop()
+        elif event in SCALAR_EVENTS:
+            parent_prefix, _, name = prefix.rpartition('.')
+            if parent_prefix in parent_prefixes:
+                open_parents[-1][name] = value
+
+
+def iter_response_children(response, depth=1, parents=False):
+    """
+    Decodes children from the response of :func:`open_children` one at a
+    time. The connection is released once the children are consumed.
+
+    :param response: HTTP response
+    :keyword depth: Depth of the streamed children relative to the read
+        key. e.g.: depth 2 for '/yoda' streams '/yoda/upstreams/<upstream>',
+        '/yoda/hosts/<hostname>' etc. (Default: 1)
+    :type depth: int
+    :keyword parents: If True, nodes between the read key and depth (e.g.
+        '/yoda/upstreams' and '/yoda/generation' for depth 2 of '/yoda') are
+        yielded as well, without their children. (Default: False)
+    :type parents: bool
+    :return: Generator of raw etcd nodes (dict)
+    """
+    ijson = _load_ijson()
+    try:
+        if ijson:
+            for child in _parse_children(ijson, response, depth, parents):
+                yield child
+        else:
+            warnings.warn(
+                'ijson is not installed (pip install yoda-py[stream]). '
+                'Streamed etcd response is decoded in one go, so memory is '
+                'not bounded.', RuntimeWarning)
+            children = [json.loads(response.read().decode('utf-8'))
+                        .get('node', {})]
+            for level in range(1, depth + 1):
+                children = [child for parent in children
+                            for child in parent.get('nodes') or []]
+                if parents and level < depth:
+                    for child in children:
+                        yield _without_children(child)
+            for child in children:
+                yield child
+    finally:
+        response.release_conn()
+
+
+def iter_children(etcd_cl, key, recursive=True, depth=1):
+    """
+    Streams children of an etcd directory using a single request (without
+    retries). Use the streaming methods of :class:`yoda.client.Client` for
+    reads with retries, deadlines and read consistency.
+
+    :param etcd_cl: Etcd client
+    :type etcd_cl: etcd.Client
+    :param key: Etcd directory key
+    :type key: str
+    :keyword recursive: If True, children include their complete subtree.
+        (Default: True)
+    :type recursive: bool
+    :keyword depth: Depth of the streamed children relative to key.
+        (Default: 1)
+    :type depth: int
+    :return: Generator of raw etcd nodes (dict). Nothing is yielded if the
+        key does not exist.
+    """
+    import etcd
+    try:
+        response = open_children(etcd_cl, key, recursive=recursive)
+    except etcd.EtcdKeyNotFound:
+        return
+    for child in iter_response_children(response, depth=depth):
+        yield child
@@ -0,0 +1,312 @@
+"""
+Optional tracing for yoda operations.
+
+When a :class:`Tracer` is passed to :class:`yoda.client.Client`, a span is
+recorded for every public client method, with a child span for every etcd
+request made by it. Finished spans are handed to a pluggable exporter (e.g.
+:class:`JsonFileExporter` or :class:`OpenTelemetryExporter`).
+
+Sampling is decided once per trace (at the root span). Spans for traces that
+are not sampled are not created at all, so the overhead at low sample rates
+is negligible.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+import json
+import random
+import threading
+import time
+
+__author__ = 'sukrit'
+
+DEFAULT_SAMPLE_RATE = 1.0
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+
+
+class SpanContext(namedtuple('SpanContext', 'trace_id, span_id, sampled')):
+    """
+    Identifies a span (e.g. a parent span from another process). Ids are hex
+    encoded as in W3C trace context.
+    """
+
+    @classmethod
+    def from_traceparent(cls, traceparent):
+        """
+        Parses W3C `traceparent` header. e.g.:
+        '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+        :param traceparent: Value for traceparent header
+        :type traceparent: str
+        :rtype: SpanContext
+        :raises ValueError: If header is invalid.
+        """
+        parts = traceparent.strip().split('-')
+        if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            raise ValueError('Invalid traceparent: %s' % traceparent)
+        return cls(parts[1], parts[2], bool(int(parts[3], 16) & 1))
+
+    @property
+    def context(self):
+        return self
+
+    @property
+    def traceparent(self):
+        return '00-%s-%s-%s' % (self.trace_id, self.span_id,
+                                '01' if self.sampled else '00')
+
+
+class _NoopSpan(object):
+    """
+    Span used for traces that are not sampled (or when tracing is
+    disabled). It can be used directly as a context manager.
+    """
+    __slots__ = ()
+    sampled = False
+    context = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    Timed operation within a trace.
+    """
+    sampled = True
+
+    def __init__(self, name, trace_id, span_id, parent_id=None,
+                 attributes=None, start=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = start
+        self.end = None
+        self.status = STATUS_OK
+        self.error = None
+
+    @property
+    def context(self):
+        return SpanContext(self.trace_id, self.span_id, True)
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = STATUS_ERROR
+        self.error = '%s: %s' % (type(error).__name__, error)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class JsonFileExporter:
+    """
+    Appends finished spans to a local file as newline delimited JSON.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path for the spans file
+        :type path: str
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        line = json.dumps(span.to_dict(), sort_keys=True, default=str)
+        with self._lock:
+            with open(self.path, 'a') as spans_file:
+                spans_file.write(line + '\n')
+
+
+class OpenTelemetryExporter:
+    """
+    Re-creates spans using OpenTelemetry API (requires `opentelemetry-api`).
+    Spans are started as children of the corresponding OpenTelemetry spans,
+    so traces are stitched together with spans from other instrumented
+    libraries.
+    """
+
+    def __init__(self, tracer_provider=None):
+        """
+        :keyword tracer_provider: OpenTelemetry tracer provider. If None,
+            global tracer provider is used.
+        """
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer('yoda',
+                                        tracer_provider=tracer_provider)
+        self._spans = dict()
+        self._lock = threading.Lock()
+
+    def _parent_context(self, span):
+        trace = self._trace
+        with self._lock:
+            parent = self._spans.get(span.parent_id)
+        if parent is None and span.parent_id:
+            # Remote parent
+            parent = trace.NonRecordingSpan(trace.SpanContext(
+                int(span.trace_id, 16), int(span.parent_id, 16),
+                is_remote=True, trace_flags=trace.TraceFlags(1)))
+        return trace.set_span_in_context(parent) if parent else None
+
+    def on_start(self, span):
+        otel_span = self._tracer.start_span(
+            span.name, context=self._parent_context(span),
+            attributes=span.attributes, start_time=int(span.start * 1e9))
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span):
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        otel_span.set_attributes(span.attributes)
+        if span.status == STATUS_ERROR:
+            otel_span.set_status(self._trace.Status(
+                self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int(span.end * 1e9))
+
+
+class Tracer:
+    """
+    Creates spans and hands them over to the exporter.
+    """
+
+    def __init__(self, exporter, sample_rate=DEFAULT_SAMPLE_RATE,
+                 clock=time.time):
+        """
+        :param exporter: Exporter for the spans. Must implement on_start and
+            on_end (invoked with :class:`Span`).
+        :keyword sample_rate: Fraction of traces that are recorded (e.g. 0.01
+            for 1%). (Default: DEFAULT_SAMPLE_RATE)
+        :type sample_rate: float
+        :keyword clock: Clock used for timing spans. (Default: time.time)
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.clock = clock
+        self._local = threading.local()
+
+    def current_span(self):
+        """
+        :return: Active span (or remote parent context) for current thread.
+        """
+        return getattr(self._local, 'span', None)
+
+    @contextmanager
+    def activate(self, span):
+        """
+        Makes span (or span context) the parent for spans created in the
+        current thread within the context. Used for propagating the parent
+        to worker threads and for external (remote) parents.
+
+        Usage:
+
+            parent = SpanContext.from_traceparent(headers['traceparent'])
+            with tracer.activate(parent):
+                client.wire_proxy(host)
+
+        :param span: Span or SpanContext
+        """
+        previous = self.current_span()
+        self._local.span = span
+        try:
+            yield span
+        finally:
+            self._local.span = previous
+
+    def _sample(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def start_span(self, name, attributes=None, parent=None):
+        """
+        Starts a span. The span must be finished using :meth:`end_span`.
+
+        :param name: Name for the span
+        :type name: str
+        :keyword attributes: Attributes for the span
+        :type attributes: dict
+        :keyword parent: Parent span or span context. (Default: Active span
+            for current thread)
+        :return: Span or NOOP_SPAN if the trace is not sampled.
+        """
+        if parent is None:
+            parent = self.current_span()
+        if parent is None:
+            if not self._sample():
+                return NOOP_SPAN
+            trace_id, parent_id = '%032x' % random.getrandbits(128), None
+        elif not parent.sampled:
+            return NOOP_SPAN
+        else:
+            context = parent.context
+            trace_id, parent_id = context.trace_id, context.span_id
+        span = Span(name, trace_id, '%016x' % random.getrandbits(64),
+                    parent_id=parent_id, attributes=attributes,
+                    start=self.clock())
+        self.exporter.on_start(span)
+        return span
+
+    def end_span(self, span):
+        if span is NOOP_SPAN:
+            return
+        span.end = self.clock()
+        self.exporter.on_end(span)
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        """
+        Records a span for the context. The span is active (i.e. parent of
+        other spans in the current thread) within the context.
+
+        :param name: Name for the span
+        :type name: str
+        :keyword attributes: Attributes for the span
+        :type attributes: dict
+        :return: Span (or NOOP_SPAN if the trace is not sampled)
+        """
+        span = self.start_span(name, attributes=attributes)
+        with self.activate(span):
+            try:
+                yield span
+            except Exception as error:
+                span.record_error(error)
+                raise
+            finally:
+                self.end_span(span)
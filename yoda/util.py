@@ -2,6 +2,14 @@
 General utility methods
 """
 import copy
+import threading
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+DEFAULT_MAX_WORKERS = 8
 
 
 def dict_merge(*dictionaries):
@@ -33,3 +41,78 @@ def dict_merge(*dictionaries):
         merged_dict = merge(merged_dict, copy.deepcopy(merge_with or {}))
 
     return merged_dict
+
+
+def parallel_map(func, items, max_workers=DEFAULT_MAX_WORKERS,
+                 return_exceptions=False):
+    """
+    Applies func to every item using a bounded pool of threads.
+
+    :param func: Function to be applied to each item
+    :param items: Iterable of items
+    :keyword max_workers: Maximum number of concurrent threads.
+        (Default: DEFAULT_MAX_WORKERS)
+    :type max_workers: int
+    :keyword return_exceptions: If True, exception raised for an item is
+        returned in place of its result. Otherwise the first exception (in
+        item order) is re-raised once all items are processed.
+        (Default: False)
+    :type return_exceptions: bool
+    :return: List of results in the same order as items
+    :rtype: list
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = {}
+    if not items:
+        return results
+    pending = queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception as exc:
+                errors[index] = exc
+
+    workers = [threading.Thread(target=worker)
+               for _ in range(min(max(max_workers, 1), len(items)))]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    for index in sorted(errors):
+        if not return_exceptions:
+            raise errors[index]
+        results[index] = errors[index]
+    return results
+
+
+def split_failures(names, results):
+    """
+    Splits results returned by :func:`parallel_map` (with
+    return_exceptions=True) into successful results and failures.
+
+    :param names: Names for the items (in same order as results)
+    :type names: list
+    :param results: Results for the items
+    :type results: list
+    :return: Tuple of dictionary of name to result and dictionary of name to
+        exception.
+    :rtype: tuple
+    """
+    successes, failures = dict(), dict()
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            failures[name] = result
+        else:
+            successes[name] = result
+    return successes, failures
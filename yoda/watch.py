@@ -0,0 +1,185 @@
+"""
+Resumable watches over the yoda tree.
+
+The index of the last processed event is checkpointed to local storage, so
+that a restarted consumer resumes watching from where it left off instead of
+re-reading the complete tree. A snapshot is only taken when there is no
+checkpoint or when etcd reports that the checkpointed index has been
+compacted away.
+"""
+from collections import namedtuple
+import logging
+import os
+import time
+import etcd
+
+__author__ = 'sukrit'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCH_TIMEOUT = 60
+
+# Delay (in seconds) before the n-th consecutive snapshot (n > 1) is
+# SNAPSHOT_BASE_DELAY * 2 ^ (n - 2), capped at SNAPSHOT_MAX_DELAY
+SNAPSHOT_BASE_DELAY = 1.0
+SNAPSHOT_MAX_DELAY = 60.0
+
+WatchEvent = namedtuple('WatchEvent',
+                        'action, key, value, modified_index, is_dir')
+
+
+class FileCheckpoint:
+    """
+    Stores the etcd index in a local file. Writes are atomic.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path for the checkpoint file
+        :type path: str
+        """
+        self.path = path
+
+    def load(self):
+        """
+        Loads the checkpointed index.
+
+        :return: Checkpointed index or None if checkpoint does not exist.
+        :rtype: int
+        """
+        try:
+            with open(self.path) as checkpoint_file:
+                return int(checkpoint_file.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, index):
+        """
+        Saves the index.
+
+        :param index: Etcd index to be checkpointed
+        :type index: int
+        :return: None
+        """
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as checkpoint_file:
+            checkpoint_file.write(str(index))
+        os.rename(tmp_path, self.path)
+
+
+class ResumableWatcher:
+    """
+    Watches the yoda tree with at-least-once delivery. An event is
+    checkpointed only after the consumer has processed it, and events at or
+    below the last processed index are skipped. Consumers that process
+    events asynchronously (e.g. :class:`yoda.events.ChangeStream`) disable
+    auto_commit and checkpoint processed events using :meth:`commit`.
+
+    Snapshots taken back to back (i.e. without a successful watch in
+    between) are delayed with exponential backoff, so that a watch that keeps
+    failing does not turn into a loop of full tree reads.
+    """
+
+    def __init__(self, client, checkpoint, on_snapshot=None,
+                 timeout=DEFAULT_WATCH_TIMEOUT, auto_commit=True):
+        """
+        :param client: Yoda client
+        :type client: yoda.client.Client
+        :param checkpoint: Checkpoint store (e.g. :class:`FileCheckpoint`)
+        :param on_snapshot: Callable invoked with (tree, etcd_index) when a
+            full snapshot is taken. (Default: None)
+        :keyword timeout: Timeout (in seconds) for a single watch request.
+            (Default: DEFAULT_WATCH_TIMEOUT)
+        :type timeout: int
+        :keyword auto_commit: If True, an event (or snapshot) is
+            checkpointed once the consumer requests the next event. If
+            False, the consumer must call :meth:`commit`. (Default: True)
+        :type auto_commit: bool
+        """
+        self.client = client
+        self.checkpoint = checkpoint
+        self.on_snapshot = on_snapshot
+        self.timeout = timeout
+        self.auto_commit = auto_commit
+        self.index = None
+        self._snapshots = 0
+        self._sleep = time.sleep
+
+    def commit(self, index):
+        """
+        Checkpoints the index of the last processed event (or snapshot).
+
+        :param index: Etcd index
+        :type index: int
+        :return: None
+        """
+        self.checkpoint.save(index)
+
+    def _snapshot(self):
+        if self._snapshots:
+            self._sleep(min(SNAPSHOT_BASE_DELAY * 2 ** (self._snapshots - 1),
+                            SNAPSHOT_MAX_DELAY))
+        self._snapshots += 1
+        tree, etcd_index = self.client.read_tree()
+        if self.on_snapshot:
+            self.on_snapshot(tree, etcd_index)
+        self.index = etcd_index or 0
+        if self.auto_commit:
+            self.checkpoint.save(self.index)
+
+    def _wait(self):
+        # Without an index (e.g. snapshot of a missing tree), watch for the
+        # next change.
+        return self.client.watch(index=self.index + 1 if self.index else None,
+                                 timeout=self.timeout)
+
+    def events(self, stop=None, until_idle=False):
+        """
+        Generator of watch events. Resumes from the checkpointed index.
+
+        :keyword stop: Optional event (e.g. threading.Event). Watch stops
+            once it is set.
+        :keyword until_idle: If True, watch stops once a watch request times
+            out, i.e. once the consumer has caught up with all changes.
+            (Default: False)
+        :type until_idle: bool
+        :return: Generator of :class:`WatchEvent`
+        """
+        self.index = self.checkpoint.load()
+        if self.index is None:
+            self._snapshot()
+        while not (stop and stop.is_set()):
+            try:
+                result = self._wait()
+            except etcd.EtcdWatchTimedOut:
+                self._snapshots = 0
+                if until_idle:
+                    return
+                continue
+            except etcd.EtcdEventIndexCleared:
+                logger.info('Etcd index %s was compacted. Taking snapshot',
+                            self.index)
+                self._snapshot()
+                continue
+            self._snapshots = 0
+            modified_index = result.modifiedIndex
+            if modified_index is None or modified_index <= self.index:
+                # Duplicate delivery
+                continue
+            yield WatchEvent(result.action, result.key, result.value,
+                             modified_index, bool(result.dir))
+            self.index = modified_index
+            if self.auto_commit:
+                self.checkpoint.save(modified_index)
+
+    def run(self, handler, stop=None):
+        """
+        Invokes handler for every watch event.
+
+        :param handler: Callable invoked with :class:`WatchEvent`
+        :keyword stop: Optional event (e.g. threading.Event). Watch stops
+            once it is set.
+        :return: None
+        """
+        for event in self.events(stop=stop):
+            handler(event)